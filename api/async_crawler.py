@@ -0,0 +1,220 @@
+"""Asyncio crawl engine running many name x platform searches in one event loop."""
+from __future__ import annotations
+import asyncio
+import concurrent.futures
+import os
+import time
+from itertools import islice
+from typing import TYPE_CHECKING
+
+from cacher import Cacher, Checkpoint, RetryList
+from custom_logger import CrawlerLogger
+from freshness import AsyncCrawlLog
+from mongo import MongoDBConnector
+from sinks import sink_from_env
+from rate_limiter import ThrottledError
+from scheduler import Watermark
+from seen_set import async_seen_set_from_env
+from serp_crawler import SearchResult, query_planner
+from session_pool import SessionPool
+
+if TYPE_CHECKING:
+    import logging
+
+
+class CrawlEngine:
+    """Run name x platform searches concurrently in a single event loop."""
+
+    def __init__(self, platforms: list[str], concurrency: int = 200, country: str = 'Sweden', window_size: int = 50):
+        """Initialize the engine."""
+        self.platforms = platforms
+        self.concurrency = concurrency
+        self.window_size = window_size
+        self.retries = int(os.getenv('RATE_LIMIT_RETRIES', 5))
+        self.country = country
+        self.cacher = Cacher(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        self.mongo = MongoDBConnector()
+        self.buffer = sink_from_env(self.mongo)
+        self.sessions = SessionPool(max_sessions=concurrency)
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='search')
+        self.logger: logging.Logger = CrawlerLogger()
+        self._watermarks: dict[str, Watermark] = {}
+        self._checkpoints: dict[str, Checkpoint] = {}
+        self._done_keys: dict[str, set[str]] = {platform: set() for platform in platforms}
+        self._done_names: dict[str, list[str]] = {platform: [] for platform in platforms}
+        self._written: list[tuple[str, int | None]] = []
+        self._retries: dict[str, RetryList] = {}
+        self._retried: dict[str, set[str]] = {}
+        self._crawl_logs = {platform: AsyncCrawlLog(self.cacher, platform, country) for platform in platforms}
+        # Keyed per platform like the other crawlers, so they share what was searched
+        self.seen = {platform: async_seen_set_from_env(self.cacher, platform) for platform in platforms}
+
+    async def search_query_platform(self, fullname: str, platform: str) -> list[dict]:
+        """Run every query of a platform for one name and keep the filtered results."""
+        # DDGS is synchronous, its network waits are spread over the engine's threads
+        loop = asyncio.get_running_loop()
+        result, urls = [], set()
+        # Planning and recording may touch Redis, keep them off the loop too
+        querys, stop_early = await asyncio.to_thread(query_planner.plan, platform)
+        for query in querys:
+            start = time.perf_counter()
+            raw = await loop.run_in_executor(self.executor, SearchResult.search_query_raw, fullname, query, self.sessions)
+            found = SearchResult.text_results(raw, platform)
+            new = {r['url'] for r in found} - urls
+            urls |= new
+            result.extend(found)
+            await asyncio.to_thread(
+                query_planner.record, platform, query, len(raw), len(found), len(new), time.perf_counter() - start
+            )
+            if stop_early and query_planner.saturated(len(result), len(new)):
+                break
+        return result
+
+    async def save(self, result: list[dict], full_name: str, index: int | None, platform: str):
+        """Buffer results for MongoDB without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        # Flushes run on a worker thread, the name is handed back to the loop
+        await asyncio.to_thread(
+            self.buffer.add, 'scrapped_profiles_v2', result, 'url',
+            on_flush=lambda: loop.call_soon_threadsafe(self.written, full_name, index, platform)
+        )
+
+    def written(self, full_name: str, index: int | None, platform: str):
+        """Record a name whose results were written, called on the event loop."""
+        self._done_keys[platform].add(f"{full_name.lower()}:{platform}:v2")
+        self._done_names[platform].append(full_name)
+        self._written.append((platform, index))
+
+    async def mark_done(self):
+        """Flag every name whose results were written in one pipeline."""
+        for platform, retry in self._retries.items():
+            done_keys, self._done_keys[platform] = self._done_keys[platform], set()
+            names, self._done_names[platform] = self._done_names[platform], []
+            await self.seen[platform].add_many(done_keys)
+            await self._crawl_logs[platform].touch(names)
+            await retry.remove([full_name for full_name in names if full_name in self._retried[platform]])
+
+    async def settle(self):
+        """Move the checkpoints past the names whose results were written since the last call."""
+        written, self._written = self._written, []
+        for platform, index in written:
+            await self.complete(platform, index)
+
+    async def complete(self, platform: str, index: int | None):
+        """Record a finished name and move the checkpoint when it is due, retried names have no index."""
+        watermark = self._watermarks[platform]
+        if index is not None and watermark.complete(index) and await self._checkpoints[platform].advance(watermark.value):
+            await self.mark_done()
+
+    async def process(self, full_name: str, index: int | None, platform: str):
+        """Search one name on one platform, persist the result and checkpoint."""
+        combined_key = f"{full_name.lower()}:{platform}:v2"
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self.search_query_platform(full_name, platform)
+            except ThrottledError as ex:
+                # Retried once the limiter's backoff is over
+                self.logger.warning(f'Throttled on {combined_key}, attempt {attempt + 1}: {ex}')
+                continue
+            except Exception as ex:
+                self.logger.error(f'Error in search result {combined_key}: {ex}')
+                result = []
+            await self.save(result, full_name, index, platform)
+            # The checkpoint moves once the results are written, not when they are buffered
+            await self.settle()
+            return
+        # The checkpoint moves on, the next run searches the name first
+        self.logger.error(f'Giving up on {combined_key}, it goes to the retry list.')
+        await self._retries[platform].add([full_name])
+        await self.complete(platform, index)
+
+    async def tasks(self, limit: int):
+        """Interleave the name streams of all platforms, skipping searched names."""
+        generators = {}
+        source = SearchResult.name_source()
+        for platform in self.platforms:
+            # Every name source keeps its own resume point, as in the other crawlers
+            key = [f'{self.country}:{platform}', *source.checkpoint_suffix]
+            start = await self.cacher.get(key) or 0
+            self._watermarks[platform] = Watermark(start)
+            self._checkpoints[platform] = Checkpoint(self.cacher, key)
+            generators[platform] = islice(source.iter_names(start), limit)
+            self._retries[platform] = RetryList(self.cacher, ':'.join(key))
+            self._retried[platform] = set(await self._retries[platform].pending())
+
+        for platform, retried in self._retried.items():
+            for full_name in retried:
+                yield full_name, None, platform
+
+        while generators:
+            for platform in list(generators):
+                window = list(islice(generators[platform], self.window_size))
+                if not window:
+                    del generators[platform]
+                    continue
+                # One lookup checks the whole window
+                keys = [f"{full_name.lower()}:{platform}:v2" for full_name, _ in window]
+                unseen = await self.seen[platform].filter_unseen(keys)
+                for (full_name, index), is_new in zip(window, unseen):
+                    if is_new:
+                        yield full_name, index, platform
+                    else:
+                        await self.complete(platform, index)
+
+    async def run(self, limit: int = 100000):
+        """Crawl up to `limit` names per platform with bounded concurrency."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending: set[asyncio.Task] = set()
+
+        async def bounded(*args):
+            try:
+                await self.process(*args)
+            finally:
+                semaphore.release()
+
+        await asyncio.to_thread(self.mongo.connect)
+        try:
+            async with self.cacher:
+                async for full_name, index, platform in self.tasks(limit):
+                    await semaphore.acquire()
+                    task = asyncio.create_task(bounded(full_name, index, platform))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                if pending:
+                    await asyncio.gather(*pending)
+                await asyncio.to_thread(self.buffer.close)
+                await self.settle()
+                await self.mark_done()
+                for seen in self.seen.values():
+                    await seen.close()
+                for checkpoint in self._checkpoints.values():
+                    await checkpoint.flush()
+        finally:
+            await asyncio.to_thread(query_planner.flush)
+            self.executor.shutdown()
+            self.sessions.close()
+            await asyncio.to_thread(self.mongo.disconnect)
+
+
+def run_engine(platforms: list[str]):
+    """Run a crawl engine for a group of platforms in its own event loop."""
+    concurrency = int(os.getenv('CRAWLER_CONCURRENCY', 200))
+    engine = CrawlEngine(platforms, concurrency=concurrency)
+    asyncio.run(engine.run())
+
+
+def main():
+    # A handful of processes is enough, each one multiplexes hundreds of searches.
+    max_processes = int(os.getenv('CRAWLER_PROCESSES', 2))
+    targets = ["facebook", "linkedin", "twitter", "tiktok", "instagram"]
+    groups = [targets[i::max_processes] for i in range(max_processes)]
+    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+        results = [executor.submit(run_engine, group) for group in groups if group]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,722 @@
+"""Offline benchmark of the crawler against local stand-ins for DDGS, Redis and MongoDB.
+
+    python benchmark.py run --names 2000 --latency 0.05 --error-rate 0.01
+    python benchmark.py search --platform linkedin --names 500
+    python benchmark.py filters --names 20000
+    CRAWLER_MODE=combined python benchmark.py run --names 500
+    CRAWLER_ORDER=priority python benchmark.py run --names 500
+
+`run` drives `SearchResult.run` end to end, `search` only calls
+`SearchResult.search_query_platform`. Both report names per second, p50/p99
+latency per name, peak memory and Redis/MongoDB round trips per name.
+`--passes` repeats the names, later passes are answered by the query cache.
+`--callers` searches every name from that many threads at once, the
+duplicates wait on the first search instead of going upstream.
+`filters` times the legacy per-platform URL filters against the compiled
+classifier on generated result URLs and counts verdicts that differ.
+"""
+from __future__ import annotations
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import re
+import resource
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Iterator
+
+import httpx
+
+import serp_crawler
+from filter import PLATFORM_RULES, classifier, platform_filters
+from frontier import POP_SCRIPT, REQUEUE_SCRIPT
+from mongo import MongoDBConnector
+from name_source import name_resources
+from query_cache import QueryCache
+from query_planner import QueryPlanner
+from rate_limiter import RateLimiterRegistry
+from serp_crawler import SearchResult
+from session_pool import SessionPool
+from single_flight import SingleFlight
+from synccacher import Cacher
+
+
+class Stats:
+    """Counters shared by the stand-ins."""
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.redis_round_trips = 0
+        self.mongo_round_trips = 0
+        self.searches = 0
+        self.latencies: list[float] = []
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1):
+        """Increment a counter."""
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+
+class FakeDDGS:
+    """A DDGS stand-in answering after a configurable latency.
+
+    Results are derived from the `site:` of the query, half of them look like
+    profiles and pass the platform filters. `error_rate` raises a generic
+    error and `throttle_rate` the empty HTTPError DDGS raises on its 202
+    rate limit page.
+    """
+
+    def __init__(self, stats: Stats, latency: float = 0.05, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, results: int = 10):
+        """Initialize the stand-in."""
+        self.stats = stats
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.results = results
+
+    def _answer(self, keywords: str) -> Iterator[tuple[str, str, str]]:
+        """Wait, fail at random, then yield (title, url, body) tuples."""
+        self.stats.count('searches')
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        draw = random.random()
+        if draw < self.throttle_rate:
+            raise httpx.HTTPError('')
+        if draw < self.throttle_rate + self.error_rate:
+            raise RuntimeError('Fake search failure')
+
+        site = re.search(r'site:(\S+)', keywords)
+        host = site.group(1).rstrip('/') if site else 'example.com'
+        name = re.sub(r'site:\S+|profile|@', '', keywords).strip()
+        slug = ('@' if '@' in keywords else '') + re.sub(r'\W+', '', name.title())
+        for i in range(self.results):
+            path = f'{slug}{i}' if i % 2 == 0 else f'{slug}{i}/posts/{i}'
+            yield name, f'https://www.{host}/{path}', f'{name} profile {i}'
+
+    def text(self, keywords: str, region: str = 'wt-wt', **kwargs) -> Iterator[dict[str, str]]:
+        """Yield text results."""
+        for title, url, body in self._answer(keywords):
+            yield {'title': title, 'href': url, 'body': body}
+
+    def images(self, keywords: str, region: str = 'wt-wt', **kwargs) -> Iterator[dict[str, str]]:
+        """Yield image results."""
+        for title, url, _ in self._answer(keywords):
+            yield {'title': title, 'image': f'{url}.jpg', 'thumbnail': f'{url}.jpg', 'url': url,
+                   'height': 100, 'width': 100, 'source': 'Bing'}
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit the context manager."""
+
+
+class FakeJSON:
+    """The RedisJSON commands used by the cachers."""
+
+    def __init__(self, redis: FakeRedis):
+        """Initialize the commands."""
+        self.redis = redis
+
+    def get(self, key: str, *paths):
+        """JSON.GET of the root path."""
+        self.redis.round_trip()
+        value = self.redis.data.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, path: str, value: Any):
+        """JSON.SET of the root path."""
+        self.redis.round_trip()
+        self.redis.data[key] = json.dumps(value)
+        return True
+
+    def mget(self, keys: list[str], path: str):
+        """JSON.MGET of the root path."""
+        self.redis.round_trip()
+        return [None if key not in self.redis.data else json.loads(self.redis.data[key]) for key in keys]
+
+
+class FakeRedis:
+    """An in-memory Redis counting round trips."""
+
+    def __init__(self, stats: Stats):
+        """Initialize the store."""
+        self.stats = stats
+        self.data: dict[str, str] = {}
+        self.bitmaps: dict[str, set[int]] = {}
+        self.sorted_sets: dict[str, dict[str, float]] = {}
+        self.hashes: dict[str, dict[str, str]] = {}
+        self.sets: dict[str, set[str]] = {}
+        self._buffering = False
+
+    def round_trip(self):
+        """Count a round trip unless the command is pipelined."""
+        if not self._buffering:
+            self.stats.count('redis_round_trips')
+
+    def ping(self):
+        """PING."""
+        self.round_trip()
+        return True
+
+    def close(self):
+        """Nothing to close."""
+
+    def json(self) -> FakeJSON:
+        """The RedisJSON commands."""
+        return FakeJSON(self)
+
+    def get(self, key: str) -> str | None:
+        """GET, expiry is not simulated."""
+        self.round_trip()
+        return self.data.get(key)
+
+    def set(self, key: str, value: str, ex: int | None = None):
+        """SET."""
+        self.round_trip()
+        self.data[key] = value
+        return True
+
+    def delete(self, *keys: str) -> int:
+        """DEL."""
+        self.round_trip()
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def zadd(self, key: str, mapping: dict[str, float]) -> int:
+        """ZADD."""
+        self.round_trip()
+        members = self.sorted_sets.setdefault(key, {})
+        added = sum(member not in members for member in mapping)
+        members.update(mapping)
+        return added
+
+    def zcard(self, key: str) -> int:
+        """ZCARD."""
+        self.round_trip()
+        return len(self.sorted_sets.get(key, {}))
+
+    def zremrangebyscore(self, key: str, minimum, maximum: float) -> int:
+        """ZREMRANGEBYSCORE from -inf."""
+        self.round_trip()
+        members = self.sorted_sets.get(key, {})
+        removed = [member for member, score in members.items() if score <= maximum]
+        for member in removed:
+            del members[member]
+        return len(removed)
+
+    def zpopmin(self, key: str, count: int = 1) -> list[tuple[str, float]]:
+        """ZPOPMIN."""
+        self.round_trip()
+        members = self.sorted_sets.get(key, {})
+        popped = sorted(members.items(), key=lambda item: item[1])[:count]
+        for member, _ in popped:
+            del members[member]
+        return popped
+
+    def hmget(self, key: str, fields: list[str]) -> list[str | None]:
+        """HMGET."""
+        self.round_trip()
+        values = self.hashes.get(key, {})
+        return [values.get(field) for field in fields]
+
+    def hset(self, key: str, field: str | None = None, value: str | None = None, mapping: dict | None = None) -> int:
+        """HSET."""
+        self.round_trip()
+        values = self.hashes.setdefault(key, {})
+        mapping = {**(mapping or {}), **({field: value} if field is not None else {})}
+        added = sum(field not in values for field in mapping)
+        values.update({field: str(value) for field, value in mapping.items()})
+        return added
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        """HINCRBY."""
+        self.round_trip()
+        values = self.hashes.setdefault(key, {})
+        values[field] = str(int(values.get(field, 0)) + amount)
+        return int(values[field])
+
+    def hgetall(self, key: str) -> dict[str, str]:
+        """HGETALL."""
+        self.round_trip()
+        return dict(self.hashes.get(key, {}))
+
+    def hincrbyfloat(self, key: str, field: str, amount: float = 1.0) -> float:
+        """HINCRBYFLOAT."""
+        self.round_trip()
+        values = self.hashes.setdefault(key, {})
+        values[field] = str(float(values.get(field, 0)) + amount)
+        return float(values[field])
+
+    def zscore(self, key: str, member: str) -> float | None:
+        """ZSCORE."""
+        self.round_trip()
+        return self.sorted_sets.get(key, {}).get(member)
+
+    def zmscore(self, key: str, members: list[str]) -> list[float | None]:
+        """ZMSCORE."""
+        self.round_trip()
+        scores = self.sorted_sets.get(key, {})
+        return [scores.get(member) for member in members]
+
+    def zpopmax(self, key: str, count: int = 1) -> list[tuple[str, float]]:
+        """ZPOPMAX."""
+        self.round_trip()
+        members = self.sorted_sets.get(key, {})
+        popped = sorted(members.items(), key=lambda item: -item[1])[:count]
+        for member, _ in popped:
+            del members[member]
+        return popped
+
+    def zrem(self, key: str, *members: str) -> int:
+        """ZREM."""
+        self.round_trip()
+        values = self.sorted_sets.get(key, {})
+        return sum(values.pop(member, None) is not None for member in members)
+
+    def hdel(self, key: str, *fields: str) -> int:
+        """HDEL."""
+        self.round_trip()
+        values = self.hashes.get(key, {})
+        return sum(values.pop(field, None) is not None for field in fields)
+
+    def zscan_iter(self, key: str, count: int | None = None) -> Iterator[tuple[str, float]]:
+        """ZSCAN in one page."""
+        self.round_trip()
+        yield from list(self.sorted_sets.get(key, {}).items())
+
+    def register_script(self, script: str):
+        """Run the Lua scripts of the frontier as Python, in one round trip each."""
+        def pop(keys, args):
+            items = []
+            for member, score in self.zpopmax(keys[0], int(args[0])):
+                self.zadd(keys[1], {member: score})
+                items.extend([member, str(score)])
+            return items
+
+        def requeue(keys, args):
+            leased = self.sorted_sets.pop(keys[1], {})
+            self.sorted_sets.setdefault(keys[0], {}).update(leased)
+            return len(leased)
+
+        function = {POP_SCRIPT: pop, REQUEUE_SCRIPT: requeue}[script]
+
+        def run(keys=(), args=()):
+            self.round_trip()
+            self._buffering = True
+            try:
+                return function(list(keys), list(args))
+            finally:
+                self._buffering = False
+        return run
+
+    def sadd(self, key: str, *members: str) -> int:
+        """SADD."""
+        self.round_trip()
+        values = self.sets.setdefault(key, set())
+        added = len(set(members) - values)
+        values.update(members)
+        return added
+
+    def srem(self, key: str, *members: str) -> int:
+        """SREM."""
+        self.round_trip()
+        values = self.sets.get(key, set())
+        removed = len(values & set(members))
+        values.difference_update(members)
+        return removed
+
+    def sscan_iter(self, key: str, count: int | None = None) -> Iterator[str]:
+        """SSCAN in one page."""
+        self.round_trip()
+        yield from list(self.sets.get(key, ()))
+
+    def execute_command(self, *args):
+        """BITFIELD with GET and SET of u1 fields."""
+        self.round_trip()
+        command, key, *operations = args
+        assert command == 'BITFIELD'
+        bits = self.bitmaps.setdefault(key, set())
+        replies = []
+        while operations:
+            if operations[0] == 'GET':
+                _, _, offset, *operations = operations
+                replies.append(int(offset in bits))
+            else:
+                _, _, offset, value, *operations = operations
+                replies.append(int(offset in bits))
+                (bits.add if value else bits.discard)(offset)
+        return replies
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        """Start a pipeline."""
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Buffer commands and send them in one round trip."""
+
+    def __init__(self, redis: FakeRedis, commands: list | None = None):
+        """Initialize the pipeline."""
+        self.redis = redis
+        self.commands = [] if commands is None else commands
+
+    def __getattr__(self, name: str):
+        """Queue any command of the fake client."""
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def json(self) -> FakeJSONPipeline:
+        """Queue RedisJSON commands."""
+        return FakeJSONPipeline(self.redis, self.commands)
+
+    def execute(self):
+        """Run the queued commands in one round trip."""
+        self.redis.round_trip()
+        self.redis._buffering = True
+        try:
+            return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        finally:
+            self.redis._buffering = False
+            self.commands.clear()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit the context manager."""
+
+
+class FakeJSONPipeline(FakePipeline):
+    """RedisJSON commands queued on a pipeline."""
+
+    def __getattr__(self, name: str):
+        """Queue a RedisJSON command."""
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(FakeJSON(self.redis), name), args, kwargs))
+            return self
+        return queue
+
+
+class FakeCacher(Cacher):
+    """A synchronous Cacher backed by `FakeRedis`."""
+
+    def __init__(self, stats: Stats):
+        """Initialize the cacher."""
+        super().__init__(host='localhost', port=6379, password=None)
+        self.fake = FakeRedis(stats)
+
+    def connect(self):
+        """Use the in-memory store."""
+        self.client = self.fake
+        self.client.ping()
+
+
+class FakeResult:
+    """The counters of a bulk write."""
+
+    def __init__(self, upserted_count: int, modified_count: int):
+        """Initialize the result."""
+        self.upserted_count = upserted_count
+        self.modified_count = modified_count
+
+
+class FakeCollection:
+    """An in-memory collection supporting the writes of the connector."""
+
+    def __init__(self, stats: Stats):
+        """Initialize the collection."""
+        self.stats = stats
+        self.documents: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, query: dict) -> str:
+        """Identify a document by its filter."""
+        return json.dumps(query, sort_keys=True, default=str)
+
+    def bulk_write(self, operations: list, ordered: bool = True) -> FakeResult:
+        """Apply upserts in one round trip."""
+        self.stats.count('mongo_round_trips')
+        upserted = modified = 0
+        with self._lock:
+            for operation in operations:
+                key = self._key(operation._filter)
+                if key in self.documents:
+                    modified += 1
+                else:
+                    upserted += 1
+                    self.documents[key] = dict(operation._filter)
+                self.documents[key].update(operation._doc.get('$set', {}))
+        return FakeResult(upserted, modified)
+
+    def find(self, query: dict) -> list[dict]:
+        """Return the documents matching every field of the query."""
+        self.stats.count('mongo_round_trips')
+        return [doc for doc in self.documents.values() if all(doc.get(k) == v for k, v in query.items())]
+
+    def find_one(self, query: dict) -> dict | None:
+        """Return the first matching document."""
+        return next(iter(self.find(query)), None)
+
+
+class FakeDatabase:
+    """An in-memory database."""
+
+    def __init__(self, stats: Stats):
+        """Initialize the database."""
+        self.stats = stats
+        self.collections: dict[str, FakeCollection] = {}
+
+    def __getitem__(self, collection: str) -> FakeCollection:
+        """Return a collection, creating it on first use."""
+        if collection not in self.collections:
+            self.collections[collection] = FakeCollection(self.stats)
+        return self.collections[collection]
+
+
+class FakeMongoClient:
+    """An in-memory MongoClient."""
+
+    def __init__(self, stats: Stats):
+        """Initialize the client."""
+        self.stats = stats
+        self.databases: dict[str, FakeDatabase] = {}
+
+    def __getitem__(self, database: str) -> FakeDatabase:
+        """Return a database, creating it on first use."""
+        if database not in self.databases:
+            self.databases[database] = FakeDatabase(self.stats)
+        return self.databases[database]
+
+    def close(self):
+        """Nothing to close."""
+
+
+def fake_connector_class(stats: Stats) -> type[MongoDBConnector]:
+    """Build a MongoDBConnector sharing one in-memory client."""
+    client = FakeMongoClient(stats)
+
+    class FakeConnector(MongoDBConnector):
+        """A MongoDBConnector backed by `FakeMongoClient`."""
+
+        def connect(self):
+            """Use the in-memory client."""
+            self.client = client
+
+        def disconnect(self):
+            """Keep the data for the report."""
+
+    FakeConnector.fake = client
+    return FakeConnector
+
+
+def names(count: int) -> Iterator[tuple[str, int]]:
+    """Enumerate deterministic full names from the bundled first and last names."""
+    resources = name_resources()
+    for index in range(min(count, len(resources))):
+        first_name, last_name = resources.pair(index)
+        yield f'{first_name.title()} {last_name}', index
+
+
+class BenchmarkNames:
+    """The generated names as a name source with rows, like the CSV."""
+
+    unique = False
+    checkpoint_suffix: tuple[str, ...] = ()
+
+    def __init__(self, count: int):
+        """Initialize the source."""
+        self.count = count
+
+    def rows(self, start: int = 0) -> Iterator[tuple[list[str], int]]:
+        """Yield (row, index) pairs from `start`."""
+        for full_name, index in islice(names(self.count), start, None):
+            yield full_name.split(' ', 1), index
+
+    def iter_names(self, start: int = 0) -> Iterator[tuple[str, int]]:
+        """Yield (full name, index) pairs from `start`."""
+        return islice(names(self.count), start, None)
+
+
+def result_urls(count: int) -> list[str]:
+    """Build result URLs of every platform, profiles and other pages alike."""
+    paths = ['{slug}', '@{slug}', '{slug}/', 'in/{slug}', 'people/{slug}/123', 'user/{slug}/posts',
+             '{slug}/posts/1', 'p/{slug}?igshid=1', '{slug};params', 'search?q={slug}#top', '']
+    hosts = [host for rule in PLATFORM_RULES.values() for host in rule['hosts']] + ['about.pinterest.com']
+    urls = []
+    for full_name, index in names(count):
+        slug = re.sub(r'\W+', '', full_name.title())
+        host = hosts[index % len(hosts)]
+        path = paths[index % len(paths)].format(slug=slug)
+        urls.append(f'https://{"www." if index % 3 else ""}{host}/{path}')
+    return urls
+
+
+@contextmanager
+def patched(module, **attributes):
+    """Swap module attributes for the duration of the block."""
+    original = {name: getattr(module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in original.items():
+            setattr(module, name, value)
+
+
+class Benchmark:
+    """Drive the crawler against the stand-ins and collect metrics."""
+
+    def __init__(self, args: argparse.Namespace):
+        """Initialize the benchmark."""
+        self.args = args
+        self.stats = Stats()
+        self.query_cache = QueryCache(FakeCacher(self.stats))
+        self.query_cache.cacher.connect()
+        # One process, only the in-process coalescing applies
+        self.single_flight = SingleFlight(lease_ttl=0)
+        self.query_planner = QueryPlanner(serp_crawler.query_schema, self.query_cache.cacher)
+
+    @contextmanager
+    def environment(self):
+        """Install the stand-ins into the crawler module."""
+        args = self.args
+        pool = SessionPool(factory=lambda proxy_url: FakeDDGS(
+            self.stats, args.latency, args.error_rate, args.throttle_rate, args.results
+        ))
+        limiters = RateLimiterRegistry(rate=args.rate, max_rate=args.rate, backoff=1.0, max_backoff=0)
+        def timed(search):
+            def wrapper(fullname, platform):
+                start = time.perf_counter()
+                try:
+                    return search(fullname, platform)
+                finally:
+                    self.stats.latencies.append(time.perf_counter() - start)
+            return staticmethod(wrapper)
+
+        with patched(serp_crawler, session_pool=pool, limiters=limiters, query_cache=self.query_cache,
+                     single_flight=self.single_flight, query_planner=self.query_planner,
+                     MongoDBConnector=fake_connector_class(self.stats)), \
+                patched(SearchResult, search_query_platform=timed(SearchResult.search_query_platform),
+                        search_combined=timed(SearchResult.search_combined)):
+            yield
+
+    def run(self):
+        """Run `SearchResult.run` over the generated names."""
+        with self.environment():
+            search = SearchResult()
+            search.cacher = FakeCacher(self.stats)
+            source = BenchmarkNames(self.args.names)
+            search.name_source = lambda: source
+            search.generate_name_special = source.iter_names
+            search.run(self.args.platform)
+
+    def search(self):
+        """Call `search_query_platform` for every generated name, retrying throttled ones."""
+        with self.environment():
+            with concurrent.futures.ThreadPoolExecutor(self.args.callers) as executor:
+                for _ in range(self.args.passes):
+                    for full_name, _ in names(self.args.names):
+                        callers = [
+                            executor.submit(SearchResult.search_with_retry, full_name, self.args.platform)
+                            for _ in range(self.args.callers)
+                        ]
+                        concurrent.futures.wait(callers)
+
+    def filters(self) -> dict[str, float]:
+        """Time the legacy filters against `classify_many`/`filter_many` and compare verdicts."""
+        urls = result_urls(self.args.names)
+
+        def legacy(filter_function, url):
+            try:
+                return bool(filter_function(url))
+            except Exception:
+                return False
+
+        start = time.perf_counter()
+        expected = {platform: [legacy(function, url) for url in urls] for platform, function in platform_filters.items()}
+        legacy_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        verdicts = {platform: classifier.filter_many(urls, platform) for platform in platform_filters}
+        compiled_elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        classifier.classify_many(urls)
+        classify_elapsed = time.perf_counter() - start
+
+        checks = len(urls) * len(platform_filters)
+        return {
+            'verdicts': checks,
+            'legacy_ns_per_url': legacy_elapsed / checks * 1e9,
+            'compiled_ns_per_url': compiled_elapsed / checks * 1e9,
+            'classify_ns_per_url': classify_elapsed / len(urls) * 1e9,
+            'speedup': legacy_elapsed / compiled_elapsed,
+            'mismatches': sum(a != b for platform in expected for a, b in zip(expected[platform], verdicts[platform])),
+        }
+
+    def measure(self) -> dict[str, float]:
+        """Run the selected mode and compute the report."""
+        if self.args.mode == 'filters':
+            return self.filters()
+        if self.args.tracemalloc:
+            tracemalloc.start()
+        start = time.perf_counter()
+        getattr(self, self.args.mode)()
+        elapsed = time.perf_counter() - start
+        latencies = sorted(self.stats.latencies) or [0.0]
+        searched = max(1, len(self.stats.latencies))
+        report = {
+            'name_searches': len(self.stats.latencies),
+            'elapsed_s': elapsed,
+            'names_per_s': len(self.stats.latencies) / elapsed,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+            'upstream_requests': self.stats.searches,
+            'redis_round_trips_per_name': self.stats.redis_round_trips / searched,
+            'mongo_round_trips_per_name': self.stats.mongo_round_trips / searched,
+            'query_cache_hits': self.query_cache.stats['local_hits'] + self.query_cache.stats['redis_hits'],
+            'coalesced_queries': self.single_flight.stats['shared'],
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        if self.args.tracemalloc:
+            report['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['run', 'search', 'filters'])
+    parser.add_argument('--platform', default='facebook')
+    parser.add_argument('--names', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.05, help='mean seconds per upstream request')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--results', type=int, default=10, help='results per upstream request')
+    parser.add_argument('--passes', type=int, default=1, help='search the names this many times')
+    parser.add_argument('--callers', type=int, default=1, help='concurrent searches of every name')
+    parser.add_argument('--rate', type=float, default=1e9, help='upstream requests per second')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace Python allocations, slower')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = Benchmark(args).measure()
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f'{key:<28} {value:,.2f}')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 """A wrapper to cache data in Redis."""
 from __future__ import annotations
+import time
 from functools import wraps
-from typing import Any, TYPE_CHECKING
+from typing import Any, AsyncIterator, TYPE_CHECKING
 import redis.asyncio as redis
 from redis.commands.json.path import Path
 
@@ -49,10 +50,14 @@ class Cacher:
             await self.client.ping()
             self.logger.info('Redis connection established.')
         except redis.ConnectionError:
+            # Without a client every call is skipped instead of failing
+            self.client = None
             self.logger.warning('Unable to connect to Redis.')
 
     async def disconnect(self):
         """Disconnect from Redis."""
+        if self.client is None:
+            return
         await self.client.close()
         self.logger.info('Redis connection closed.')
 
@@ -68,38 +73,108 @@ class Cacher:
         """Writes to Redis asynchronously."""
         if isinstance(key, list):
             key = self.to_key(key)
-            print(key)
         await self.client.json().set(key, Path.root_path(), values)
 
     @ensure_connection
-    async def search_by_status(self, status: str | int) -> list[dict]:
-        """Search all the rquests for a specific status."""
-        # First get all the keys
-        keys = await self.client.keys('*')
-        # Then get the values for those keys
-        records = await self.client.json().mget(keys, Path.root_path())
-        results = {}
-        for key, record in zip(keys, records):
-            results[key] = record[str(status)]
-        return results
+    async def get_many(self, keys: list[str]) -> list[Any]:
+        """Get many values from Redis asynchronously in one round trip."""
+        if not keys:
+            return []
+        return await self.client.json().mget(keys, Path.root_path())
+
+    @ensure_connection
+    async def insert_many(self, mapping: dict[str, Any]):
+        """Writes many keys to Redis asynchronously in one pipeline."""
+        if not mapping:
+            return
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.json().set(key, Path.root_path(), value)
+            await pipe.execute()
+
+    async def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it has not been stored yet."""
+        values = await self.get_many(keys)
+        if values is None:
+            return [True] * len(keys)
+        return [value is None for value in values]
+
+    @staticmethod
+    def status_key(status: str | int) -> str:
+        """Return the key of the set indexing the documents holding a status."""
+        return f'index:status:{status}'
+
+    async def iter_by_status(self, status: str | int, page_size: int = 500) -> AsyncIterator[tuple[str, Any]]:
+        """Yield (key, records) of a status a SSCAN page at a time, in constant memory."""
+        if not self.client:
+            self.logger.warning('Redis connection not established. Skipping caching.')
+            return
+        index_key = self.status_key(status)
+        cursor = None
+        try:
+            while cursor != 0:
+                cursor, keys = await self.client.sscan(index_key, cursor or 0, count=page_size)
+                if not keys:
+                    continue
+                records = await self.client.json().mget(keys, f'$.{status}')
+                stale = []
+                for key, record in zip(keys, records):
+                    if record:
+                        yield key, record[0]
+                    else:
+                        stale.append(key)
+                if stale:
+                    # The document or its status went away without passing through the index
+                    await self.client.srem(index_key, *stale)
+        except Exception as exp:
+            self.logger.error(f'Error while executing iter_by_status:\n{exp}')
+
+    async def search_by_status(self, status: str | int) -> dict[str, Any]:
+        """Search all the requests for a specific status."""
+        return {key: records async for key, records in self.iter_by_status(status)}
+
+    def _queue_status(self, pipe, key: str, status: str | int, records: list[dict], append: bool = False):
+        """Queue a path-level status write, creating the document if it is missing."""
+        # NX writes only create what is missing and never overwrite other statuses
+        pipe.json().set(key, Path.root_path(), {}, nx=True)
+        if append:
+            pipe.json().set(key, f'$.{status}', [], nx=True)
+            if records:
+                pipe.json().arrappend(key, f'$.{status}', *records)
+        else:
+            pipe.json().set(key, f'$.{status}', records)
+        pipe.sadd(self.status_key(status), key)
 
     @ensure_connection
     async def update_by_status(self, key: str, status: str | int, records: list[dict]):
-        """Update the value of a specific status."""
-        # First get the value for the key
-        value = await self.client.json().get(key, Path.root_path())
-        # Then update the value
-        value[str(status)] = records
-        # Then set the value back to the key
-        await self.client.json().set(key, Path.root_path(), value)
+        """Replace the records of a status atomically, without reading the document."""
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._queue_status(pipe, key, status, records)
+            await pipe.execute()
+
+    @ensure_connection
+    async def append_by_status(self, key: str, status: str | int, records: list[dict]):
+        """Append records to a status atomically with JSON.ARRAPPEND."""
+        async with self.client.pipeline(transaction=True) as pipe:
+            self._queue_status(pipe, key, status, records, append=True)
+            await pipe.execute()
+
+    @ensure_connection
+    async def bulk_update_by_status(self, mapping: dict[str, dict[str, list[dict]]]):
+        """Replace the records of many statuses of many keys in one transaction."""
+        async with self.client.pipeline(transaction=True) as pipe:
+            for key, payload in mapping.items():
+                for status, records in payload.items():
+                    self._queue_status(pipe, key, status, records)
+            await pipe.execute()
 
     @ensure_connection
-    async def bulk_update_by_status(self, mapping: dict[str, str | list[dict]]):
-        """Update the value of a specific status."""
+    async def bulk_append_by_status(self, mapping: dict[str, dict[str, list[dict]]]):
+        """Append records to many statuses of many keys in one transaction."""
         async with self.client.pipeline(transaction=True) as pipe:
             for key, payload in mapping.items():
                 for status, records in payload.items():
-                    pipe.json().set(key, f'$.{status}', records)
+                    self._queue_status(pipe, key, status, records, append=True)
             await pipe.execute()
 
     async def __aenter__(self):
@@ -116,3 +191,76 @@ class Cacher:
     def to_key(args):
         """Convert arguments to a Redis key."""
         return ':'.join(args)
+
+
+class Checkpoint:
+    """A resume point that is written every `every` names or `interval` seconds."""
+
+    def __init__(self, cacher: Cacher, key: list[str], every: int = 100, interval: float = 5.0):
+        """Initialize the checkpoint."""
+        self.cacher = cacher
+        self.key = key
+        self.every = every
+        self.interval = interval
+        self.value = None
+        self._written = None
+        self._pending = 0
+        self._last_write = time.monotonic()
+
+    async def advance(self, value: Any) -> bool:
+        """Move the checkpoint, return True if it was written."""
+        self.value = value
+        self._pending += 1
+        if self._pending >= self.every or time.monotonic() - self._last_write >= self.interval:
+            return await self.flush()
+        return False
+
+    async def flush(self) -> bool:
+        """Write the latest value if it changed."""
+        self._pending = 0
+        self._last_write = time.monotonic()
+        if self.value is None or self.value == self._written:
+            return False
+        await self.cacher.insert(self.key, self.value)
+        self._written = self.value
+        return True
+
+
+class RetryList:
+    """Names given up on while throttled, a Redis set the next run searches first.
+
+    The resume point moves past a name that was given up on, so the name is
+    added here before and removed once its results are written.
+    """
+
+    def __init__(self, cacher: Cacher, key: str):
+        """Initialize the list."""
+        self.cacher = cacher
+        self.key = f'retry:{key}'
+        self.logger: logging.Logger = CacherLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    @ensure_connection
+    async def add(self, names: list[str]):
+        """Keep names to search again."""
+        if names:
+            await self.client.sadd(self.key, *names)
+
+    @ensure_connection
+    async def remove(self, names: list[str]):
+        """Forget names whose results are written."""
+        if names:
+            await self.client.srem(self.key, *names)
+
+    @ensure_connection
+    async def _members(self, page_size: int) -> list[str]:
+        """SSCAN the whole set."""
+        return [name async for name in self.client.sscan_iter(self.key, count=page_size)]
+
+    async def pending(self, page_size: int = 500) -> list[str]:
+        """Return the names left from earlier runs."""
+        return (await self._members(page_size) or []) if self.client else []
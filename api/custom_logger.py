@@ -102,3 +102,25 @@ class MongoLogger(BaseLogger):
     def get_formatter(self):
         """Return the formatter for the logger."""
         return ColoredFormatter("[%(levelname)s][%(name)s] %(message)s")
+
+
+class CrawlerLogger(BaseLogger):
+    """A custom logger for the crawler."""
+    def __init__(self):
+        """Initialize the logger."""
+        super().__init__("Crawler")
+
+    def get_formatter(self):
+        """Return the formatter for the logger."""
+        return ColoredFormatter("[%(levelname)s][%(name)s] %(message)s")
+
+
+class ApiLogger(BaseLogger):
+    """A custom logger for the HTTP API."""
+    def __init__(self):
+        """Initialize the logger."""
+        super().__init__("API")
+
+    def get_formatter(self):
+        """Return the formatter for the logger."""
+        return ColoredFormatter("[%(levelname)s][%(name)s] %(message)s")
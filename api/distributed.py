@@ -0,0 +1,279 @@
+"""Distributed crawling: name ranges leased from a Redis stream by any number of nodes."""
+from __future__ import annotations
+import concurrent.futures
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from typing import NamedTuple, TYPE_CHECKING
+
+from redis.exceptions import ResponseError
+
+from custom_logger import CrawlerLogger
+from freshness import CrawlLog
+from mongo import MongoDBConnector, WriteBehindBuffer
+from sinks import sink_from_env
+from scheduler import Watermark
+from seen_set import seen_set_from_env
+from serp_crawler import SearchResult, query_planner
+from synccacher import Cacher, RetryList, ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+
+# Hand out the next range atomically, so concurrent seeders never add the same rows twice
+SEED_SCRIPT = """
+local size = tonumber(ARGV[1])
+local total = tonumber(ARGV[2])
+local start = redis.call('INCRBY', KEYS[1], size) - size
+if start >= total then
+    redis.call('DECRBY', KEYS[1], size)
+    return -1
+end
+redis.call('XADD', KEYS[2], '*', 'start', start, 'end', math.min(start + size, total))
+return start
+"""
+
+
+class Lease(NamedTuple):
+    """A range of rows [start, end) leased from the stream."""
+    entry_id: str
+    start: int
+    end: int
+
+
+class RangeQueue:
+    """Name ranges of one platform, leased through a Redis stream consumer group.
+
+    The list is cut into ranges of `range_size` rows appended to a stream.
+    A node reads a range with XREADGROUP; while it works it commits the next
+    row to a progress hash, and a heartbeat renews the lease every third of
+    the timeout however long a window takes. A lease idle for more than
+    `visibility_timeout` seconds belongs to a dead node and is taken over
+    with XAUTOCLAIM, resuming from its committed progress. Finished ranges
+    are acknowledged and deleted.
+    """
+
+    group = 'crawlers'
+
+    def __init__(self,
+        cacher: Cacher,
+        platform: str,
+        country: str = 'Sweden',
+        range_size: int = int(os.getenv('CRAWLER_RANGE_SIZE', 1000)),
+        visibility_timeout: int = int(os.getenv('CRAWLER_LEASE_TIMEOUT', 600)),
+        consumer: str | None = None
+    ):
+        """Initialize the queue."""
+        self.cacher = cacher
+        self.range_size = range_size
+        self.visibility_timeout = visibility_timeout
+        self.consumer = consumer or f'{socket.gethostname()}:{os.getpid()}'
+        self.prefix = prefix = f'crawl:{country}:{platform}'
+        self.stream = f'{prefix}:ranges'
+        self.cursor_key = f'{prefix}:cursor'
+        self.progress_key = f'{prefix}:progress'
+        self.logger: logging.Logger = CrawlerLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    @ensure_connection
+    def create_group(self):
+        """Create the consumer group if it does not exist yet."""
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as exp:
+            if 'BUSYGROUP' not in str(exp):
+                raise
+
+    @ensure_connection
+    def seed(self, total: int) -> int:
+        """Append the ranges up to `total` rows that are not queued yet."""
+        script = self.client.register_script(SEED_SCRIPT)
+        added = 0
+        while script(keys=[self.cursor_key, self.stream], args=[self.range_size, total]) >= 0:
+            added += 1
+        if added:
+            self.logger.info(f'Queued {added} ranges of {self.stream}.')
+        return added
+
+    def _lease(self, entry_id: str, fields: dict[str, str]) -> Lease:
+        """Build a lease, resuming from the committed progress."""
+        progress = self.client.hget(self.progress_key, entry_id)
+        start = max(int(fields['start']), int(progress or 0))
+        return Lease(entry_id, start, int(fields['end']))
+
+    @ensure_connection
+    def lease(self) -> Lease | None:
+        """Take over an expired lease, or lease a new range. None when all is done."""
+        claimed = self.client.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=self.visibility_timeout * 1000, start_id='0-0', count=1
+        )
+        if claimed and claimed[1]:
+            entry_id, fields = claimed[1][0]
+            self.logger.info(f'Reclaimed expired lease {entry_id} of {self.stream}.')
+            return self._lease(entry_id, fields)
+
+        entries = self.client.xreadgroup(self.group, self.consumer, {self.stream: '>'}, count=1)
+        if entries and entries[0][1]:
+            entry_id, fields = entries[0][1][0]
+            return self._lease(entry_id, fields)
+        return None
+
+    @ensure_connection
+    def commit(self, lease: Lease, row: int):
+        """Record that every row before `row` is done and renew the lease."""
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hset(self.progress_key, lease.entry_id, row)
+            pipe.xclaim(self.stream, self.group, self.consumer, 0, [lease.entry_id], justid=True)
+            pipe.execute()
+
+    @ensure_connection
+    def renew(self, lease: Lease):
+        """Reset the idle time of a lease."""
+        self.client.xclaim(self.stream, self.group, self.consumer, 0, [lease.entry_id], justid=True)
+
+    @contextmanager
+    def heartbeat(self, lease: Lease):
+        """Renew a lease in the background while the block runs."""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.visibility_timeout / 3):
+                self.renew(lease)
+
+        thread = threading.Thread(target=beat, name=f'lease-{lease.entry_id}', daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    @ensure_connection
+    def complete(self, lease: Lease):
+        """Acknowledge a finished range."""
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.xack(self.stream, self.group, lease.entry_id)
+            pipe.xdel(self.stream, lease.entry_id)
+            pipe.hdel(self.progress_key, lease.entry_id)
+            pipe.execute()
+
+
+class DistributedWorker:
+    """Crawl leased ranges of a platform until none are left."""
+
+    def __init__(self, platform: str, window_size: int = int(os.getenv('CRAWLER_WINDOW', 50))):
+        """Initialize the worker."""
+        self.platform = platform
+        self.window_size = window_size
+        self.cacher = Cacher(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        self.logger: logging.Logger = CrawlerLogger()
+        # Filled by the flush callbacks, a write kept for a later flush lands in a later window
+        self._flushed: list[tuple[str, str, int | None]] = []
+
+    def crawl_window(self, window: list[tuple[str, int | None]], seen, buffer: WriteBehindBuffer,
+                     crawl_log: CrawlLog, retry: RetryList) -> tuple[list[tuple[str, int | None]], list[tuple[str, int | None]]]:
+        """Search a window of names and write their results.
+
+        Return the (name, index) pairs that are done, skipped or written by
+        this flush, possibly names of earlier windows whose write had failed,
+        and the pairs given up on, which go to the retry list.
+        """
+        done = []
+        given_up = []
+        keys = [f"{full_name.lower()}:{self.platform}:v2" for full_name, _ in window]
+        for (full_name, index), combined_key, is_new in zip(window, keys, seen.filter_unseen(keys)):
+            if not is_new:
+                done.append((full_name, index))
+                continue
+            result = SearchResult.search_with_retry(full_name, self.platform)
+            if result is None:
+                given_up.append((full_name, index))
+                continue
+            buffer.add(
+                'scrapped_profiles_v2', result, 'url',
+                on_flush=lambda key=combined_key, name=full_name, index=index: self._flushed.append((key, name, index))
+            )
+        # Given-up names are kept before the progress moves past them
+        retry.add([full_name for full_name, _ in given_up])
+        buffer.flush()
+        flushed, self._flushed = self._flushed, []
+        seen.add_many({key for key, _, _ in flushed})
+        crawl_log.touch([full_name for _, full_name, _ in flushed])
+        return done + [(full_name, index) for _, full_name, index in flushed], given_up
+
+    def crawl_range(self, lease: Lease, source, seen, buffer: WriteBehindBuffer, queue: RangeQueue,
+                    crawl_log: CrawlLog, retry: RetryList):
+        """Search every name of a range, committing progress after each window.
+
+        Progress only moves past rows that are written, skipped or in the
+        retry list. A range left with rows that were never written is not
+        acknowledged, its lease expires and the range is taken over from the
+        committed progress.
+        """
+        names = islice(source.iter_names(lease.start), lease.end - lease.start)
+        watermark = Watermark(lease.start)
+        # A window of throttled names may outlast the lease timeout
+        with queue.heartbeat(lease):
+            while window := list(islice(names, self.window_size)):
+                done, given_up = self.crawl_window(window, seen, buffer, crawl_log, retry)
+                if any([watermark.complete(index) for _, index in done + given_up if index is not None]):
+                    queue.commit(lease, watermark.value)
+        if watermark.value < lease.end:
+            self.logger.warning(f'Rows {watermark.value}-{lease.end} of {self.platform} were not written, leaving the lease to expire.')
+            return
+        queue.complete(lease)
+
+    def crawl_retries(self, seen, buffer: WriteBehindBuffer, crawl_log: CrawlLog, retry: RetryList):
+        """Search the names given up on by earlier runs of any node."""
+        retried = retry.pending()
+        for start in range(0, len(retried), self.window_size):
+            window = [(full_name, None) for full_name in retried[start:start + self.window_size]]
+            done, _ = self.crawl_window(window, seen, buffer, crawl_log, retry)
+            retry.remove([full_name for full_name, _ in done])
+
+    def run(self):
+        """Lease and crawl ranges until the stream is drained."""
+        with self.cacher as cacher, MongoDBConnector() as connector:
+            queue = RangeQueue(cacher, self.platform)
+            queue.create_group()
+            source = SearchResult.name_source()
+            queue.seed(len(source))
+            seen = seen_set_from_env(cacher, self.platform)
+            crawl_log = CrawlLog(cacher, self.platform)
+            retry = RetryList(cacher, queue.prefix)
+            try:
+                with sink_from_env(connector) as buffer:
+                    self.crawl_retries(seen, buffer, crawl_log, retry)
+                    while lease := queue.lease():
+                        self.logger.info(f'Crawling rows {lease.start}-{lease.end} of {self.platform}.')
+                        self.crawl_range(lease, source, seen, buffer, queue, crawl_log, retry)
+            finally:
+                seen.close()
+                query_planner.flush()
+
+
+def run_worker(target):
+    return DistributedWorker(target).run()
+
+
+def main():
+    # Start the same command on every crawl box, ranges are split through Redis
+    max_processes = int(os.getenv('CRAWLER_PROCESSES', 10))
+    targets = ["facebook", "linkedin", "twitter", "tiktok", "instagram"]
+    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+        results = [executor.submit(run_worker, target) for target in targets]
+
+
+if __name__ == "__main__":
+    main()
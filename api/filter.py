@@ -1,4 +1,5 @@
-from urllib.parse import urlparse
+import re
+from urllib.parse import urlparse, urlsplit, uses_params
 def twitter_filter(url):
     # Parse the URL
     parsed_url = urlparse(url)
@@ -149,10 +150,123 @@ platform_filters = {
     'snapchat': no_filter
 }
 
-def specialized_filter(url,platform_name):
-    filter_function = platform_filters[platform_name]
-    result = filter_function(url)
-    return result
+# Declarative rules of the compiled classifier, each one matches the filter above:
+#   hosts          registered domains of the platform, used to classify a URL
+#   profile_path   regex the whole URL path has to match
+#   excluded_hosts netlocs that are never profiles
+#   url_contains   substring of the raw URL, checked instead of parsing
+PLATFORM_RULES = {
+    'twitter': {'hosts': ['twitter.com', 'x.com'], 'profile_path': r'[^/]*/[^/]*'},
+    'facebook': {'hosts': ['facebook.com', 'fb.com'], 'profile_path': r'[^/]*/(?:[^/]*|people(?:/.*)?)'},
+    'linkedin': {'hosts': ['linkedin.com'], 'url_contains': 'linkedin.com/in'},
+    'tiktok': {'hosts': ['tiktok.com'], 'profile_path': r'[^/]*/[^/]*@[^/]*'},
+    'instagram': {'hosts': ['instagram.com'], 'profile_path': r'[^/]*/[^/]*/?'},
+    'pinterest': {
+        'hosts': ['pinterest.com', 'pinterest.se', 'pinterest.co.uk'],
+        'profile_path': r'[^/]*/[^/]*/?',
+        'excluded_hosts': ['about.pinterest.com', 'help.pinterest.com'],
+    },
+    'reddit': {'hosts': ['reddit.com'], 'profile_path': r'[^/]*/[^/]*user[^/]*/[^/]*/[^/]*'},
+    'medium': {'hosts': ['medium.com'], 'profile_path': r'[^/]*/[^/]*@[^/]*'},
+    'quora': {'hosts': ['quora.com']},
+    'badoo': {'hosts': ['badoo.com']},
+    'snapchat': {'hosts': ['snapchat.com']},
+}
+
+# Same split as urlparse: leading C0/space stripped, then scheme, netloc and path up to ? or #
+URL_PATTERN = re.compile(r'[\x00-\x20]*(?:([A-Za-z][A-Za-z0-9+.-]*):)?(?://([^/?#]*))?([^?#]*)', re.DOTALL)
+
+
+def split_url(url):
+    # Return (netloc, path) exactly as urlparse would, raise ValueError where it does
+    if '\t' in url or '\r' in url or '\n' in url:
+        url = url.replace('\t', '').replace('\r', '').replace('\n', '')
+    scheme, netloc, path = URL_PATTERN.match(url).groups()
+    if netloc is None:
+        netloc = ''
+    elif '[' in netloc or ']' in netloc or not netloc.isascii():
+        # Rare netlocs urlparse validates (IPv6 brackets, NFKC), let it raise
+        urlsplit(url)
+    if ';' in path and (scheme or '').lower() in uses_params:
+        # urlparse moves ;params of the last segment out of the path
+        start = path.rfind('/')
+        i = path.find(';', start) if start >= 0 else path.find(';')
+        if i >= 0:
+            path = path[:i]
+    return netloc, path
+
+
+class UrlClassifier:
+    """Classify result URLs by platform and profile verdict in a single pass.
+
+    Rules are compiled once; every URL is parsed at most once with one regex
+    and matched against one precompiled path pattern, instead of a full
+    urlparse plus split per filter call. Where a filter above raised (an
+    empty facebook path, a malformed IPv6 netloc) the verdict is False.
+    """
+
+    def __init__(self, rules=PLATFORM_RULES):
+        self.rules = {}
+        self.hosts = {}
+        for platform, rule in rules.items():
+            self.rules[platform] = (
+                re.compile(rule['profile_path'], re.DOTALL).fullmatch if 'profile_path' in rule else None,
+                frozenset(rule.get('excluded_hosts', ())),
+                rule.get('url_contains'),
+            )
+            for host in rule['hosts']:
+                self.hosts[host] = platform
 
+    def _verdict(self, url, rule, parsed=None):
+        profile_path, excluded_hosts, url_contains = rule
+        if url_contains is not None:
+            return url_contains in url
+        if profile_path is None and not excluded_hosts:
+            return True
+        try:
+            netloc, path = parsed or split_url(url)
+        except ValueError:
+            return False
+        if netloc in excluded_hosts:
+            return False
+        return profile_path is None or profile_path(path) is not None
 
-    
\ No newline at end of file
+    def is_profile(self, url, platform):
+        # Raises KeyError for an unknown platform, like specialized_filter always did
+        return self._verdict(url, self.rules[platform])
+
+    def platform_of(self, netloc):
+        host = netloc.lower()
+        if '@' in host or ':' in host:
+            host = host.rpartition('@')[2]
+            host = host.rpartition(']')[0] + ']' if host.startswith('[') else host.partition(':')[0]
+        labels = host.rstrip('.').rsplit('.', 3)
+        return self.hosts.get('.'.join(labels[-2:])) or self.hosts.get('.'.join(labels[-3:]))
+
+    def classify(self, url):
+        # Return (platform or None, is a profile of that platform)
+        try:
+            parsed = split_url(url)
+        except ValueError:
+            return None, False
+        platform = self.platform_of(parsed[0])
+        if platform is None:
+            return None, False
+        return platform, self._verdict(url, self.rules[platform], parsed)
+
+    def classify_many(self, urls):
+        classify = self.classify
+        return [classify(url) for url in urls]
+
+    def filter_many(self, urls, platform):
+        # Profile verdicts of a batch of URLs for one platform
+        rule = self.rules[platform]
+        verdict = self._verdict
+        return [verdict(url, rule) for url in urls]
+
+
+classifier = UrlClassifier()
+
+
+def specialized_filter(url,platform_name):
+    return classifier.is_profile(url, platform_name)
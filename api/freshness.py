@@ -0,0 +1,159 @@
+"""When each name was last crawled, and which recrawled profiles actually changed."""
+from __future__ import annotations
+import os
+import random
+import time
+from typing import Iterable, Iterator, TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from normalize import dedupe_documents
+from synccacher import ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+    from cacher import Cacher as AsyncCacher
+    from mongo import MongoDBConnector
+    from synccacher import Cacher
+
+
+class CrawlLog:
+    """The last crawl time of every name of a platform, a sorted set scored by timestamp.
+
+    Members are lowercase full names, so the spellings of a name share one
+    time, and the `<key>:names` hash keeps the spelling last searched. A
+    name is touched once its results are written, so a crawler stopping in
+    between searches it again.
+    """
+
+    def __init__(self, cacher: Cacher, platform: str, country: str = 'Sweden'):
+        """Initialize the log."""
+        self.cacher = cacher
+        self.platform = platform
+        self.key = f'crawled:{country}:{platform}'
+        self.names_key = f'{self.key}:names'
+        self.logger: logging.Logger = CacherLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    def _queue_touch(self, pipe, names: Iterable[str], when: float | None) -> bool:
+        """Queue the crawl times and spellings of names, return False if there are none."""
+        spellings = {name.lower(): name for name in names}
+        if spellings:
+            pipe.zadd(self.key, dict.fromkeys(spellings, time.time() if when is None else when))
+            pipe.hset(self.names_key, mapping=spellings)
+        return bool(spellings)
+
+    @ensure_connection
+    def touch(self, names: Iterable[str], when: float | None = None):
+        """Record that names were crawled now, or at `when`."""
+        with self.client.pipeline(transaction=False) as pipe:
+            if self._queue_touch(pipe, names, when):
+                pipe.execute()
+
+    def iter_stale(self, ttl: float, page_size: int = 500) -> Iterator[list[str]]:
+        """Yield pages of the names last crawled more than `ttl` seconds ago, oldest first.
+
+        Pages follow a score cursor, so names touched meanwhile leave the
+        range without shifting the next page.
+        """
+        cutoff = time.time() - ttl
+        low, done = '-inf', set()
+        while self.client:
+            page = self._range(low, cutoff, page_size + len(done))
+            page = [(name, score) for name, score in page or [] if name not in done]
+            if not page:
+                return
+            yield self.spellings([name for name, _ in page])
+            last = page[-1][1]
+            # Names sharing the cursor score come back with the next page
+            done = {name for name, score in page if score == last} | (done if low == last else set())
+            low = last
+
+    def spellings(self, members: list[str]) -> list[str]:
+        """Return the names as searched, backfilled names are only known in lowercase."""
+        found = self._spellings(members) if members and self.client else None
+        return [name or member for member, name in zip(members, found or [None] * len(members))]
+
+    @ensure_connection
+    def _spellings(self, members: list[str]) -> list[str | None]:
+        """HMGET the spellings of members."""
+        return self.client.hmget(self.names_key, members)
+
+    @ensure_connection
+    def _range(self, low: float | str, high: float, count: int) -> list[tuple[str, float]]:
+        """ZRANGEBYSCORE with scores."""
+        return self.client.zrangebyscore(self.key, low, high, start=0, num=count, withscores=True)
+
+    @ensure_connection
+    def backfill(self, spread: float, version: str = 'v2', page_size: int = 1000) -> int:
+        """Log the names flagged by the exact seen set before the log existed.
+
+        Their crawl times are unknown, so they are spread at random over the
+        last `spread` seconds and come due over one TTL instead of at once.
+        Names already logged keep their time.
+        """
+        suffix = f':{self.platform}:{version}'
+        now, added, cursor = time.time(), 0, None
+        while cursor != 0:
+            cursor, keys = self.client.scan(cursor or 0, match=f'*{suffix}', count=page_size)
+            members = {key[:-len(suffix)]: now - random.uniform(0, spread) for key in keys}
+            if members:
+                added += self.client.zadd(self.key, members, nx=True)
+        self.logger.info(f'Logged {added} previously crawled names of {self.platform}.')
+        return added
+
+
+class AsyncCrawlLog(CrawlLog):
+    """The asyncio flavour of `CrawlLog`, only touching names."""
+
+    def __init__(self, cacher: AsyncCacher, platform: str, country: str = 'Sweden'):
+        """Initialize the log."""
+        super().__init__(cacher, platform, country)
+
+    async def touch(self, names: Iterable[str], when: float | None = None):
+        """Record that names were crawled now, or at `when`."""
+        if not self.client:
+            return
+        try:
+            async with self.client.pipeline(transaction=False) as pipe:
+                if self._queue_touch(pipe, names, when):
+                    await pipe.execute()
+        except Exception as exp:
+            self.logger.error(f'Error while executing touch:\n{exp}')
+
+
+def recrawl_ttls(platforms: list[str]) -> dict[str, float]:
+    """Return the TTL of every platform in seconds.
+
+    `RECRAWL_TTL_DAYS` is the default, `RECRAWL_TTLS="linkedin=90,tiktok=7"`
+    overrides single platforms (in days too).
+    """
+    days = dict.fromkeys(platforms, float(os.getenv('RECRAWL_TTL_DAYS', 30)))
+    for item in filter(None, os.getenv('RECRAWL_TTLS', '').split(',')):
+        platform, value = item.split('=')
+        if platform.strip() in days:
+            days[platform.strip()] = float(value)
+    return {platform: value * 86400 for platform, value in days.items()}
+
+
+def changed_documents(connector: MongoDBConnector, collection: str, documents: list[dict],
+                      field: str = 'url') -> tuple[list[dict], int]:
+    """Drop the documents stored with the same values, return the rest and how many were dropped.
+
+    Documents are canonicalized first, as the buffer would, and compared on
+    their own fields only, so `_id` and `updated_at` of the stored ones do
+    not count. Without MongoDB every document counts as changed.
+    """
+    documents = dedupe_documents(documents, field)
+    if not documents:
+        return [], 0
+    found = connector.find_documents(collection, {field: {'$in': [document[field] for document in documents]}})
+    stored = {document[field]: document for document in found or []}
+    changed = [
+        document for document in documents
+        if document[field] not in stored or any(stored[document[field]].get(key) != value for key, value in document.items())
+    ]
+    return changed, len(documents) - len(changed)
@@ -0,0 +1,403 @@
+"""Priority frontier of names to crawl, best expected results first.
+
+A frontier queues the names of one platform, each with a score from
+`NameScorer` and the index it was read at from the name source; pushing a
+queued name again changes its score. The crawler stops reading the source
+while `FRONTIER_SIZE` names are queued, so no name is ever dropped, and its
+checkpoint stays below the index of every name still queued. Backends share
+the `push_many`/`pop_many`/`ack` API and are picked with the
+`FRONTIER_BACKEND` environment variable:
+
+- `redis` (default): a sorted set, so the frontier survives restarts. Popped
+  names are leased in a second sorted set until `ack`, names still leased
+  when a crawler starts are queued again by `requeue`. One consumer per key.
+- `memory`: a heap in the process, lost on exit; the checkpoint lets the
+  next run read the lost names from the source again.
+"""
+from __future__ import annotations
+import heapq
+import itertools
+import json
+import math
+import os
+import time
+from collections import Counter
+from typing import Iterable, Iterator, TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from freshness import CrawlLog
+from name_source import NAME_CACHE_DIR, cache_path
+from synccacher import ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+    from synccacher import Cacher
+
+# Move the best names to the leased set in one step, so none is lost between both
+POP_SCRIPT = """
+local items = redis.call('ZPOPMAX', KEYS[1], ARGV[1])
+for i = 1, #items, 2 do
+    redis.call('ZADD', KEYS[2], items[i + 1], items[i])
+end
+return items
+"""
+
+REQUEUE_SCRIPT = """
+local items = redis.call('ZRANGE', KEYS[2], 0, -1, 'WITHSCORES')
+for i = 1, #items, 2 do
+    redis.call('ZADD', KEYS[1], items[i + 1], items[i])
+end
+redis.call('DEL', KEYS[2])
+return #items / 2
+"""
+
+
+class PriorityFrontier:
+    """A max-priority queue of names in the process.
+
+    A new score pushes a new heap entry and leaves the old one behind; stale
+    entries are skipped when popped and dropped by rebuilding the heap once
+    they outnumber the live ones.
+    """
+
+    def __init__(self, maxsize: int = int(os.getenv('FRONTIER_SIZE', 10000))):
+        """Initialize the frontier."""
+        self.maxsize = maxsize
+        self._heap: list[tuple[float, int, str]] = []
+        self._entries: dict[str, tuple[float, int]] = {}
+        self._indexes: dict[str, int] = {}
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        """Return the number of queued names."""
+        return len(self._entries)
+
+    def __contains__(self, name: str) -> bool:
+        """Return True if the name is queued."""
+        return name in self._entries
+
+    def push_many(self, scores: dict[str, float], indexes: dict[str, int] | None = None) -> list[int]:
+        """Queue names or change their scores, return the `indexes` of names queued at another index."""
+        repeats = []
+        for name, index in (indexes or {}).items():
+            if self._indexes.setdefault(name, index) != index:
+                repeats.append(index)
+        for name, score in scores.items():
+            entry = next(self._counter)
+            self._entries[name] = (score, entry)
+            heapq.heappush(self._heap, (-score, entry, name))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._rebuild()
+        return repeats
+
+    def _rebuild(self):
+        """Rebuild the heap from the live entries."""
+        self._heap = [(-score, entry, name) for name, (score, entry) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def remove(self, names: Iterable[str]):
+        """Forget queued names."""
+        for name in names:
+            self._entries.pop(name, None)
+            self._indexes.pop(name, None)
+
+    def pop_many(self, count: int) -> list[tuple[str, float, int | None]]:
+        """Remove and return up to `count` names with the highest scores and their indexes."""
+        popped = []
+        while self._heap and len(popped) < count:
+            score, entry, name = heapq.heappop(self._heap)
+            if self._entries.get(name, (None, None))[1] == entry:
+                del self._entries[name]
+                popped.append((name, -score, self._indexes.pop(name, None)))
+        return popped
+
+    def members(self) -> Iterator[tuple[str, float]]:
+        """Yield every queued name and its score."""
+        for name, (score, _) in list(self._entries.items()):
+            yield name, score
+
+    def ack(self, names: Iterable[str]):
+        """Nothing to release, popped names are gone."""
+
+    def requeue(self) -> int:
+        """Nothing survives the process."""
+        return 0
+
+
+class RedisFrontier:
+    """A frontier stored as Redis sorted sets, `key` and `key:leased`, and the hash of indexes `key:index`."""
+
+    def __init__(self, cacher: Cacher, key: str, maxsize: int = int(os.getenv('FRONTIER_SIZE', 10000))):
+        """Initialize the frontier."""
+        self.cacher = cacher
+        self.key = key
+        self.leased_key = f'{key}:leased'
+        self.index_key = f'{key}:index'
+        self.maxsize = maxsize
+        self.logger: logging.Logger = CacherLogger()
+        self._pop = None
+        self._requeue = None
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    def __len__(self) -> int:
+        """Return the number of queued names."""
+        return (self._card() or 0) if self.client else 0
+
+    @ensure_connection
+    def _card(self) -> int:
+        """ZCARD of the frontier."""
+        return self.client.zcard(self.key)
+
+    @ensure_connection
+    def push_many(self, scores: dict[str, float], indexes: dict[str, int] | None = None) -> list[int]:
+        """Queue names or change their scores, return the `indexes` of names queued at another index."""
+        repeats, new = [], {}
+        if indexes:
+            # A name keeps its first index until it is acked, later reads of it are repeats
+            for (name, index), queued in zip(indexes.items(), self.client.hmget(self.index_key, list(indexes))):
+                if queued is None:
+                    new[name] = index
+                elif int(queued) != index:
+                    repeats.append(index)
+        if scores or new:
+            with self.client.pipeline(transaction=False) as pipe:
+                if scores:
+                    pipe.zadd(self.key, scores)
+                if new:
+                    pipe.hset(self.index_key, mapping=new)
+                pipe.execute()
+        return repeats
+
+    @ensure_connection
+    def remove(self, names: Iterable[str]):
+        """Forget queued names."""
+        names = list(names)
+        if names:
+            with self.client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self.key, *names)
+                pipe.hdel(self.index_key, *names)
+                pipe.execute()
+
+    @ensure_connection
+    def pop_many(self, count: int) -> list[tuple[str, float, int | None]]:
+        """Lease and return up to `count` names with the highest scores and their indexes."""
+        if self._pop is None:
+            self._pop = self.client.register_script(POP_SCRIPT)
+        items = self._pop(keys=[self.key, self.leased_key], args=[count])
+        names = items[::2]
+        indexes = self.client.hmget(self.index_key, names) if names else []
+        return [(name, float(score), None if index is None else int(index))
+                for name, score, index in zip(names, items[1::2], indexes)]
+
+    def members(self, batch: int = 1000) -> Iterator[tuple[str, float]]:
+        """Yield every queued name and its score, names rescored meanwhile may repeat."""
+        if self.client:
+            yield from self.client.zscan_iter(self.key, count=batch)
+
+    @ensure_connection
+    def ack(self, names: Iterable[str]):
+        """Release the lease of names whose results are stored."""
+        names = list(names)
+        if names:
+            with self.client.pipeline(transaction=False) as pipe:
+                pipe.zrem(self.leased_key, *names)
+                pipe.hdel(self.index_key, *names)
+                pipe.execute()
+
+    @ensure_connection
+    def requeue(self) -> int:
+        """Queue the leased names of a crawler that stopped before storing them."""
+        if self._requeue is None:
+            self._requeue = self.client.register_script(REQUEUE_SCRIPT)
+        count = self._requeue(keys=[self.key, self.leased_key])
+        if count:
+            self.logger.info(f'Requeued {count} leased names of {self.key}.')
+        return count
+
+
+class NameFrequencies:
+    """Estimate how many people share a full name from first and last name counts.
+
+    Only the two counters are kept, so the memory is bounded by the distinct
+    first and last names rather than the full names. Counts of a whole
+    source are cached in the name cache until the source changes, so only
+    the first worker scans it.
+    """
+
+    def __init__(self, first_names: Counter | None = None, last_names: Counter | None = None, rows: int = 0):
+        """Initialize the estimator."""
+        self.first_names = first_names or Counter()
+        self.last_names = last_names or Counter()
+        self.rows = rows
+
+    @classmethod
+    def from_source(cls, source, limit: int | None = None, cache_dir: str = NAME_CACHE_DIR) -> NameFrequencies:
+        """Count the names of a source with rows, a generated source counts every name once."""
+        if source.unique or not hasattr(source, 'rows'):
+            return cls()
+        path = getattr(source, 'path', None)
+        cached = limit is None and path is not None and os.path.exists(path)
+        if cached:
+            stat = os.stat(path)
+            signature = [stat.st_size, stat.st_mtime_ns]
+            counts_path = cache_path(path, '.freq.json', cache_dir)
+            frequencies = cls.load(counts_path, signature)
+            if frequencies is not None:
+                return frequencies
+        first_names, last_names, rows = Counter(), Counter(), 0
+        for row, _ in itertools.islice(source.rows(), limit):
+            first_names[row[0].lower()] += 1
+            last_names[row[1].lower()] += 1
+            rows += 1
+        frequencies = cls(first_names, last_names, rows)
+        if cached:
+            frequencies.save(counts_path, signature)
+        return frequencies
+
+    @classmethod
+    def load(cls, path: str, signature: list[int]) -> NameFrequencies | None:
+        """Read cached counts, None if missing or counted from another version of the source."""
+        try:
+            with open(path, 'r', encoding='utf-8') as fp:
+                counts = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        if counts.get('signature') != signature:
+            return None
+        return cls(Counter(counts['first_names']), Counter(counts['last_names']), counts['rows'])
+
+    def save(self, path: str, signature: list[int]):
+        """Cache the counts, a read-only cache only costs the next worker a scan."""
+        counts = {'signature': signature, 'rows': self.rows,
+                  'first_names': self.first_names, 'last_names': self.last_names}
+        # Workers may count the same source at once, each writes its own file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'w', encoding='utf-8') as fp:
+                json.dump(counts, fp)
+            os.replace(tmp_path, path)
+        except OSError as exp:
+            CacherLogger().warning(f'Unable to cache the name counts in {path}:\n{exp}')
+
+    def estimate(self, full_name: str) -> float:
+        """Return the expected number of people named `full_name`, at least 1."""
+        if not self.rows:
+            return 1.0
+        first_name, _, last_name = full_name.lower().partition(' ')
+        return max(1.0, self.first_names[first_name] * self.last_names[last_name] / self.rows)
+
+
+def parse_scores(value: str, defaults: dict[str, float]) -> dict[str, float]:
+    """Parse `frequency=1,yield=2`, factors left out keep their default."""
+    weights = dict(defaults)
+    for item in filter(None, value.split(',')):
+        factor, weight = item.split('=')
+        if factor.strip() in weights:
+            weights[factor.strip()] = float(weight)
+    return weights
+
+
+class NameScorer:
+    """Score the names of a platform by what searching them is expected to return.
+
+        score = frequency * log(1 + people sharing the name)
+              + yield * mean profiles kept per search of the surname
+              + recency * min(days since the last crawl / recrawl_days, 1)
+
+    A name never crawled counts as fully stale. Yields are kept per surname
+    in the `yield:<country>:<platform>` hash and crawl times come from the
+    `CrawlLog` of the platform, so every worker learns from every other
+    one. Weights come from `FRONTIER_WEIGHTS`, a negative one turns a
+    factor into a penalty.
+    """
+
+    defaults = {'frequency': 1.0, 'yield': 1.0, 'recency': 1.0}
+
+    def __init__(self,
+        cacher: Cacher,
+        platform: str,
+        frequencies: NameFrequencies | None = None,
+        country: str = 'Sweden',
+        weights: str = os.getenv('FRONTIER_WEIGHTS', ''),
+        recrawl_days: float = float(os.getenv('FRONTIER_RECRAWL_DAYS', 30))
+    ):
+        """Initialize the scorer."""
+        self.cacher = cacher
+        self.frequencies = frequencies or NameFrequencies()
+        self.weights = parse_scores(weights, self.defaults)
+        self.recrawl_days = recrawl_days
+        self.yield_key = f'yield:{country}:{platform}'
+        self.crawled_key = CrawlLog(cacher, platform, country).key
+        self.logger: logging.Logger = CacherLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    @staticmethod
+    def surname(full_name: str) -> str:
+        """Return the lowercase last name."""
+        return full_name.lower().partition(' ')[2]
+
+    @ensure_connection
+    def _history(self, full_names: list[str]) -> tuple[list, list]:
+        """Read the surname yields and crawl times of names in one round trip."""
+        fields = []
+        for full_name in full_names:
+            surname = self.surname(full_name)
+            fields.extend([f'{surname}:searches', f'{surname}:kept'])
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.hmget(self.yield_key, fields)
+            pipe.zmscore(self.crawled_key, [full_name.lower() for full_name in full_names])
+            return tuple(pipe.execute())
+
+    def scores(self, full_names: list[str]) -> dict[str, float]:
+        """Score a batch of names."""
+        if not full_names:
+            return {}
+        history = self._history(full_names) if self.client else None
+        counts, crawled = history or ([None] * 2 * len(full_names), [None] * len(full_names))
+        now = time.time()
+        scores = {}
+        for i, full_name in enumerate(full_names):
+            searches, kept = int(counts[2 * i] or 0), int(counts[2 * i + 1] or 0)
+            # One imaginary empty search keeps a single lucky hit from dominating
+            mean_kept = kept / (searches + 1)
+            if crawled[i] is None:
+                staleness = 1.0
+            else:
+                staleness = min((now - crawled[i]) / 86400 / self.recrawl_days, 1.0)
+            scores[full_name] = (
+                self.weights['frequency'] * math.log1p(self.frequencies.estimate(full_name))
+                + self.weights['yield'] * mean_kept
+                + self.weights['recency'] * staleness
+            )
+        return scores
+
+    @ensure_connection
+    def record(self, kept: dict[str, int]):
+        """Record how many profiles the searches of names kept."""
+        if not kept:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for full_name, count in kept.items():
+                surname = self.surname(full_name)
+                pipe.hincrby(self.yield_key, f'{surname}:searches', 1)
+                pipe.hincrby(self.yield_key, f'{surname}:kept', count)
+            pipe.execute()
+
+
+def frontier_from_env(cacher: Cacher, name: str):
+    """Build the configured frontier backend."""
+    backend = os.getenv('FRONTIER_BACKEND', 'redis')
+    if backend == 'redis':
+        return RedisFrontier(cacher, f'frontier:{name}')
+    if backend == 'memory':
+        return PriorityFrontier()
+    raise ValueError(f'Unknown frontier backend {backend}')
@@ -0,0 +1,328 @@
+"""HTTP API for on-demand name lookups, served at /api/index through vercel.json.
+
+    GET /api/search?name=Anna Berg&platforms=facebook,linkedin
+    GET /api/jobs/<job_id>?wait=10
+    GET /api/jobs/<job_id>/events
+
+A lookup is answered from cached search responses in Redis, then from the
+`lookups` collection in MongoDB. Platforms missing from both are searched by
+a background job and the response is a 202 pointing at the job, which can be
+polled (optionally long-polled with `wait`) or streamed as server-sent
+events. The job id is derived from the name and platforms, so concurrent
+requests for the same lookup share one job instead of crawling twice.
+"""
+from __future__ import annotations
+import atexit
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, TYPE_CHECKING
+
+from flask import Flask, Response, jsonify, request, stream_with_context
+
+from custom_logger import ApiLogger
+from lru import LRUCache
+from mongo import BackgroundWriter, MongoDBConnector
+from serp_crawler import SearchResult, query_schema
+from synccacher import Cacher
+
+if TYPE_CHECKING:
+    import logging
+
+DEFAULT_PLATFORMS = ["facebook", "linkedin", "twitter", "tiktok", "instagram"]
+FINISHED = ('done', 'failed')
+
+app = Flask(__name__)
+logger: logging.Logger = ApiLogger()
+
+
+class Job:
+    """The state of a background lookup."""
+
+    def __init__(self, job_id: str, name: str, platforms: list[str]):
+        """Initialize a queued job."""
+        self.id = job_id
+        self.name = name
+        self.platforms = platforms
+        self.status = 'queued'
+        self.results: dict[str, list[dict]] = {}
+        self.errors: dict[str, str] = {}
+        self.version = 0
+        self.updated_at = time.time()
+        self.token = uuid.uuid4().hex
+
+    def to_dict(self) -> dict[str, Any]:
+        """Return the JSON view of the job."""
+        return {
+            'job': self.id,
+            'name': self.name,
+            'platforms': self.platforms,
+            'status': self.status,
+            'results': self.results,
+            'errors': self.errors,
+            'version': self.version,
+            'updated_at': self.updated_at,
+        }
+
+
+class JobManager:
+    """Run lookups on a bounded thread pool and publish their state to Redis.
+
+    A job already queued or running for the same name and platforms, in this
+    process or (through its Redis state) in another one, is returned instead
+    of starting a new search. The process starting a job takes its Redis
+    lease with SET NX EX, so only one of them runs it. Redis state expires
+    after `ttl` seconds, and a job not updated for `stale_after` seconds is
+    considered dead: its lease runs out and the next lookup starts it again.
+    """
+
+    def __init__(self,
+        max_workers: int = int(os.getenv('API_JOB_WORKERS', 4)),
+        ttl: int = int(os.getenv('API_JOB_TTL', 3600)),
+        stale_after: int = int(os.getenv('API_JOB_STALE', 300))
+    ):
+        """Initialize the manager."""
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='lookup')
+        self.ttl = ttl
+        self.stale_after = stale_after
+        self.cacher = Cacher(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        self.cacher.connect()
+        self.connector = MongoDBConnector()
+        self.connector.connect()
+        self.writer = BackgroundWriter(self.connector)
+        self._jobs: dict[str, Job] = {}
+        self._finished = LRUCache(int(os.getenv('API_JOB_HISTORY', 1000)))
+        self._changed = threading.Condition()
+
+    @staticmethod
+    def job_id(name: str, platforms: list[str]) -> str:
+        """Return the id shared by every lookup of a name and platforms."""
+        key = f"{name.lower()}|{','.join(sorted(platforms))}"
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=12).hexdigest()
+
+    def lookup_cached(self, name: str, platforms: list[str]) -> tuple[dict[str, list[dict]], dict[str, str]]:
+        """Return the results found in Redis or MongoDB and where each came from."""
+        results, sources = {}, {}
+        for platform in platforms:
+            cached = SearchResult.cached_text_results(name, platform)
+            if cached is not None:
+                results[platform], sources[platform] = cached, 'redis'
+        missing = [platform for platform in platforms if platform not in results]
+        if missing:
+            keys = [self.lookup_key(name, platform) for platform in missing]
+            for document in self.connector.find_documents('lookups', {'lookup': {'$in': keys}}) or []:
+                results[document['platform']], sources[document['platform']] = document['results'], 'mongo'
+        return results, sources
+
+    @staticmethod
+    def lookup_key(name: str, platform: str) -> str:
+        """Return the key of a stored lookup, the crawler's done flag of the name."""
+        return f"{name.lower()}:{platform}:v2"
+
+    def submit(self, name: str, platforms: list[str]) -> dict[str, Any]:
+        """Start a lookup, or join the one already running."""
+        job_id = self.job_id(name, platforms)
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status not in FINISHED and time.time() - job.updated_at < self.stale_after:
+                return job.to_dict()
+            job = Job(job_id, name, platforms)
+            # False when another process holds the lease, None without Redis
+            if self.cacher.claim(['job', job_id, 'lease'], job.token, self.stale_after) is False:
+                # The holder publishes right after taking the lease, until then the job is queued
+                return self.cacher.get(['job', job_id]) or job.to_dict()
+            self._jobs[job_id] = job
+            self._publish(job)
+        self.executor.submit(self.run, job)
+        return job.to_dict()
+
+    def _publish(self, job: Job):
+        """Record a change of a job. Caller holds the condition."""
+        if self._jobs.get(job.id) is not job:
+            # A stale job was replaced, the new one owns the state
+            return
+        job.version += 1
+        job.updated_at = time.time()
+        self.cacher.insert_with_ttl(['job', job.id], job.to_dict(), self.ttl)
+        self.cacher.renew(['job', job.id, 'lease'], self.stale_after)
+        self._changed.notify_all()
+
+    def update(self, job: Job, **changes):
+        """Change a job and publish it."""
+        with self._changed:
+            for attribute, value in changes.items():
+                setattr(job, attribute, value)
+            self._publish(job)
+
+    def run(self, job: Job):
+        """Search every platform of a job and store the results, the job always ends done or failed."""
+        status = 'failed'
+        try:
+            self.update(job, status='running')
+            self.search_platforms(job)
+            if job.results or not job.errors:
+                status = 'done'
+        except Exception as exp:
+            logger.error(f'Lookup job {job.id} of {job.name} failed: {exp}')
+        finally:
+            with self._changed:
+                job.status = status
+                self._publish(job)
+                if self._jobs.get(job.id) is job:
+                    # Only the latest finished jobs stay in memory, older ones are served from Redis
+                    self._finished.put(job.id, self._jobs.pop(job.id))
+            self.cacher.release(['job', job.id, 'lease'], job.token)
+
+    def search_platforms(self, job: Job):
+        """Search the platforms of a job and hand the results to the writer."""
+        for platform in job.platforms:
+            try:
+                results = SearchResult.search_with_retry(job.name, platform)
+            except Exception as exp:
+                logger.error(f'Lookup of {job.name} on {platform} failed: {exp}')
+                results = None
+            if results is None:
+                self.update(job, errors={**job.errors, platform: 'Search failed or throttled, retry later.'})
+                continue
+            key = self.lookup_key(job.name, platform)
+            # Copies, the writer stamps `updated_at` on what it writes
+            self.writer.submit('scrapped_profiles_v2', [dict(result) for result in results], 'url')
+            self.writer.submit(
+                'lookups', [{'lookup': key, 'name': job.name, 'platform': platform, 'results': results}], 'lookup',
+                on_flush=lambda key=key: self.cacher.insert_many({key: True})
+            )
+            self.update(job, results={**job.results, platform: results})
+
+    def get(self, job_id: str) -> dict[str, Any] | None:
+        """Return the state of a job."""
+        with self._changed:
+            job = self._jobs.get(job_id) or self._finished.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        return self.cacher.get(['job', job_id])
+
+    def wait(self, job_id: str, version: int, timeout: float) -> dict[str, Any] | None:
+        """Return the state of a job once it is newer than `version` or finished, or at the timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            state = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if state is None or state['version'] > version or state['status'] in FINISHED or remaining <= 0:
+                return state
+            with self._changed:
+                # Jobs of other processes are only visible through Redis, poll them
+                self._changed.wait(min(remaining, 0.5))
+
+    def close(self):
+        """Finish the running jobs and their writes."""
+        self.executor.shutdown(wait=True)
+        self.writer.close()
+        self.connector.disconnect()
+
+
+_manager: JobManager | None = None
+_manager_lock = threading.Lock()
+
+
+def manager() -> JobManager:
+    """Return the job manager, created on the first request."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+            atexit.register(_manager.close)
+        return _manager
+
+
+def parse_platforms(value: str | None) -> list[str]:
+    """Parse a comma separated platform list, raising ValueError for unknown platforms."""
+    platforms = [platform.strip() for platform in (value or '').split(',') if platform.strip()]
+    unknown = [platform for platform in platforms if platform not in query_schema]
+    if unknown:
+        raise ValueError(f"Unknown platforms: {', '.join(unknown)}")
+    return list(dict.fromkeys(platforms)) or DEFAULT_PLATFORMS
+
+
+@app.route('/')
+@app.route('/api/index')
+def health():
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/api/search')
+def search():
+    name = ' '.join(request.args.get('name', '').split())
+    if not name:
+        return jsonify({'error': 'The name parameter is required.'}), 400
+    try:
+        platforms = parse_platforms(request.args.get('platforms'))
+    except ValueError as exp:
+        return jsonify({'error': str(exp)}), 400
+
+    jobs = manager()
+    results, sources = jobs.lookup_cached(name, platforms)
+    missing = [platform for platform in platforms if platform not in results]
+    if not missing:
+        return jsonify({'name': name, 'status': 'done', 'results': results, 'sources': sources})
+
+    job = jobs.submit(name, missing)
+    return jsonify({
+        'name': name,
+        'status': job['status'],
+        'results': results,
+        'sources': sources,
+        'job': job['job'],
+        'status_url': f"/api/jobs/{job['job']}",
+        'events_url': f"/api/jobs/{job['job']}/events",
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id: str):
+    try:
+        wait = min(float(request.args.get('wait', 0) or 0), 30.0)
+    except ValueError:
+        return jsonify({'error': 'The wait parameter must be a number of seconds.'}), 400
+    jobs = manager()
+    state = jobs.get(job_id)
+    if state is not None and wait > 0 and state['status'] not in FINISHED:
+        state = jobs.wait(job_id, float('inf'), wait)
+    if state is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+    return jsonify(state)
+
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id: str):
+    jobs = manager()
+    if jobs.get(job_id) is None:
+        return jsonify({'error': 'Unknown job.'}), 404
+
+    def events():
+        version = 0
+        while True:
+            state = jobs.wait(job_id, version, 15.0)
+            if state is None:
+                return
+            if state['version'] > version:
+                version = state['version']
+                yield f"event: {state['status']}\ndata: {json.dumps(state, default=str)}\n\n"
+            else:
+                # Keeps proxies from closing an idle stream
+                yield ': keep-alive\n\n'
+            if state['status'] in FINISHED:
+                return
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+if __name__ == "__main__":
+    app.run(port=int(os.getenv('PORT', 5000)), threaded=True)
@@ -0,0 +1,56 @@
+"""A small thread-safe LRU map shared by the in-process caches."""
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    """Keep the `maxsize` most recently used keys, evicting the oldest first."""
+
+    def __init__(self, maxsize: int = 100000):
+        """Initialize the cache."""
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of cached keys."""
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Return True if the key is cached, without touching its recency."""
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value of a key and mark it as recently used."""
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Cache a value, evicting the least recently used key if full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove a key and return its value."""
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        """Drop every key."""
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,62 @@
+"""One-off migration of stored profile URLs to their canonical form.
+
+Documents written before `normalize` existed are keyed by whatever URL DDG
+returned, so upserts of the canonical URL would add a second document for
+the same profile. Every stored variant is folded into the document of its
+canonical URL: a canonical document that already exists is kept as is,
+otherwise the variant is inserted under the canonical URL, and the variant
+is deleted.
+
+    python migrate_urls.py [--dry-run] [collection ...]
+"""
+from __future__ import annotations
+import sys
+import time
+
+from pymongo import DeleteOne, UpdateOne
+
+from mongo import MongoDBConnector
+from normalize import canonical_url
+
+COLLECTIONS = ['scrapped_profiles_v2', 'serp_result_image']
+
+
+def migrate(connector: MongoDBConnector, collection: str, dry_run: bool = False, batch_size: int = 1000) -> int:
+    """Fold the documents of a collection into their canonical URLs, return how many were moved."""
+    documents = connector.get_collection(collection)
+    if documents is None:
+        return 0
+    moved = 0
+    operations = []
+    st_time = time.monotonic()
+    for document in documents.find({'url': {'$type': 'string'}}):
+        canonical = canonical_url(document['url'], document.get('platform'))
+        if canonical == document['url']:
+            continue
+        moved += 1
+        fields = {key: value for key, value in document.items() if key not in ('_id', 'url')}
+        operations += [
+            UpdateOne({'url': canonical}, {'$setOnInsert': fields}, upsert=True),
+            DeleteOne({'_id': document['_id']}),
+        ]
+        if len(operations) >= batch_size and not dry_run:
+            documents.bulk_write(operations, ordered=True)
+            operations = []
+    if operations and not dry_run:
+        documents.bulk_write(operations, ordered=True)
+    action = 'Would move' if dry_run else 'Moved'
+    connector.logger.success(f'{action} {moved} documents of {collection} in [{time.monotonic() - st_time:.2f}]s')
+    return moved
+
+
+def main():
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    collections = [arg for arg in args if arg != '--dry-run'] or COLLECTIONS
+    with MongoDBConnector() as connector:
+        for collection in collections:
+            migrate(connector, collection, dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,17 +2,25 @@
 from __future__ import annotations
 from dotenv import load_dotenv
 from functools import wraps
+import atexit
+import hashlib
+import json
 import os
+import queue
 import threading
 import time
+from collections import defaultdict
 from datetime import datetime
-from typing import TYPE_CHECKING
+from typing import Callable, TYPE_CHECKING
 
+import bson
 from pymongo import MongoClient, UpdateOne
 from pymongo.server_api import ServerApi
 from pymongo.errors import BulkWriteError, ConnectionFailure
 
 from custom_logger import MongoLogger
+from lru import LRUCache
+from normalize import canonical_document
 
 if TYPE_CHECKING:
     import logging
@@ -150,7 +158,7 @@ class MongoDBConnector:
             self.logger.error(f"Bulk write error: {bwe.details}")
 
     @ensure_connection
-    def bulk_upsert_updated(self, collection: str, documents: list[dict],filter_field: str):
+    def bulk_upsert_updated(self, collection: str, documents: list[dict],filter_field: str, ordered: bool = True):
         """Bulk upsert documents in MongoDB."""
         st_time = time.monotonic()
         bulk_operations = []
@@ -164,11 +172,12 @@ class MongoDBConnector:
             )
 
         try:
-            result = self.client[self.database][collection].bulk_write(bulk_operations)
+            result = self.client[self.database][collection].bulk_write(bulk_operations, ordered=ordered)
             self.logger.success(f"Updated Collection in [{time.monotonic() - st_time:.2f}]s")
             self.logger.info(f"Inserted {result.upserted_count} new records.")
             self.logger.info(f"Modified {result.modified_count} existing records.")
-            
+            return result
+
         except BulkWriteError as bwe:
             self.logger.error(f"Updated Bulk write error: {bwe.details}")
 
@@ -183,10 +192,301 @@ class MongoDBConnector:
         return False
 
 
+def write_dead_letter(directory: str, collection: str, filter_field: str, documents: list[dict]) -> str:
+    """Append documents that could not be written to a JSON lines file, return its path.
+
+    Every line holds the collection, the filter field and the document, so
+    the file can be replayed once the cause of the failure is fixed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{collection}-{os.getpid()}.jsonl')
+    lines = ''.join(
+        json.dumps({'collection': collection, 'filter_field': filter_field, 'document': document},
+                   ensure_ascii=False, default=str) + '\n'
+        for document in documents
+    )
+    with open(path, 'a', encoding='utf-8') as fp:
+        fp.write(lines)
+        fp.flush()
+        os.fsync(fp.fileno())
+    return path
+
+
+class WriteBehindBuffer:
+    """Collect upserts across many names and flush them in batches.
+
+    Documents are kept per collection and filter field, deduplicated on the
+    filter value (canonical profile URLs when the field is `url`, variants of a
+    profile are merged), and written with one unordered `bulk_write` per collection
+    once `max_documents` documents or `max_bytes` BSON bytes are buffered, or
+    `max_interval` seconds passed since the last flush. Callbacks registered
+    with `add` run after the flush that wrote their documents, so callers
+    can mark work as done only once it left the process; a collection whose
+    write failed keeps its documents and callbacks for the next flush. After
+    `max_retries` failed flushes in a row its documents go to a dead-letter
+    file in `dead_letter_dir` and their callbacks run, if that fails too they
+    are dropped with their callbacks. The digests of the last
+    `written_cache_size` written documents are remembered, an unchanged
+    repeat is dropped before it reaches the database.
+    """
+
+    def __init__(self,
+        connector: MongoDBConnector,
+        max_documents: int = int(os.getenv('MONGO_BUFFER_DOCUMENTS', 500)),
+        max_bytes: int = int(os.getenv('MONGO_BUFFER_BYTES', 4 * 1024 * 1024)),
+        max_interval: float = float(os.getenv('MONGO_BUFFER_INTERVAL', 10)),
+        written_cache_size: int = int(os.getenv('MONGO_WRITTEN_CACHE', 100000)),
+        normalize: bool = True,
+        max_retries: int = int(os.getenv('MONGO_MAX_RETRIES', 3)),
+        dead_letter_dir: str = os.getenv('DEAD_LETTER_DIR', 'dead_letter')
+    ):
+        """Initialize the buffer."""
+        self.connector = connector
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval
+        self.normalize = normalize
+        self.max_retries = max_retries
+        self.dead_letter_dir = dead_letter_dir
+        self.written = LRUCache(written_cache_size)
+        self.skipped = 0
+        self._documents: dict[tuple[str, str], dict] = defaultdict(dict)
+        self._sizes: dict[tuple[str, str, object], tuple[int, bytes]] = {}
+        self._callbacks: list[tuple[tuple[str, str], Callable[[], object]]] = []
+        self._failures: dict[tuple[str, str], int] = {}
+        self._count = 0
+        self._bytes = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self.logger: logging.Logger = MongoLogger()
+
+    def add(self, collection: str, documents: list[dict], filter_field: str, on_flush: Callable[[], object] | None = None):
+        """Buffer documents for an upsert and flush if a threshold is reached."""
+        with self._lock:
+            batch = self._documents[(collection, filter_field)]
+            for document in documents:
+                if self.normalize and filter_field == 'url':
+                    document = canonical_document(document)
+                value = document[filter_field]
+                previous = self._sizes.get((collection, filter_field, value))
+                if previous is not None:
+                    document = {**batch[value], **document}
+                encoded = bson.encode(document)
+                digest = hashlib.blake2b(encoded, digest_size=16).digest()
+                if previous is None:
+                    if self.written.get((collection, value)) == digest:
+                        # Written unchanged since, nothing to update
+                        self.skipped += 1
+                        continue
+                    self._count += 1
+                else:
+                    self._bytes -= previous[0]
+                batch[value] = document
+                self._sizes[(collection, filter_field, value)] = (len(encoded), digest)
+                self._bytes += len(encoded)
+            if on_flush is not None:
+                self._callbacks.append(((collection, filter_field), on_flush))
+            if self.should_flush():
+                self.flush()
+
+    def should_flush(self) -> bool:
+        """Return True once any of the thresholds is reached."""
+        return (
+            self._count >= self.max_documents
+            or self._bytes >= self.max_bytes
+            or time.monotonic() - self._last_flush >= self.max_interval
+        )
+
+    def flush(self):
+        """Write every buffered document and run the callbacks of the collections written."""
+        with self._lock:
+            documents, sizes, callbacks = self._documents, self._sizes, self._callbacks
+            count = self._count
+            self._documents = defaultdict(dict)
+            self._sizes = {}
+            self._callbacks = []
+            self._count = 0
+            self._bytes = 0
+            self._last_flush = time.monotonic()
+
+            failed, dropped = set(), set()
+            for (collection, filter_field), batch in documents.items():
+                if not batch:
+                    continue
+                key = (collection, filter_field)
+                try:
+                    result = self.connector.bulk_upsert_updated(collection, list(batch.values()), filter_field, ordered=False)
+                except Exception as exp:
+                    self.logger.error(f'Error while writing {collection}:\n{exp}')
+                    result = None
+                if result is None:
+                    self._failures[key] = self._failures.get(key, 0) + 1
+                    if self._failures[key] <= self.max_retries:
+                        failed.add(key)
+                        self._restore(collection, filter_field, batch, sizes)
+                    else:
+                        # Given up on, e.g. a document the server always rejects would block the collection
+                        del self._failures[key]
+                        if not self._dead_letter(collection, filter_field, list(batch.values())):
+                            dropped.add(key)
+                    continue
+                self._failures.pop(key, None)
+                for value in batch:
+                    self.written.put((collection, value), sizes[(collection, filter_field, value)][1])
+            if failed:
+                self.logger.warning(f"Kept {self._count} documents of {len(failed)} failed writes for the next flush.")
+            if count - self._count:
+                self.logger.info(f"Flushed {count - self._count} buffered documents.")
+            for key, callback in callbacks:
+                if key in failed:
+                    self._callbacks.append((key, callback))
+                    continue
+                if key in dropped:
+                    continue
+                try:
+                    callback()
+                except Exception as exp:
+                    self.logger.error(f'Error while executing flush callback:\n{exp}')
+
+    def _dead_letter(self, collection: str, filter_field: str, documents: list[dict]) -> bool:
+        """Move the documents of a write given up on to the dead-letter file, return True if they were kept."""
+        try:
+            path = write_dead_letter(self.dead_letter_dir, collection, filter_field, documents)
+        except Exception as exp:
+            self.logger.error(f'Dropped {len(documents)} documents of {collection} after {self.max_retries} retries:\n{exp}')
+            return False
+        self.logger.error(f'Moved {len(documents)} documents of {collection} to {path} after {self.max_retries} retries.')
+        return True
+
+    def _restore(self, collection: str, filter_field: str, batch: dict, sizes: dict):
+        """Buffer the documents of a failed write again."""
+        self._documents[(collection, filter_field)] = batch
+        for value in batch:
+            size = self._sizes[(collection, filter_field, value)] = sizes[(collection, filter_field, value)]
+            self._count += 1
+            self._bytes += size[0]
+
+    def close(self):
+        """Drain the buffer."""
+        self.flush()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Drain the buffer on exit."""
+        self.close()
+        return False
+
+
+class BackgroundWriter:
+    """Upsert documents from a bounded queue on a fixed pool of writer threads.
+
+    Every thread drains whatever is queued, up to `batch_documents`, into its
+    own `WriteBehindBuffer` and writes it in one flush, so calls arriving
+    together are coalesced and deduplicated. All threads share one client.
+    `submit` blocks while `max_queue` batches are waiting, which bounds the
+    memory held no matter how fast results arrive.
+    """
+
+    def __init__(self,
+        connector: MongoDBConnector | None = None,
+        workers: int = int(os.getenv('MONGO_WRITER_THREADS', 2)),
+        max_queue: int = int(os.getenv('MONGO_WRITER_QUEUE', 1000)),
+        batch_documents: int = int(os.getenv('MONGO_BUFFER_DOCUMENTS', 500))
+    ):
+        """Initialize the writer and start its threads."""
+        self._owns_connector = connector is None
+        self.connector = connector or MongoDBConnector()
+        if self._owns_connector:
+            self.connector.connect()
+        self.batch_documents = batch_documents
+        self.logger: logging.Logger = MongoLogger()
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f'MongoDB-{i}', daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, collection: str, documents: list[dict], filter_field: str,
+               on_flush: Callable[[], object] | None = None, timeout: float | None = None):
+        """Queue documents for an upsert, waiting up to `timeout` seconds while the queue is full."""
+        if self._closed:
+            raise RuntimeError('The writer is closed.')
+        self._queue.put((collection, documents, filter_field, on_flush), timeout=timeout)
+
+    def _work(self):
+        """Write queued batches until a stop marker arrives."""
+        buffer = WriteBehindBuffer(self.connector, max_documents=self.batch_documents, max_interval=float('inf'))
+        running = True
+        while running:
+            items = [self._queue.get()]
+            # Every thread takes exactly one stop marker
+            count = len(items[0][1]) if items[0] is not None else self.batch_documents
+            while count < self.batch_documents:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+                if items[-1] is None:
+                    break
+                count += len(items[-1][1])
+            try:
+                for item in items:
+                    if item is None:
+                        running = False
+                    else:
+                        buffer.add(*item)
+                buffer.flush()
+            except Exception as exp:
+                self.logger.error(f'Error while writing in the background:\n{exp}')
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Wait until every submitted document is written."""
+        self._queue.join()
+
+    def close(self):
+        """Write what is queued, stop the threads and release the client."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._owns_connector:
+            self.connector.disconnect()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the writer on exit."""
+        self.close()
+        return False
+
+
+_image_writer: BackgroundWriter | None = None
+_image_writer_lock = threading.Lock()
+
+
+def image_writer() -> BackgroundWriter:
+    """Return the process-wide writer of image results, closed at exit."""
+    global _image_writer
+    with _image_writer_lock:
+        if _image_writer is None:
+            _image_writer = BackgroundWriter()
+            atexit.register(_image_writer.close)
+        return _image_writer
+
+
 def save_image_profiles(data: dict):
-    """Save the scraped data to MongoDB."""
-    def save(data):
-        with MongoDBConnector() as connector:
-            connector.bulk_upsert_updated('serp_result_image',data,'url')
-    mongo_thread = threading.Thread(target=save, args=(data,), name='MongoDB')
-    mongo_thread.start()
+    """Save the scraped data to MongoDB in the background."""
+    image_writer().submit('serp_result_image', data, 'url')
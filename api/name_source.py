@@ -0,0 +1,487 @@
+"""Streaming, seekable sources of names to search."""
+from __future__ import annotations
+import csv
+import hashlib
+import io
+import json
+import mmap
+import random
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from typing import Callable, Iterable, Iterator, TYPE_CHECKING
+
+from custom_logger import CrawlerLogger
+
+if TYPE_CHECKING:
+    import logging
+
+INDEX_MAGIC = b'SNI2'
+INDEX_HEADER = struct.Struct('<4sIQQQ')
+TABLE_MAGIC = b'SNT1'
+TABLE_HEADER = struct.Struct('<4sIQ')
+OFFSET = struct.Struct('<Q')
+# Bumped when compiled name lists change meaning, older tables are compiled again
+NAMES_VERSION = 2
+# Files derived from the name lists, kept out of the source tree
+NAME_CACHE_DIR = os.getenv('NAME_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'name_tables'))
+
+
+def cache_path(path: str, suffix: str, cache_dir: str = NAME_CACHE_DIR) -> str:
+    """Return where a file derived from `path` is cached, sources of other directories never collide."""
+    path = os.path.abspath(path)
+    digest = hashlib.blake2b(path.encode('utf-8'), digest_size=4).hexdigest()
+    return os.path.join(cache_dir, f'{os.path.splitext(os.path.basename(path))[0]}.{digest}{suffix}')
+
+
+def parse_line(line: bytes) -> list[str]:
+    """Parse a single CSV line."""
+    return next(csv.reader([line.decode('utf-8').rstrip('\r\n')]), [])
+
+
+class CsvNameSource:
+    """Read a CSV of names lazily and resume anywhere in constant time.
+
+    A sidecar index (`<csv>.idx`) stores the row count and the byte offset
+    of every `stride`-th row, so resuming at row N costs one seek plus at
+    most `stride` line reads instead of parsing the whole file. The index is
+    built on the first deep resume or length query and rebuilt whenever the
+    CSV changes size or modification time.
+    A byte offset returned through `offset` can also be passed back directly.
+    """
+
+    # Rows may repeat a name, and the checkpoint is the row index
+    unique = False
+    checkpoint_suffix: tuple[str, ...] = ()
+
+    def __init__(self, path: str, index_path: str | None = None, stride: int = 1024):
+        """Initialize the name source."""
+        self.path = path
+        self.index_path = index_path or f'{path}.idx'
+        self.stride = stride
+        self.offset = 0
+        self.logger: logging.Logger = CrawlerLogger()
+
+    def _signature(self) -> tuple[int, int]:
+        """Return the size and modification time of the CSV."""
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def build_index(self):
+        """Write the sidecar index of row offsets."""
+        size, mtime = self._signature()
+        offsets = array('Q')
+        position = rows = 0
+        with open(self.path, 'rb') as fp:
+            for rows, line in enumerate(fp, 1):
+                if (rows - 1) % self.stride == 0:
+                    offsets.append(position)
+                position += len(line)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        tmp_path = f'{self.index_path}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(INDEX_HEADER.pack(INDEX_MAGIC, self.stride, size, mtime, rows))
+            offsets.tofile(fp)
+        os.replace(tmp_path, self.index_path)
+
+    def seek_row(self, row: int) -> tuple[int, int]:
+        """Return the closest indexed (row, byte offset) at or before `row`."""
+        if row < self.stride:
+            return 0, 0
+        try:
+            if not self._index_valid():
+                self.build_index()
+            with open(self.index_path, 'rb') as fp:
+                _, stride, _, _, _ = INDEX_HEADER.unpack(fp.read(INDEX_HEADER.size))
+                slot = row // stride
+                fp.seek(INDEX_HEADER.size + slot * OFFSET.size)
+                data = fp.read(OFFSET.size)
+            if len(data) < OFFSET.size:
+                # Past the end of the file, scan from the last indexed row
+                slot = (os.path.getsize(self.index_path) - INDEX_HEADER.size) // OFFSET.size - 1
+                return self.seek_row(slot * stride)
+            return slot * stride, OFFSET.unpack(data)[0]
+        except OSError as exp:
+            self.logger.warning(f'Unable to use the name index, scanning instead:\n{exp}')
+            return 0, 0
+
+    def _index_valid(self) -> bool:
+        """Check that the sidecar index matches the CSV."""
+        try:
+            with open(self.index_path, 'rb') as fp:
+                header = fp.read(INDEX_HEADER.size)
+        except FileNotFoundError:
+            return False
+        if len(header) < INDEX_HEADER.size:
+            return False
+        magic, stride, size, mtime, _ = INDEX_HEADER.unpack(header)
+        return magic == INDEX_MAGIC and stride == self.stride and (size, mtime) == self._signature()
+
+    def __len__(self) -> int:
+        """Return the row count of the index, the file is only scanned when the index is stale."""
+        try:
+            if not self._index_valid():
+                self.build_index()
+            with open(self.index_path, 'rb') as fp:
+                return INDEX_HEADER.unpack(fp.read(INDEX_HEADER.size))[4]
+        except OSError as exp:
+            self.logger.warning(f'Unable to use the name index, counting instead:\n{exp}')
+        with open(self.path, 'rb') as fp:
+            return sum(1 for _ in fp)
+
+    def rows(self, start: int = 0, offset: int | None = None) -> Iterator[tuple[list[str], int]]:
+        """Yield (row, index) pairs from `start`, seeking to `offset` if known."""
+        row, position = (start, offset) if offset is not None else self.seek_row(start)
+        with open(self.path, 'rb') as fp:
+            fp.seek(position)
+            self.offset = position
+            for line in fp:
+                self.offset += len(line)
+                if row >= start:
+                    yield parse_line(line), row
+                row += 1
+
+    def iter_names(self, start: int = 0, offset: int | None = None) -> Iterator[tuple[str, int]]:
+        """Yield (full name, index) pairs from `start`."""
+        for row, index in self.rows(start, offset):
+            yield f"{row[0]} {row[1]}", index
+
+
+class BinaryNameTable:
+    """A memory-mapped table of strings for large name lists.
+
+    Layout: a `SNT1` header with the column and row counts, then
+    `rows * columns + 1` little-endian uint64 offsets into a UTF-8 blob.
+    Any row is two offset reads and one slice away, the file is shared
+    read-only between processes through the page cache, and nothing is
+    materialized as Python objects until it is read. A table can also be
+    held in memory as `data` where no file can be written.
+    """
+
+    unique = False
+    checkpoint_suffix: tuple[str, ...] = ()
+
+    def __init__(self, path: str, data: bytes | None = None):
+        """Open the table, or read it from `data`."""
+        self.path = path
+        if data is None:
+            self._fp = open(path, 'rb')
+            self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._fp = None
+            self._mm = data
+        magic, self.columns, self.rows_count = TABLE_HEADER.unpack_from(self._mm, 0)
+        if magic != TABLE_MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a name table.')
+        self._blob = TABLE_HEADER.size + (self.rows_count * self.columns + 1) * OFFSET.size
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self.rows_count
+
+    def cell(self, row: int, column: int = 0) -> str:
+        """Return a single value."""
+        slot = row * self.columns + column
+        start, end = struct.unpack_from('<2Q', self._mm, TABLE_HEADER.size + slot * OFFSET.size)
+        return self._mm[self._blob + start:self._blob + end].decode('utf-8')
+
+    def row(self, row: int) -> list[str]:
+        """Return all the values of a row."""
+        if not 0 <= row < self.rows_count:
+            raise IndexError(row)
+        return [self.cell(row, column) for column in range(self.columns)]
+
+    def rows(self, start: int = 0) -> Iterator[tuple[list[str], int]]:
+        """Yield (row, index) pairs from `start`."""
+        for index in range(start, self.rows_count):
+            yield self.row(index), index
+
+    def iter_names(self, start: int = 0) -> Iterator[tuple[str, int]]:
+        """Yield (full name, index) pairs from `start`."""
+        for row, index in self.rows(start):
+            yield ' '.join(row[:2]), index
+
+    def close(self):
+        """Unmap the file."""
+        if self._fp is not None:
+            self._mm.close()
+            self._fp.close()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Exit the context manager."""
+        self.close()
+        return False
+
+    @staticmethod
+    def dump(fp, rows: Callable[[], Iterable[list[str]]], columns: int):
+        """Write a table to a binary file object from a row factory, called once per pass over the data."""
+        count = 0
+        for _ in rows():
+            count += 1
+
+        fp.write(TABLE_HEADER.pack(TABLE_MAGIC, columns, count))
+        position = 0
+        fp.write(OFFSET.pack(position))
+        for row in rows():
+            for column in range(columns):
+                position += len(row[column].encode('utf-8'))
+                fp.write(OFFSET.pack(position))
+        for row in rows():
+            for column in range(columns):
+                fp.write(row[column].encode('utf-8'))
+
+    @classmethod
+    def write(cls, path: str, rows: Callable[[], Iterable[list[str]]], columns: int):
+        """Write a table file from a row factory."""
+        # Workers may compile the same table at once, each writes its own file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as fp:
+                cls.dump(fp, rows, columns)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A full disk leaves a partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def compile_csv(cls, csv_path: str, path: str, columns: int = 2):
+        """Compile a CSV of names into a table."""
+        def rows():
+            with open(csv_path, 'r', encoding='utf-8', newline='') as fp:
+                for row in csv.reader(fp):
+                    yield (row + [''] * columns)[:columns]
+        cls.write(path, rows, columns)
+
+    @staticmethod
+    def distinct(names: Iterable[str]) -> list[str]:
+        """Drop repeated names, compared casefolded, keeping the first spelling and the order."""
+        distinct: dict[str, str] = {}
+        for name in names:
+            distinct.setdefault(name.casefold(), name)
+        return list(distinct.values())
+
+    @classmethod
+    def json_rows(cls, json_path: str) -> Callable[[], Iterable[list[str]]]:
+        """Return the row factory of a JSON list of names, repeats dropped."""
+        with open(json_path, 'r', encoding='utf-8') as fp:
+            names = cls.distinct(json.load(fp))
+        return lambda: ([name] for name in names)
+
+    @classmethod
+    def compile_json(cls, json_path: str, path: str):
+        """Compile a JSON list of names into a single column table of distinct names."""
+        cls.write(path, cls.json_rows(json_path), 1)
+
+    @classmethod
+    def from_json(cls, json_path: str, cache_dir: str = NAME_CACHE_DIR) -> BinaryNameTable:
+        """Open the table compiled from a JSON list, compiling it into `cache_dir` if missing or stale.
+
+        Where the cache cannot be written, e.g. a read-only deploy, the table
+        is compiled in memory for this process only.
+        """
+        path = cache_path(json_path, f'.v{NAMES_VERSION}.bin', cache_dir)
+        try:
+            if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(json_path):
+                os.makedirs(cache_dir, exist_ok=True)
+                cls.compile_json(json_path, path)
+            return cls(path)
+        except OSError as exp:
+            CrawlerLogger().warning(f'Unable to cache the table of {json_path}, keeping it in memory:\n{exp}')
+        data = io.BytesIO()
+        cls.dump(data, cls.json_rows(json_path), 1)
+        return cls(json_path, data.getvalue())
+
+
+class NameResources:
+    """Every first x last name combination, addressed by index.
+
+    Both lists hold distinct names, so every combination is a distinct full
+    name. They are compiled tables mapped read-only from the name cache, so
+    workers share their pages and start in constant time whatever the list
+    sizes. Combination `index` is last name `index // len(first)` with
+    first name `index % len(first)`, the order of
+    `product(last_names, first_names)`.
+    """
+
+    def __init__(self, first_names: BinaryNameTable, last_names: BinaryNameTable):
+        """Initialize the resources."""
+        self.first_names = first_names
+        self.last_names = last_names
+
+    @classmethod
+    def from_directory(cls, directory: str) -> NameResources:
+        """Open `firstname.json` and `lastname.json` of a resource directory."""
+        return cls(
+            BinaryNameTable.from_json(os.path.join(directory, 'firstname.json')),
+            BinaryNameTable.from_json(os.path.join(directory, 'lastname.json')),
+        )
+
+    def __len__(self) -> int:
+        """Return the number of combinations."""
+        return len(self.first_names) * len(self.last_names)
+
+    def pair(self, index: int) -> tuple[str, str]:
+        """Return the (first name, last name) of a combination."""
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        last, first = divmod(index, len(self.first_names))
+        return self.first_names.cell(first), self.last_names.cell(last)
+
+    def name(self, index: int) -> str:
+        """Return the full name of a combination."""
+        return ' '.join(self.pair(index))
+
+    def sample(self, rng: random.Random | None = None) -> str:
+        """Return a random full name, first and last name drawn independently."""
+        return self.name((rng or random).randrange(len(self)))
+
+    def iter_names(self, start: int = 0) -> Iterator[tuple[str, int]]:
+        """Yield (full name, index) pairs from `start`."""
+        for index in range(start, len(self)):
+            yield self.name(index), index
+
+    def close(self):
+        """Unmap both tables."""
+        self.first_names.close()
+        self.last_names.close()
+
+
+class FeistelPermutation:
+    """A seeded bijection of `range(size)`, evaluated one index at a time.
+
+    A balanced Feistel network permutes the smallest even-width power of
+    two covering `size`; values that land outside the range are encrypted
+    again (cycle walking) until they fall inside, which keeps it a bijection
+    of the range. Nothing is stored besides the round keys.
+    """
+
+    MASK = (1 << 64) - 1
+
+    def __init__(self, size: int, seed: str, rounds: int = 4):
+        """Derive the round keys from the seed."""
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half = (bits + 1) // 2
+        self.half_mask = (1 << self.half) - 1
+        self.keys = [
+            int.from_bytes(hashlib.blake2b(f'{seed}:{round_}'.encode('utf-8'), digest_size=8).digest(), 'little')
+            for round_ in range(rounds)
+        ]
+
+    def _round(self, value: int, key: int) -> int:
+        """Mix one half with a round key (splitmix64 finalizer)."""
+        x = (value * 0x9E3779B97F4A7C15 + key) & self.MASK
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & self.MASK
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & self.MASK
+        return (x ^ (x >> 31)) & self.half_mask
+
+    def _encrypt(self, value: int) -> int:
+        """Permute the covering power of two."""
+        left, right = value >> self.half, value & self.half_mask
+        for key in self.keys:
+            left, right = right, left ^ self._round(right, key)
+        return (left << self.half) | right
+
+    def __call__(self, index: int) -> int:
+        """Return the image of an index."""
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        value = self._encrypt(index)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+
+class NameEnumerator:
+    """Walk every first x last combination once, resumable from one integer.
+
+    Cursor `c` maps to combination `c` or, with a seed, to its image under
+    a `FeistelPermutation`, which spreads the names of a popular last name
+    over the whole run without repeating any. Every name is produced exactly
+    once, so the source needs no dedup lookups and the crawl is complete
+    once the cursor reaches `len(enumerator)`.
+    """
+
+    unique = True
+
+    def __init__(self, resources: NameResources, seed: str | None = None):
+        """Initialize the enumerator."""
+        self.resources = resources
+        self.seed = seed
+        self.permutation = FeistelPermutation(len(resources), seed) if seed else None
+
+    @property
+    def checkpoint_suffix(self) -> tuple[str, ...]:
+        """Cursors of different orders or list sizes must not share a checkpoint."""
+        size = str(len(self.resources))
+        return ('product', size, self.seed) if self.seed else ('product', size)
+
+    def __len__(self) -> int:
+        """Return the number of combinations."""
+        return len(self.resources)
+
+    def index(self, cursor: int) -> int:
+        """Return the combination at a cursor."""
+        return self.permutation(cursor) if self.permutation else cursor
+
+    def name(self, cursor: int) -> str:
+        """Return the full name at a cursor."""
+        return self.resources.name(self.index(cursor))
+
+    def iter_names(self, start: int = 0) -> Iterator[tuple[str, int]]:
+        """Yield (full name, cursor) pairs from `start`."""
+        for cursor in range(start, len(self)):
+            yield self.name(cursor), cursor
+
+
+_resources: dict[str, NameResources] = {}
+
+
+def name_resources(directory: str = os.path.join(os.path.dirname(__file__), 'resource')) -> NameResources:
+    """Return the name resources of a directory, opened once per process."""
+    if directory not in _resources:
+        _resources[directory] = NameResources.from_directory(directory)
+    return _resources[directory]
+
+
+def open_name_source(path: str) -> CsvNameSource | BinaryNameTable:
+    """Open a name source, preferring a compiled table next to a CSV."""
+    table_path = f'{os.path.splitext(path)[0]}.bin'
+    if path.endswith('.bin'):
+        return BinaryNameTable(path)
+    if os.path.exists(table_path) and (
+        not os.path.exists(path) or os.path.getmtime(table_path) >= os.path.getmtime(path)
+    ):
+        return BinaryNameTable(table_path)
+    return CsvNameSource(path)
+
+
+def main():
+    # python name_source.py index resource/SE.csv
+    # python name_source.py compile resource/SE.csv [resource/SE.bin]
+    # python name_source.py compile-names resource    # into NAME_CACHE_DIR
+    command, path, *rest = sys.argv[1:]
+    if command == 'index':
+        CsvNameSource(path).build_index()
+    elif command == 'compile':
+        table_path = rest[0] if rest else f'{os.path.splitext(path)[0]}.bin'
+        BinaryNameTable.compile_csv(path, table_path)
+    elif command == 'compile-names':
+        for file_name in ('firstname.json', 'lastname.json'):
+            BinaryNameTable.from_json(os.path.join(path, file_name)).close()
+    else:
+        raise SystemExit(f'Unknown command {command}')
+
+
+if __name__ == "__main__":
+    main()
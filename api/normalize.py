@@ -0,0 +1,98 @@
+"""Canonical profile URLs, so variants of one profile upsert into one document.
+
+DDG returns the same profile under many URLs: `www.`, `m.` or country
+hosts (`se.linkedin.com`, `sv-se.facebook.com`), trailing slashes, tracking
+queries (`?locale=`, `?igshid=`), mixed case handles and both spellings of
+percent-encoded names. `canonical_url` maps them to a single URL:
+
+- https scheme, `www.` host (bare for twitter, x and medium), no port
+- no query or fragment, except the `id` of facebook's `profile.php`
+- facebook `/people/<name>/<id>` and `/<id>` become `/profile.php?id=<id>`
+- linkedin `/in/<slug>/<anything>` becomes `/in/<slug>`
+- handles are lowercased on platforms where they are case-insensitive
+"""
+from __future__ import annotations
+import re
+from typing import Iterable
+from urllib.parse import quote, unquote, urlsplit
+
+from filter import PLATFORM_RULES, classifier
+
+# Host labels in front of the platform domain that do not change the page. Only
+# these are dropped, other subdomains are separate services, e.g. `vm.tiktok.com`
+# short links, `sv.quora.com` or the blogs of `*.medium.com`
+MIRROR_LABEL = re.compile(r'(?:www|m|mobile)')
+MIRROR_LABELS = {
+    # Mobile front ends and locale hosts such as `sv-se.facebook.com`
+    'facebook': re.compile(r'(?:www|m|mobile|mbasic|touch|web|[a-z]{2}-[a-z]{2})'),
+    # Country hosts such as `se.linkedin.com`
+    'linkedin': re.compile(r'(?:www|m|[a-z]{2})'),
+    'pinterest': re.compile(r'(?:www|m|[a-z]{2})'),
+    'reddit': re.compile(r'(?:www|m|old|new|np)'),
+}
+BARE_HOSTS = {'twitter.com', 'x.com', 'medium.com'}
+CASE_SENSITIVE = {'quora'}
+PATH_SAFE = "/@:+-._~!$&'()*,;="
+FACEBOOK_ID = re.compile(r'/(?:people/[^/]+/)?(\d{5,})')
+
+
+def canonical_host(host: str, platform: str | None) -> str:
+    """Drop mirror subdomains of a platform host."""
+    for domain in PLATFORM_RULES.get(platform, {}).get('hosts', ()):
+        if host == domain or host.endswith('.' + domain):
+            labels = host[:-len(domain)].rstrip('.').split('.') if host != domain else []
+            mirror = MIRROR_LABELS.get(platform, MIRROR_LABEL)
+            if all(mirror.fullmatch(label) for label in labels):
+                return domain if domain in BARE_HOSTS else f'www.{domain}'
+    return host
+
+
+def canonical_url(url: str, platform: str | None = None) -> str:
+    """Return the canonical form of a profile URL, unknown URLs only lose their fragment."""
+    try:
+        parts = urlsplit(url.strip())
+        host = (parts.hostname or '').rstrip('.')
+    except ValueError:
+        return url
+    if not host:
+        return url
+    if platform is None:
+        platform = classifier.platform_of(host)
+    if platform not in PLATFORM_RULES:
+        return parts._replace(fragment='').geturl()
+
+    host = canonical_host(host, platform)
+    path = re.sub(r'/{2,}', '/', unquote(parts.path)).rstrip('/') or '/'
+    if platform not in CASE_SENSITIVE:
+        path = path.lower()
+    query = ''
+    if platform == 'facebook':
+        if path == '/profile.php':
+            profile_id = re.search(r'(?:^|&)id=(\d+)', parts.query)
+            query = f'id={profile_id.group(1)}' if profile_id else ''
+        elif profile_id := FACEBOOK_ID.fullmatch(path):
+            path, query = '/profile.php', f'id={profile_id.group(1)}'
+    elif platform == 'linkedin' and path.startswith('/in/'):
+        path = '/'.join(path.split('/')[:3])
+    return f"https://{host}{quote(path, safe=PATH_SAFE)}{'?' + query if query else ''}"
+
+
+def canonical_document(document: dict, field: str = 'url') -> dict:
+    """Return the document with a canonical URL, a copy if it changed."""
+    url = document.get(field)
+    if not isinstance(url, str):
+        return document
+    canonical = canonical_url(url, document.get('platform'))
+    if canonical == url:
+        return document
+    return {**document, field: canonical}
+
+
+def dedupe_documents(documents: Iterable[dict], field: str = 'url') -> list[dict]:
+    """Canonicalize documents and merge the ones sharing a URL, later fields win."""
+    merged: dict[str, dict] = {}
+    for document in documents:
+        document = canonical_document(document, field)
+        value = document[field]
+        merged[value] = {**merged[value], **document} if value in merged else document
+    return list(merged.values())
@@ -0,0 +1,160 @@
+"""Two-tier cache of raw search responses keyed by the rendered query."""
+from __future__ import annotations
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Any, TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from lru import LRUCache
+from synccacher import Cacher, ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+
+
+class QueryCache:
+    """Cache the unfiltered results of a query in process and in Redis.
+
+    Lookups go to an in-process LRU of `local_size` queries first, then to
+    Redis where payloads are stored zlib-compressed for `ttl` seconds. An
+    empty response is kept for `empty_ttl` seconds only, it is more likely
+    a transient upstream failure than a name without results. Both tiers
+    expire an entry at the same time, counted from its write. The keys are
+    tracked in a sorted set by write time, every `trim_every` writes the
+    oldest ones are evicted so at most `max_entries` stay. The
+    filters run on the cached payload, so new filters or a new output schema
+    reuse it without another request through the paid proxy.
+    """
+
+    prefix = 'serp'
+
+    def __init__(self,
+        cacher: Cacher | None = None,
+        ttl: int = int(os.getenv('QUERY_CACHE_TTL', 7 * 24 * 3600)),
+        max_entries: int = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 1_000_000)),
+        local_size: int = int(os.getenv('QUERY_CACHE_LOCAL', 10000)),
+        trim_every: int = 100,
+        empty_ttl: int = int(os.getenv('QUERY_CACHE_EMPTY_TTL', 3600))
+    ):
+        """Initialize the cache, a `ttl` of 0 disables it and an `empty_ttl` of 0 never caches empty responses."""
+        self.cacher = cacher
+        self.ttl = ttl
+        self.empty_ttl = min(empty_ttl, ttl)
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self.local = LRUCache(local_size)
+        self.index_key = f'{self.prefix}:index'
+        self.stats = dict.fromkeys(['local_hits', 'redis_hits', 'misses', 'writes', 'evictions'], 0)
+        self.logger: logging.Logger = CacherLogger()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The Redis client, connected on first use."""
+        with self._lock:
+            if self.cacher is None:
+                self.cacher = Cacher(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=os.getenv('REDIS_PORT', 6379),
+                    password=os.getenv('REDIS_PASSWORD', None)
+                )
+                self.cacher.connect()
+        return self.cacher.client
+
+    def key(self, engine: str, region: str, query: str) -> str:
+        """Return the Redis key of a rendered query."""
+        digest = hashlib.blake2b(query.encode('utf-8'), digest_size=16).hexdigest()
+        return f'{self.prefix}:{engine}:{region}:{digest}'
+
+    @staticmethod
+    def encode(results: list[dict]) -> str:
+        """Compress a payload, base64 keeps it valid for the decoding client."""
+        return base64.b64encode(zlib.compress(json.dumps(results).encode('utf-8'))).decode('ascii')
+
+    @staticmethod
+    def decode(payload: str) -> list[dict]:
+        """Decompress a payload."""
+        return json.loads(zlib.decompress(base64.b64decode(payload)))
+
+    def _count(self, name: str, value: int = 1):
+        """Increase a metric."""
+        with self._lock:
+            self.stats[name] += value
+
+    def expiry(self, results: list[dict], written: float) -> float:
+        """Return when the results of a query written at `written` expire."""
+        return written + (self.ttl if results else self.empty_ttl)
+
+    @ensure_connection
+    def _fetch(self, key: str) -> tuple[str | None, float | None]:
+        """Read a payload from Redis with its write time."""
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(key)
+            pipe.zscore(self.index_key, key)
+            return tuple(pipe.execute())
+
+    @ensure_connection
+    def _store(self, key: str, payload: str, ttl: int, written: float):
+        """Write a payload to Redis and index it by write time."""
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(key, payload, ex=ttl)
+            pipe.zadd(self.index_key, {key: written})
+            pipe.execute()
+
+    @ensure_connection
+    def trim(self):
+        """Forget expired keys and evict the oldest ones above `max_entries`."""
+        self.client.zremrangebyscore(self.index_key, '-inf', time.time() - self.ttl)
+        overflow = self.client.zcard(self.index_key) - self.max_entries
+        if overflow > 0:
+            keys = [key for key, _ in self.client.zpopmin(self.index_key, overflow)]
+            self.client.delete(*keys)
+            self._count('evictions', len(keys))
+
+    def get(self, engine: str, region: str, query: str) -> list[dict] | None:
+        """Return the cached results of a query, None on a miss."""
+        if not self.ttl:
+            return None
+        key = self.key(engine, region, query)
+        now = time.time()
+        entry = self.local.get(key)
+        if entry is not None:
+            expires, results = entry
+            if expires > now:
+                self._count('local_hits')
+                return results
+            self.local.pop(key)
+        payload, written = (self._fetch(key) if self.client else None) or (None, None)
+        if payload is None:
+            self._count('misses')
+            return None
+        self._count('redis_hits')
+        results = self.decode(payload)
+        # An entry missing from the index has outlived a trim, Redis expires it on its own
+        self.local.put(key, (self.expiry(results, written or now), results))
+        return results
+
+    def put(self, engine: str, region: str, query: str, results: list[dict]):
+        """Cache the results of a query in both tiers."""
+        ttl = self.ttl if results else self.empty_ttl
+        if not ttl:
+            return
+        key = self.key(engine, region, query)
+        written = time.time()
+        self.local.put(key, (self.expiry(results, written), results))
+        self._count('writes')
+        if not self.client:
+            return
+        self._store(key, self.encode(results), ttl, written)
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % self.trim_every == 0
+        if trim:
+            self.trim()
+            self.logger.info(f'Query cache {self.stats}.')
@@ -0,0 +1,172 @@
+"""Order and prune the query templates of a platform by how much they find.
+
+Every run of a template records how many results it returned, how many
+passed the filters, how many of those no earlier template of the same name
+had found, its latency and whether it failed. The counters are summed in
+the `query_stats:<platform>` hashes in Redis, so every worker plans from
+what all of them observed.
+"""
+from __future__ import annotations
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from synccacher import Cacher, ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+
+METRICS = ('runs', 'returned', 'kept', 'new', 'errors', 'seconds')
+
+
+class QueryPlanner:
+    """Plan the templates of a name from the shared template statistics.
+
+    Templates run best first by profiles kept per run. After `min_runs`
+    runs a template adding fewer than `min_yield` new profiles per run is
+    skipped, though never the last one of a platform. Searches stop early
+    once a name has `saturation` profiles or a template found nothing new.
+    A share `explore` of the plans runs every template without stopping,
+    so skipped templates can earn their place back. `adaptive=False` (the
+    `QUERY_PLAN=all` setting) runs every template in file order.
+    """
+
+    prefix = 'query_stats'
+
+    def __init__(self,
+        queries: dict[str, list[str]],
+        cacher: Cacher | None = None,
+        adaptive: bool = os.getenv('QUERY_PLAN', 'adaptive') == 'adaptive',
+        min_runs: int = int(os.getenv('QUERY_PLAN_MIN_RUNS', 200)),
+        min_yield: float = float(os.getenv('QUERY_PLAN_MIN_YIELD', 0.05)),
+        saturation: int = int(os.getenv('QUERY_PLAN_SATURATION', 20)),
+        explore: float = float(os.getenv('QUERY_PLAN_EXPLORE', 0.05)),
+        flush_every: int = 50,
+        refresh_interval: float = 30.0
+    ):
+        """Initialize the planner."""
+        self.queries = queries
+        self.cacher = cacher
+        self.adaptive = adaptive
+        self.min_runs = min_runs
+        self.min_yield = min_yield
+        self.saturation = saturation
+        self.explore = explore
+        self.flush_every = flush_every
+        self.refresh_interval = refresh_interval
+        self.logger: logging.Logger = CacherLogger()
+        self._stats: dict[str, dict[str, float]] = {}
+        self._pending: dict[str, defaultdict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._recorded = 0
+        self._refreshed: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The Redis client, connected on first use."""
+        with self._lock:
+            if self.cacher is None:
+                self.cacher = Cacher(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=os.getenv('REDIS_PORT', 6379),
+                    password=os.getenv('REDIS_PASSWORD', None)
+                )
+                self.cacher.connect()
+        return self.cacher.client
+
+    def key(self, platform: str) -> str:
+        """Return the Redis hash of a platform."""
+        return f'{self.prefix}:{platform}'
+
+    @ensure_connection
+    def _load(self, platform: str) -> dict[str, str]:
+        """Read the counters of a platform."""
+        return self.client.hgetall(self.key(platform))
+
+    def stats(self, platform: str) -> dict[str, dict[str, float]]:
+        """Return the counters of every template of a platform, refreshed every `refresh_interval` seconds."""
+        with self._lock:
+            stale = time.monotonic() - self._refreshed.get(platform, float('-inf')) >= self.refresh_interval
+            if stale:
+                self._refreshed[platform] = time.monotonic()
+        if stale and self.client:
+            fields = self._load(platform)
+            if fields is not None:
+                with self._lock:
+                    self._stats[platform] = {field: float(value) for field, value in fields.items()}
+        with self._lock:
+            flat = dict(self._stats.get(platform, {}))
+            # Runs of this process not flushed yet count too
+            for field, value in self._pending[platform].items():
+                flat[field] = flat.get(field, 0.0) + value
+        return {
+            template: {metric: flat.get(f'{template}|{metric}', 0.0) for metric in METRICS}
+            for template in self.queries[platform]
+        }
+
+    def plan(self, platform: str, explore: bool | None = None) -> tuple[list[str], bool]:
+        """Return the templates to run for a name and whether to stop once it saturates."""
+        templates = self.queries[platform]
+        if not self.adaptive or len(templates) == 1:
+            return list(templates), self.adaptive
+        if explore is None:
+            explore = random.random() < self.explore
+        if explore:
+            return list(templates), False
+        stats = self.stats(platform)
+        ranked = sorted(templates, key=lambda template: -stats[template]['kept'] / max(stats[template]['runs'], 1))
+        kept = [
+            template for template in ranked
+            if stats[template]['runs'] < self.min_runs or stats[template]['new'] / stats[template]['runs'] >= self.min_yield
+        ]
+        return kept or ranked[:1], True
+
+    def saturated(self, results: int, new: int) -> bool:
+        """Return True if a name needs no further template."""
+        return results >= self.saturation or (results > 0 and new == 0)
+
+    def record(self, platform: str, template: str, returned: int | None = None, kept: int = 0,
+               new: int | None = None, seconds: float | None = None, error: bool = False):
+        """Count a run of a template, flushed to Redis every `flush_every` runs."""
+        with self._lock:
+            pending = self._pending[platform]
+            pending[f'{template}|runs'] += 1
+            pending[f'{template}|kept'] += kept
+            pending[f'{template}|new'] += kept if new is None else new
+            pending[f'{template}|errors'] += int(error)
+            if returned is not None:
+                pending[f'{template}|returned'] += returned
+            if seconds is not None:
+                pending[f'{template}|seconds'] += seconds
+            self._recorded += 1
+            flush = self._recorded % self.flush_every == 0
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Add the pending counters to the shared ones."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: defaultdict(float))
+            for platform, counters in pending.items():
+                # Until the next refresh, the flushed runs still count locally
+                stats = self._stats.setdefault(platform, {})
+                for field, value in counters.items():
+                    stats[field] = stats.get(field, 0.0) + value
+        if pending and self.client:
+            self._store(pending)
+
+    @ensure_connection
+    def _store(self, pending: dict[str, dict[str, float]]):
+        """Increase the counters of the templates in one round trip."""
+        with self.client.pipeline(transaction=False) as pipe:
+            for platform, counters in pending.items():
+                for field, value in counters.items():
+                    if field.endswith('|seconds'):
+                        pipe.hincrbyfloat(self.key(platform), field, value)
+                    else:
+                        pipe.hincrby(self.key(platform), field, int(value))
+            pipe.execute()
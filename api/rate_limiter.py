@@ -0,0 +1,159 @@
+"""Adaptive rate limiting of upstream searches per proxy and engine."""
+from __future__ import annotations
+import asyncio
+import os
+import threading
+import time
+from typing import TYPE_CHECKING
+
+import httpx
+
+from custom_logger import CrawlerLogger
+
+if TYPE_CHECKING:
+    import logging
+
+# Statuses of DuckDuckGo and the proxy asking us to slow down, 418 is the bot detection
+THROTTLE_STATUSES = (403, 418, 429)
+
+
+class ThrottledError(Exception):
+    """The upstream asked us to slow down, the search has to be retried."""
+
+
+def is_throttled(exp: BaseException) -> bool:
+    """Return True if an exception is a throttling signal from DuckDuckGo or the proxy."""
+    if isinstance(exp, ThrottledError):
+        return True
+    if isinstance(exp, httpx.HTTPStatusError):
+        return exp.response.status_code in THROTTLE_STATUSES
+    # The proxy stops answering in time when it is overloaded
+    if isinstance(exp, httpx.TimeoutException):
+        return True
+    # DDGS answers its 202 rate limit page with a bare HTTPError without a message
+    return type(exp) is httpx.HTTPError and not str(exp)
+
+
+class TokenBucket:
+    """A thread-safe token bucket refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        """Initialize the bucket full."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        """Add the tokens earned since the last update. Caller holds the lock."""
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return how long the caller has to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def acquire(self):
+        """Block until a token is available."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop."""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class AIMDRateLimiter(TokenBucket):
+    """A token bucket whose rate follows additive increase, multiplicative decrease.
+
+    Every successful search adds `increase` requests per second, up to
+    `max_rate`. A throttling response multiplies the rate by `decrease`
+    (down to `min_rate`) and pauses the bucket for an exponential backoff.
+    Throttles arriving within `cooldown` seconds of a decrease come from
+    requests already in flight and are not counted again.
+    """
+
+    def __init__(self,
+        rate: float = 2.0,
+        min_rate: float = 0.1,
+        max_rate: float = 20.0,
+        increase: float = 0.05,
+        decrease: float = 0.5,
+        cooldown: float = 5.0,
+        backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        name: str = ''
+    ):
+        """Initialize the limiter."""
+        super().__init__(rate, capacity=max(1.0, rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.name = name
+        self.throttles = 0
+        self._last_decrease = 0.0
+        self.logger: logging.Logger = CrawlerLogger()
+
+    def on_success(self):
+        """Probe for more capacity after a successful request."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.throttles = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+            self.capacity = max(1.0, self.rate)
+
+    def on_throttle(self):
+        """Back off after a throttling response."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._refill(now)
+            self._last_decrease = now
+            self.throttles += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.capacity = max(1.0, self.rate)
+            self.tokens = min(self.tokens, 0.0)
+            pause = min(self.max_backoff, self.backoff ** self.throttles)
+            self.paused_until = now + pause
+        self.logger.warning(f'Throttled on {self.name}, rate {self.rate:.2f}/s, pausing {pause:.0f}s.')
+
+
+class RateLimiterRegistry:
+    """One limiter per (proxy URL, engine) pair."""
+
+    def __init__(self, **settings):
+        """Initialize the registry, `settings` are passed to every limiter."""
+        self.settings = settings
+        self._limiters: dict[tuple[str | None, str], AIMDRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, proxy_url: str | None, engine: str) -> AIMDRateLimiter:
+        """Return the limiter of a proxy and engine."""
+        with self._lock:
+            key = (proxy_url, engine)
+            if key not in self._limiters:
+                self._limiters[key] = AIMDRateLimiter(name=engine, **self.settings)
+            return self._limiters[key]
+
+
+# Rates are per process, divide the upstream budget by the number of workers
+limiters = RateLimiterRegistry(
+    rate=float(os.getenv('RATE_LIMIT_RATE', 2.0)),
+    min_rate=float(os.getenv('RATE_LIMIT_MIN', 0.1)),
+    max_rate=float(os.getenv('RATE_LIMIT_MAX', 20.0)),
+)
@@ -0,0 +1,116 @@
+"""Incremental recrawl: search names again once their results are older than a per-platform TTL.
+
+Names are taken oldest first from the `CrawlLog` of each platform instead
+of sweeping the whole list again. Their new results are compared with the
+documents in MongoDB and only new or changed profiles are written, then
+the names are logged as crawled now.
+
+    RECRAWL_TTL_DAYS=30 RECRAWL_TTLS="linkedin=90,tiktok=7" python recrawl.py
+    python recrawl.py backfill    # log the names flagged before the crawl log existed
+"""
+from __future__ import annotations
+import concurrent.futures
+import functools
+import os
+import sys
+from typing import TYPE_CHECKING
+
+from custom_logger import CrawlerLogger
+from freshness import CrawlLog, changed_documents, recrawl_ttls
+from mongo import MongoDBConnector
+from serp_crawler import SearchResult, query_planner
+from sinks import sink_from_env
+from synccacher import Cacher
+
+if TYPE_CHECKING:
+    import logging
+
+# Cached responses may be older than the TTL that made the name stale
+search_fresh = functools.partial(SearchResult.search_query_platform, refresh=True)
+
+
+class Recrawler:
+    """Search the stale names of a platform again and write what changed."""
+
+    def __init__(self,
+        platform: str,
+        ttl: float,
+        window_size: int = int(os.getenv('CRAWLER_WINDOW', 50)),
+        limit: int = int(os.getenv('RECRAWL_LIMIT', 100000))
+    ):
+        """Initialize the recrawler, `ttl` in seconds."""
+        self.platform = platform
+        self.ttl = ttl
+        self.window_size = window_size
+        self.limit = limit
+        self.cacher = Cacher(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        self.logger: logging.Logger = CrawlerLogger()
+
+    def run(self) -> dict[str, int]:
+        """Recrawl up to `limit` stale names, return how many profiles were written and unchanged."""
+        stats = dict.fromkeys(['names', 'written', 'unchanged'], 0)
+        with self.cacher as cacher, MongoDBConnector() as connector:
+            crawl_log = CrawlLog(cacher, self.platform)
+            crawled = []
+            try:
+                with sink_from_env(connector) as buffer:
+                    for window in crawl_log.iter_stale(self.ttl, self.window_size):
+                        window = window[:self.limit - stats['names']]
+                        results, searched = [], []
+                        for full_name in window:
+                            result = SearchResult.search_with_retry(full_name, self.platform, search=search_fresh)
+                            if result is None:
+                                # Still throttled, it stays stale and comes back with the next run
+                                continue
+                            results.extend(result)
+                            searched.append(full_name)
+                        # One query for the stored profiles of the whole window
+                        changed, unchanged = changed_documents(connector, 'scrapped_profiles_v2', results)
+                        buffer.add(
+                            'scrapped_profiles_v2', changed, 'url',
+                            on_flush=lambda names=searched: crawled.extend(names)
+                        )
+                        crawl_log.touch(crawled)
+                        crawled.clear()
+                        stats['names'] += len(window)
+                        stats['written'] += len(changed)
+                        stats['unchanged'] += unchanged
+                        if stats['names'] >= self.limit:
+                            break
+            finally:
+                crawl_log.touch(crawled)
+                query_planner.flush()
+        self.logger.info(f'Recrawled {self.platform}: {stats}.')
+        return stats
+
+
+def run_worker(target: str, ttl: float):
+    return Recrawler(target, ttl).run()
+
+
+def backfill_worker(target: str, ttl: float):
+    with Cacher(
+        host=os.getenv('REDIS_HOST', 'localhost'),
+        port=os.getenv('REDIS_PORT', 6379),
+        password=os.getenv('REDIS_PASSWORD', None)
+    ) as cacher:
+        return CrawlLog(cacher, target).backfill(ttl)
+
+
+def main():
+    max_processes = int(os.getenv('CRAWLER_PROCESSES', 10))
+    targets = ["facebook", "linkedin", "twitter", "tiktok", "instagram"]
+    ttls = recrawl_ttls(targets)
+    worker = backfill_worker if sys.argv[1:] == ['backfill'] else run_worker
+    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+        results = [executor.submit(worker, target, ttls[target]) for target in targets]
+        for future in results:
+            future.result()
+
+
+if __name__ == "__main__":
+    main()
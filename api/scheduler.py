@@ -0,0 +1,303 @@
+"""Central scheduler handing (name, platform, query) tasks to a shared worker pool."""
+from __future__ import annotations
+import concurrent.futures
+import os
+from collections import deque
+from itertools import islice
+from typing import Any, Callable, Iterator, NamedTuple, TYPE_CHECKING
+
+from custom_logger import CrawlerLogger
+from freshness import CrawlLog
+from mongo import MongoDBConnector, WriteBehindBuffer
+from sinks import sink_from_env
+from rate_limiter import ThrottledError
+from seen_set import seen_set_from_env
+from synccacher import Cacher, Checkpoint, RetryList
+
+if TYPE_CHECKING:
+    import logging
+    from query_planner import QueryPlanner
+
+
+class QueryTask(NamedTuple):
+    """A single query template to run for a name on a platform."""
+    full_name: str
+    index: int | None
+    platform: str
+    query: str
+    attempt: int = 0
+
+
+class Watermark:
+    """Track the lowest index below which every name has been searched.
+
+    Searches finish out of order, so the checkpoint can only move past an
+    index once all of its predecessors are done as well.
+    """
+
+    def __init__(self, start: int):
+        """Initialize the watermark."""
+        self.value = start
+        self._done: set[int] = set()
+
+    def complete(self, index: int) -> bool:
+        """Mark an index as done, return True if the watermark advanced."""
+        self._done.add(index)
+        advanced = False
+        while self.value in self._done:
+            self._done.remove(self.value)
+            self.value += 1
+            advanced = True
+        return advanced
+
+
+class WeightedRoundRobin:
+    """Smooth weighted round robin, a key with weight 2 is picked twice as often."""
+
+    def __init__(self, weights: dict[str, int]):
+        """Initialize the round robin."""
+        self.weights = {key: weight for key, weight in weights.items() if weight > 0}
+        self._current = dict.fromkeys(self.weights, 0)
+
+    def __bool__(self) -> bool:
+        """Return True while keys are left."""
+        return bool(self.weights)
+
+    def next(self) -> str:
+        """Pick the next key."""
+        total = sum(self.weights.values())
+        for key, weight in self.weights.items():
+            self._current[key] += weight
+        key = max(self._current, key=self._current.get)
+        self._current[key] -= total
+        return key
+
+    def remove(self, key: str):
+        """Stop picking a key."""
+        self.weights.pop(key, None)
+        self._current.pop(key, None)
+
+
+def parse_weights(value: str, platforms: list[str]) -> dict[str, int]:
+    """Parse `facebook=2,linkedin=1`, platforms left out get a weight of 1."""
+    weights = dict.fromkeys(platforms, 1)
+    for item in filter(None, value.split(',')):
+        platform, weight = item.split('=')
+        if platform.strip() in weights:
+            weights[platform.strip()] = int(weight)
+    return weights
+
+
+class Scheduler:
+    """Split the crawl into query tasks and keep a shared worker pool busy.
+
+    Names are pulled from each platform in proportion to its weight and
+    expanded into one task per query template. A new task is submitted as
+    soon as a worker finishes one, so a slow platform never holds capacity
+    another platform could use. Results of a name are written once all of
+    its queries are back, and every platform keeps its own checkpoint, which
+    moves past a name once its results are flushed. Names given up on while
+    throttled go to the retry list of the platform, which the next run
+    searches before the names past the checkpoint.
+    """
+
+    def __init__(self,
+        search: Callable[[QueryTask], tuple[int, list[dict], float]],
+        queries: dict[str, list[str]],
+        names: Callable[[int], Iterator[tuple[str, int]]],
+        weights: dict[str, int],
+        max_workers: int = 10,
+        country: str = 'Sweden',
+        limit: int = 100000,
+        window_size: int = 50,
+        retries: int = int(os.getenv('RATE_LIMIT_RETRIES', 5)),
+        source: Any = None,
+        planner: QueryPlanner | None = None
+    ):
+        """Initialize the scheduler, `source` tells whether `names` repeats and how to checkpoint it.
+
+        `search` returns the number of raw results of a task, the profiles
+        kept from them and the seconds the query took.
+
+        With a `planner`, a name runs the templates it plans and their
+        results are recorded; all of them are queued at once, so there is
+        no early stop.
+        """
+        self.search = search
+        self.queries = queries
+        self.names = names
+        self.max_workers = max_workers
+        self.max_in_flight = max_workers * 2
+        self.country = country
+        self.limit = limit
+        self.window_size = window_size
+        self.retries = retries
+        self.planner = planner
+        self.unique = getattr(source, 'unique', False)
+        self.checkpoint_suffix = tuple(getattr(source, 'checkpoint_suffix', ()))
+        self.cacher = Cacher(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=os.getenv('REDIS_PORT', 6379),
+            password=os.getenv('REDIS_PASSWORD', None)
+        )
+        self.round_robin = WeightedRoundRobin({platform: weights.get(platform, 1) for platform in queries})
+        self.logger: logging.Logger = CrawlerLogger()
+        self._tasks: deque[QueryTask] = deque()
+        self._streams: dict[str, Iterator[tuple[str, int]]] = {}
+        self._windows: dict[str, deque[tuple[str, int | None]]] = {}
+        self._jobs: dict[tuple[str, int | None, str], dict[str, Any]] = {}
+        self._watermarks: dict[str, Watermark] = {}
+        self._checkpoints: dict[str, Checkpoint] = {}
+        self._seen: dict[str, Any] = {}
+        self._done: dict[str, set[str]] = {}
+        self._crawled: dict[str, list[str]] = {}
+        self._flushed: dict[str, list[int | None]] = {}
+        self._crawl_logs: dict[str, CrawlLog] = {}
+        self._retries: dict[str, RetryList] = {}
+        self._retried: dict[str, set[str]] = {}
+
+    @staticmethod
+    def key(full_name: str, platform: str) -> str:
+        """Return the dedup key of a name on a platform."""
+        return f"{full_name.lower()}:{platform}:v2"
+
+    def open(self):
+        """Load the checkpoints and open the name streams."""
+        for platform in self.round_robin.weights:
+            key = [f'{self.country}:{platform}', *self.checkpoint_suffix]
+            start = self.cacher.get(key) or 0
+            self._watermarks[platform] = Watermark(start)
+            self._checkpoints[platform] = Checkpoint(self.cacher, key)
+            self._seen[platform] = seen_set_from_env(self.cacher, platform)
+            self._done[platform] = set()
+            self._crawled[platform] = []
+            self._flushed[platform] = []
+            self._crawl_logs[platform] = CrawlLog(self.cacher, platform, self.country)
+            self._streams[platform] = islice(self.names(start), self.limit)
+            self._retries[platform] = RetryList(self.cacher, ':'.join(key))
+            retried = self._retries[platform].pending()
+            self._retried[platform] = set(retried)
+            # Retried names come before the stream and have no index to checkpoint
+            self._windows[platform] = deque((full_name, None) for full_name in retried)
+
+    def next_name(self, platform: str) -> tuple[str, int | None] | None:
+        """Return the next unsearched name of a platform, None once exhausted."""
+        window = self._windows[platform]
+        while not window:
+            names = list(islice(self._streams[platform], self.window_size))
+            if not names:
+                return None
+            if self.unique:
+                unseen = [True] * len(names)
+            else:
+                unseen = self._seen[platform].filter_unseen([self.key(name, platform) for name, _ in names])
+            for (full_name, index), is_new in zip(names, unseen):
+                if is_new:
+                    window.append((full_name, index))
+                else:
+                    self.complete(platform, index)
+        return window.popleft()
+
+    def next_task(self) -> QueryTask | None:
+        """Return the next task, expanding a name of the next platform if needed."""
+        while not self._tasks and self.round_robin:
+            platform = self.round_robin.next()
+            name = self.next_name(platform)
+            if name is None:
+                self.round_robin.remove(platform)
+                continue
+            full_name, index = name
+            queries = self.planner.plan(platform)[0] if self.planner else self.queries[platform]
+            self._jobs[(platform, index, full_name)] = {'remaining': len(queries), 'results': [], 'throttled': False}
+            self._tasks.extend(QueryTask(full_name, index, platform, query) for query in queries)
+        return self._tasks.popleft() if self._tasks else None
+
+    def finish(self, task: QueryTask, future: concurrent.futures.Future, buffer: WriteBehindBuffer):
+        """Collect the result of a task and write the name once all its queries are back."""
+        job = self._jobs[(task.platform, task.index, task.full_name)]
+        try:
+            returned, result, seconds = future.result()
+        except ThrottledError as ex:
+            if task.attempt < self.retries:
+                # Requeue behind the other tasks, the worker's limiter is backing off
+                self._tasks.append(task._replace(attempt=task.attempt + 1))
+                return
+            self.logger.error(f'Giving up on {task.full_name}:{task.platform} after {task.attempt} retries: {ex}')
+            job['throttled'] = True
+            result = []
+        except Exception as ex:
+            self.logger.error(f'Error in search result {task.full_name}:{task.platform}: {ex}')
+            if self.planner:
+                self.planner.record(task.platform, task.query, error=True)
+            result = []
+        else:
+            if self.planner:
+                # New is counted against the queries of the name that finished earlier
+                new = {r['url'] for r in result} - {r['url'] for r in job['results']}
+                self.planner.record(task.platform, task.query, returned, len(result), len(new), seconds)
+        job['results'].extend(result)
+        job['remaining'] -= 1
+        if job['remaining']:
+            return
+
+        del self._jobs[(task.platform, task.index, task.full_name)]
+        if job['throttled']:
+            # Written but not flagged, the checkpoint moves on and the retry list keeps the name
+            self._retries[task.platform].add([task.full_name])
+            buffer.add('scrapped_profiles_v2', job['results'], 'url')
+            self.complete(task.platform, task.index)
+            return
+        done, crawled, flushed = self._done[task.platform], self._crawled[task.platform], self._flushed[task.platform]
+        # The checkpoint moves in mark_done, a crash never skips results still in the buffer
+        buffer.add(
+            'scrapped_profiles_v2', job['results'], 'url',
+            on_flush=lambda key=self.key(task.full_name, task.platform), name=task.full_name, index=task.index: (
+                done.add(key), crawled.append(name), flushed.append(index)
+            )
+        )
+
+    def complete(self, platform: str, index: int | None):
+        """Record a finished name and move the checkpoint, retried names have no index."""
+        if index is not None and self._watermarks[platform].complete(index):
+            self._checkpoints[platform].advance(self._watermarks[platform].value)
+
+    def mark_done(self):
+        """Flag the names whose results were written and move the checkpoints past them."""
+        for platform, flushed in self._flushed.items():
+            for index in flushed:
+                self.complete(platform, index)
+            flushed.clear()
+        for platform, done in self._done.items():
+            if done:
+                self._seen[platform].add_many(done)
+                done.clear()
+                self._crawl_logs[platform].touch(self._crawled[platform])
+                self._retries[platform].remove([
+                    full_name for full_name in self._crawled[platform] if full_name in self._retried[platform]
+                ])
+                self._crawled[platform].clear()
+
+    def run(self):
+        """Run the crawl until every platform is exhausted."""
+        with self.cacher, MongoDBConnector() as connector:
+            self.open()
+            try:
+                with sink_from_env(connector) as buffer, \
+                        concurrent.futures.ProcessPoolExecutor(self.max_workers) as executor:
+                    in_flight: dict[concurrent.futures.Future, QueryTask] = {}
+                    while True:
+                        while len(in_flight) < self.max_in_flight and (task := self.next_task()):
+                            in_flight[executor.submit(self.search, task)] = task
+                        if not in_flight:
+                            break
+                        finished, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in finished:
+                            self.finish(in_flight.pop(future), future, buffer)
+                        self.mark_done()
+            finally:
+                self.mark_done()
+                if self.planner:
+                    self.planner.flush()
+                for platform in self._seen:
+                    self._seen[platform].close()
+                    self._checkpoints[platform].flush()
@@ -0,0 +1,281 @@
+"""Pluggable backends remembering which name x platform keys were searched.
+
+Backends share the `filter_unseen(keys)` / `add_many(keys)` API of the
+cachers and are picked with the `SEEN_BACKEND` environment variable:
+
+- `exact` (default): one RedisJSON key per name, as before. No false
+  positives, roughly 100 bytes of Redis memory per name.
+- `bloom`: an in-process Bloom filter over a bytearray, snapshotted to
+  `SEEN_BLOOM_DIR`. Nothing leaves the process, so use it when a key is only
+  ever crawled by one worker (the per-platform processes of `main()`).
+- `redis-bloom`: the same Bloom filter stored as a Redis bitmap, shared by
+  every worker. A window of keys is checked or set with a single BITFIELD.
+
+Bloom filters never miss a searched name but may report an unsearched one
+as searched (the name is then skipped). With `n` names and false positive
+rate `p` the filter uses `-n ln p / ln(2)^2` bits and `ln(2) m / n` hashes:
+
+    p        bits/name  hashes  10M names  100M names
+    1%       9.6        7       12 MB      120 MB
+    0.1%     14.4       10      18 MB      180 MB
+    0.01%    19.2       13      24 MB      240 MB
+
+The rate only holds up to `SEEN_CAPACITY` names, size it for the full list.
+"""
+from __future__ import annotations
+import hashlib
+import math
+import os
+import struct
+from typing import Iterable, TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from synccacher import ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+    from cacher import Cacher as AsyncCacher
+    from synccacher import Cacher
+
+BLOOM_MAGIC = b'SBF1'
+BLOOM_HEADER = struct.Struct('<4sQIQ')
+
+
+class BloomHasher:
+    """Map keys to bit positions with double hashing."""
+
+    def __init__(self, capacity: int, error_rate: float):
+        """Size the filter for `capacity` keys at `error_rate`."""
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+
+    def positions(self, key: str) -> list[int]:
+        """Return the bit positions of a key."""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+
+class BloomFilter:
+    """An in-process Bloom filter that snapshots to disk."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, path: str | None = None, snapshot_every: int = 10000):
+        """Initialize the filter, loading the snapshot at `path` if present."""
+        self.hasher = BloomHasher(capacity, error_rate)
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._unsaved = 0
+        self.logger: logging.Logger = CacherLogger()
+        self.bitmap = bytearray((self.hasher.bits + 7) // 8)
+        if path and os.path.exists(path):
+            self.load()
+
+    def __contains__(self, key: str) -> bool:
+        """Return True if the key was probably added."""
+        return all(self.bitmap[p >> 3] & (1 << (p & 7)) for p in self.hasher.positions(key))
+
+    def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it was never added."""
+        return [key not in self for key in keys]
+
+    def add_many(self, keys: Iterable[str]):
+        """Add keys to the filter."""
+        for key in keys:
+            for p in self.hasher.positions(key):
+                self.bitmap[p >> 3] |= 1 << (p & 7)
+            self._unsaved += 1
+        if self.path and self._unsaved >= self.snapshot_every:
+            self.snapshot()
+
+    def load(self):
+        """Load a snapshot written with the same sizing."""
+        with open(self.path, 'rb') as fp:
+            magic, bits, hashes, _ = BLOOM_HEADER.unpack(fp.read(BLOOM_HEADER.size))
+            if magic != BLOOM_MAGIC or (bits, hashes) != (self.hasher.bits, self.hasher.hashes):
+                self.logger.warning(f'Ignoring bloom snapshot {self.path} with a different sizing.')
+                return
+            fp.readinto(self.bitmap)
+
+    def snapshot(self):
+        """Atomically write the filter to disk."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as fp:
+            fp.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.hasher.bits, self.hasher.hashes, self.hasher.capacity))
+            fp.write(self.bitmap)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def close(self):
+        """Write the final snapshot."""
+        if self.path and self._unsaved:
+            self.snapshot()
+
+
+class RedisBloomFilter:
+    """A Bloom filter stored as a Redis bitmap shared by every worker."""
+
+    def __init__(self, cacher: Cacher, key: str, capacity: int, error_rate: float = 0.001):
+        """Initialize the filter."""
+        self.cacher = cacher
+        self.key = key
+        self.hasher = BloomHasher(capacity, error_rate)
+        self.logger: logging.Logger = CacherLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    def _command(self, keys: list[str], operation: tuple[str, ...]) -> list[str | int]:
+        """Build one BITFIELD command touching every position of the keys."""
+        command = ['BITFIELD', self.key]
+        for key in keys:
+            for p in self.hasher.positions(key):
+                command.extend(operation[:1] + ('u1', p) + operation[1:])
+        return command
+
+    def _unseen(self, keys: list[str], bits: list[int]) -> list[bool]:
+        """Split the BITFIELD reply per key."""
+        k = self.hasher.hashes
+        return [not all(bits[i * k:(i + 1) * k]) for i in range(len(keys))]
+
+    @ensure_connection
+    def _get_bits(self, keys: list[str]) -> list[int]:
+        """Read the bits of the keys in one round trip."""
+        return self.client.execute_command(*self._command(keys, ('GET',)))
+
+    def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it was never added."""
+        if not keys:
+            return []
+        bits = self._get_bits(keys)
+        if bits is None:
+            return [True] * len(keys)
+        return self._unseen(keys, bits)
+
+    @ensure_connection
+    def add_many(self, keys: Iterable[str]):
+        """Set the bits of the keys in one round trip."""
+        keys = list(keys)
+        if keys:
+            self.client.execute_command(*self._command(keys, ('SET', 1)))
+
+    def close(self):
+        """Nothing to release, the bitmap lives in Redis."""
+
+
+class AsyncRedisBloomFilter(RedisBloomFilter):
+    """The asyncio flavour of `RedisBloomFilter`."""
+
+    def __init__(self, cacher: AsyncCacher, key: str, capacity: int, error_rate: float = 0.001):
+        """Initialize the filter."""
+        super().__init__(cacher, key, capacity, error_rate)
+
+    async def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it was never added."""
+        if not keys or not self.client:
+            return [True] * len(keys)
+        try:
+            bits = await self.client.execute_command(*self._command(keys, ('GET',)))
+        except Exception as exp:
+            self.logger.error(f'Error while executing filter_unseen:\n{exp}')
+            return [True] * len(keys)
+        return self._unseen(keys, bits)
+
+    async def add_many(self, keys: Iterable[str]):
+        """Set the bits of the keys in one round trip."""
+        keys = list(keys)
+        if not keys or not self.client:
+            return
+        try:
+            await self.client.execute_command(*self._command(keys, ('SET', 1)))
+        except Exception as exp:
+            self.logger.error(f'Error while executing add_many:\n{exp}')
+
+    async def close(self):
+        """Nothing to release, the bitmap lives in Redis."""
+
+
+class ExactSeenSet:
+    """One RedisJSON flag per key, the original behaviour."""
+
+    def __init__(self, cacher: Cacher):
+        """Initialize the seen set."""
+        self.cacher = cacher
+
+    def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it has no flag yet."""
+        return self.cacher.filter_unseen(keys)
+
+    def add_many(self, keys: Iterable[str]):
+        """Flag the keys as searched in one pipeline."""
+        self.cacher.insert_many(dict.fromkeys(keys, True))
+
+    def close(self):
+        """Nothing to release, the flags live in Redis."""
+
+
+class AsyncExactSeenSet(ExactSeenSet):
+    """The asyncio flavour of `ExactSeenSet`."""
+
+    async def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it has no flag yet."""
+        return await self.cacher.filter_unseen(keys)
+
+    async def add_many(self, keys: Iterable[str]):
+        """Flag the keys as searched in one pipeline."""
+        await self.cacher.insert_many(dict.fromkeys(keys, True))
+
+    async def close(self):
+        """Nothing to release, the flags live in Redis."""
+
+
+class AsyncBloomFilter(BloomFilter):
+    """An in-process Bloom filter with the asyncio API, it never blocks on I/O."""
+
+    async def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it was never added."""
+        return super().filter_unseen(keys)
+
+    async def add_many(self, keys: Iterable[str]):
+        """Add keys to the filter."""
+        super().add_many(keys)
+
+    async def close(self):
+        """Write the final snapshot."""
+        super().close()
+
+
+def _settings(name: str) -> tuple[str, int, float, str]:
+    """Read the backend settings from the environment."""
+    backend = os.getenv('SEEN_BACKEND', 'exact')
+    capacity = int(os.getenv('SEEN_CAPACITY', 10_000_000))
+    error_rate = float(os.getenv('SEEN_ERROR_RATE', 0.001))
+    path = os.path.join(os.getenv('SEEN_BLOOM_DIR', '.'), f'seen-{name}.bloom')
+    return backend, capacity, error_rate, path
+
+
+def seen_set_from_env(cacher: Cacher, name: str):
+    """Build the configured backend for a synchronous crawler."""
+    backend, capacity, error_rate, path = _settings(name)
+    if backend == 'bloom':
+        return BloomFilter(capacity, error_rate, path=path)
+    if backend == 'redis-bloom':
+        return RedisBloomFilter(cacher, f'seen:{name}', capacity, error_rate)
+    if backend == 'exact':
+        return ExactSeenSet(cacher)
+    raise ValueError(f'Unknown seen set backend {backend}')
+
+
+def async_seen_set_from_env(cacher: AsyncCacher, name: str):
+    """Build the configured backend for the asyncio crawler."""
+    backend, capacity, error_rate, path = _settings(name)
+    if backend == 'bloom':
+        return AsyncBloomFilter(capacity, error_rate, path=path)
+    if backend == 'redis-bloom':
+        return AsyncRedisBloomFilter(cacher, f'seen:{name}', capacity, error_rate)
+    if backend == 'exact':
+        return AsyncExactSeenSet(cacher)
+    raise ValueError(f'Unknown seen set backend {backend}')
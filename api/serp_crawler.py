@@ -1,12 +1,23 @@
 import os
 import json
-import csv
-import random
+import time
 import concurrent.futures
-from duckduckgo_search import DDGS
+from itertools import chain, islice
+from typing import Callable
 from mongo import MongoDBConnector
-from synccacher import Cacher
-from filter import specialized_filter
+from sinks import sink_from_env
+from synccacher import Cacher, Checkpoint, RetryList
+from filter import classifier, specialized_filter
+from freshness import CrawlLog
+from frontier import NameFrequencies, NameScorer, frontier_from_env
+from name_source import NameEnumerator, name_resources, open_name_source
+from query_cache import QueryCache
+from query_planner import QueryPlanner
+from rate_limiter import ThrottledError, is_throttled, limiters
+from scheduler import QueryTask, Scheduler, Watermark, parse_weights
+from seen_set import seen_set_from_env
+from single_flight import SingleFlight
+from session_pool import SessionPool
 
 # Get the directory of the current script
 script_dir = os.path.dirname(__file__)
@@ -15,6 +26,29 @@ json_path = os.path.join(script_dir, 'query.json')
 with open(json_path, 'r') as fp:
     query_schema = json.load(fp)
 
+# Sessions are shared by every search of the process to keep proxy connections alive
+session_pool = SessionPool(max_sessions=int(os.getenv('DDGS_MAX_SESSIONS', 8)))
+# Raw responses are cached per rendered query, filters run on every read
+query_cache = QueryCache()
+# Identical queries in flight at once, in this process or another, go upstream once
+single_flight = SingleFlight()
+# Templates run best first, low-yield ones are skipped once every worker has seen enough of them
+query_planner = QueryPlanner(query_schema)
+# Runs the text and image queries of a name side by side in the combined mode
+search_executor = concurrent.futures.ThreadPoolExecutor(
+    int(os.getenv('DDGS_MAX_SESSIONS', 8)) * 2, thread_name_prefix='ddgs'
+)
+
+IMAGE_SEARCH = dict(
+    region="se-sv",
+    safesearch="off",
+    size=None,
+    color=None,
+    type_image="photo",
+    layout=None,
+    license_image=None,
+)
+
 
 class SearchResult:
     def __init__(self):
@@ -25,69 +59,138 @@ class SearchResult:
         )
 
     @staticmethod
-    def generate_name_special(index_log):
+    def name_source():
+        # NAME_SOURCE=product walks every first x last pair once, NAME_SEED shuffles the order
+        if os.getenv('NAME_SOURCE') == 'product':
+            return NameEnumerator(name_resources(), seed=os.getenv('NAME_SEED') or None)
         script_dir = os.path.dirname(__file__)
         # Start from Sweden Nordic names
         name_csv_file = os.path.join(script_dir, 'resource/SE.csv')
+        return open_name_source(name_csv_file)
 
-        with open(name_csv_file, 'r', encoding="utf-8") as csv_file:
-            csv_reader = csv.reader(csv_file)
-
-            for index, row in enumerate(list(csv_reader)[index_log:]):
-                full_name = f"{row[0]} {row[1]}"
-                yield full_name, index+index_log
+    @staticmethod
+    def generate_name_special(index_log):
+        # Rows are streamed and the start row is found through the sidecar index
+        yield from SearchResult.name_source().iter_names(index_log)
 
     @staticmethod
     def generate_name():
-        # Get the directory of the current script
-        script_dir = os.path.dirname(__file__)
-        first_name_path = os.path.join(script_dir, 'resource/firstname.json')
-        with open(first_name_path, 'r', encoding="utf-8") as fp:
-            first_names = json.load(fp)
-
-        last_name_path = os.path.join(script_dir, 'resource/lastname.json')
-        with open(last_name_path, 'r', encoding="utf-8") as fp:
-            last_names = json.load(fp)
-
+        # The name lists are compiled once and memory-mapped, nothing is parsed per call
+        names = name_resources()
         while True:
             # Randomly select a first name and last name
-            first_name = random.choice(first_names)
-            last_name = random.choice(last_names)
+            yield names.sample()
+
+    @staticmethod
+    def cached_search(engine: str, query: str, request, refresh: bool = False) -> list[dict]:
+        """Return the raw results of a rendered query, calling `request` on a cache miss.
+
+        `refresh` calls `request` even on a hit and replaces the cached results.
+        """
+        if not refresh:
+            raw = query_cache.get(engine, 'se-sv', query)
+            if raw is not None:
+                return raw
 
-            # Combine the first name and last name to form a full name
-            full_name = f"{first_name} {last_name}"
+        limiter = limiters.get(os.getenv('ZENROWS_PROXY_URL'), engine)
 
-            yield full_name
+        def fetch():
+            try:
+                raw = list(request())
+            except Exception as ex:
+                if is_throttled(ex):
+                    limiter.on_throttle()
+                    raise ThrottledError(str(ex)) from ex
+                raise
+            limiter.on_success()
+            query_cache.put(engine, 'se-sv', query, raw)
+            return raw
+
+        # Later callers of the same query wait for the first one, which stores it in the query cache
+        peek = None if refresh else lambda: query_cache.get(engine, 'se-sv', query)
+        # The token is taken before the lease, a backoff can outlast the lease
+        return single_flight.do(query_cache.key(engine, 'se-sv', query), fetch, peek, limiter.acquire)
+
+    @staticmethod
+    def search_query_raw(fullname: str, query: str, pool: SessionPool | None = None, refresh: bool = False) -> list[dict]:
+        """Return the unfiltered text results of a query template for a name, `refresh` skips the cache."""
+        query = query.replace('$query', fullname)
+
+        def request():
+            with (pool or session_pool).session(os.getenv('ZENROWS_PROXY_URL')) as ddgs:
+                # DDGS yields lazily, the requests have to run while the session is leased
+                return list(ddgs.text(query, region="se-sv"))
+
+        return SearchResult.cached_search('ddg-text', query, request, refresh)
+
+    @staticmethod
+    def search_query(fullname: str, platform: str, query: str, pool: SessionPool | None = None) -> list[dict]:
+        """Run a single query template of a platform for a name."""
+        return SearchResult.text_results(SearchResult.search_query_raw(fullname, query, pool), platform)
 
     @staticmethod
-    def search_query_platform(fullname: str, platform):
+    def text_results(raw: list[dict], platform: str, verdicts: list[bool] | None = None) -> list[dict]:
+        """Keep the profiles of a raw text response, renaming `href` to `url`."""
+        if verdicts is None:
+            verdicts = classifier.filter_many([r['href'] for r in raw], platform)
+        result = []
+        for r, keep in zip(raw, verdicts):
+            if keep:
+                # Copies, the cached response is shared
+                r = dict(r)
+                r['url'] = r.pop('href')
+                r["platform"] = platform
+                result.append(r)
+        return result
+
+    @staticmethod
+    def cached_text_results(fullname: str, platform: str) -> list[dict] | None:
+        """Return the profiles of a name from cached responses only, None if a planned query is missing."""
+        result, urls = [], set()
+        templates, stop_early = query_planner.plan(platform, explore=False)
+        for query in templates:
+            raw = query_cache.get('ddg-text', 'se-sv', query.replace('$query', fullname))
+            if raw is None:
+                return None
+            found = SearchResult.text_results(raw, platform)
+            new = {r['url'] for r in found} - urls
+            urls |= new
+            result.extend(found)
+            # The search it replays stopped there too
+            if stop_early and query_planner.saturated(len(result), len(new)):
+                break
+        return result
+
+    @staticmethod
+    def search_query_platform(fullname: str, platform, refresh: bool = False):
         """
         One query per one platform search 
 
-        params query:string, platform: target platform name
+        params query:string, platform: target platform name, refresh: skip the query cache
         return result:list<dict> search result list 
         """
         result = []
-        querys = query_schema[platform]
-        proxies = {
-            "http://": os.getenv('ZENROWS_PROXY_URL'),
-            "https://": os.getenv('ZENROWS_PROXY_URL'),
-        }
-
-        try:
-            with DDGS(proxies=proxies, timeout=30) as ddgs:
-                for query in querys:
-                    query = query.replace('$query', fullname)
-                    generator_ddg = ddgs.text(query, region="se-sv")
-                    for r in generator_ddg:
-                        if specialized_filter(r['href'], platform):
-                            r['url'] = r['href']
-                            r["platform"] = platform
-                            del r['href']
-                            result.append(r)
-
-        except Exception as ex:
-            print(f"**Error in search result # **: {str(ex)}")
+        urls = set()
+        querys, stop_early = query_planner.plan(platform)
+
+        for query in querys:
+            start = time.perf_counter()
+            try:
+                raw = SearchResult.search_query_raw(fullname, query, refresh=refresh)
+            except ThrottledError:
+                # The name has to be searched again, an empty result would mark it done
+                raise
+            except Exception as ex:
+                query_planner.record(platform, query, seconds=time.perf_counter() - start, error=True)
+                print(f"**Error in search result # **: {str(ex)}")
+                break
+            found = SearchResult.text_results(raw, platform)
+            new = {r['url'] for r in found} - urls
+            urls |= new
+            result.extend(found)
+            query_planner.record(platform, query, len(raw), len(found), len(new), time.perf_counter() - start)
+            if stop_early and query_planner.saturated(len(result), len(new)):
+                break
 
         return result
 
@@ -96,63 +199,241 @@ class SearchResult:
         # query = f"site:{platform}.com {fullname} profile"
         querys = query_schema[platform]
         result = []
-        # with DDGS(proxies= os.getenv('RESIDENTIAL_PROXY_URL'),timeout=30) as ddgs:
-        proxies = {
-            "http://": os.getenv('ZENROWS_PROXY_URL'),
-            "https://": os.getenv('ZENROWS_PROXY_URL'),
-        }
-        with DDGS(proxies=proxies, timeout=30) as ddgs:
+        proxy_url = os.getenv('ZENROWS_PROXY_URL')
+        with session_pool.session(proxy_url) as ddgs:
             for query in querys:
                 query = query.replace('$query', fullname)
 
                 try:
-                    keywords = query
-                    ddgs_images_gen = ddgs.images(
-                        keywords,
-                        region="se-sv",
-                        safesearch="off",
-                        size=None,
-                        color=None,
-                        type_image="photo",
-                        layout=None,
-                        license_image=None,
-                    )
-                    for r in ddgs_images_gen:
-                        if specialized_filter(r['url'], platform):
-                            result.append(r)
-                            r["platform"] = platform
-
+                    raw = SearchResult.cached_search('ddg-images', query, lambda: ddgs.images(query, **IMAGE_SEARCH))
+                except ThrottledError:
+                    session_pool.failed(ddgs)
+                    raise
                 except Exception as ex:
+                    session_pool.failed(ddgs)
                     print(str(ex))
+                    continue
+
+                for r in raw:
+                    if specialized_filter(r['url'], platform):
+                        result.append({**r, "platform": platform})
 
         return result
 
-    def run(self, platform):
-        mongoconnector = MongoDBConnector()
-        with self.cacher as cacher:
-            indice_log = cacher.get([f'Sweden:{platform}']) or 0
-            name_generator = self.generate_name_special(indice_log)
-
-            for _ in range(100000):
-                full_name, index = next(name_generator)
-                cacher.insert([f'Sweden:{platform}'], index)
-                combined_key = f"{full_name.lower()}:{platform}:v2"
-                result = cacher.get([combined_key]) or {}
-                if result:
-                    print("ERROR : repeated")
-                    continue
+    @staticmethod
+    def search_combined(fullname: str, platform: str, pool: SessionPool | None = None) -> tuple[list[dict], list[dict]]:
+        """Run the text and image queries of a name concurrently over one session.
+
+        Both result sets go through a single classifier pass, the text results
+        are returned as in `search_query_platform` and the image results as in
+        `search_image`.
+        """
+        jobs = []
+        # No early stop, the templates run side by side, but low-yield ones are skipped
+        templates, _ = query_planner.plan(platform)
+        with (pool or session_pool).session(os.getenv('ZENROWS_PROXY_URL')) as ddgs:
+            for template in templates:
+                query = template.replace('$query', fullname)
+                jobs.append(('text', template, search_executor.submit(
+                    SearchResult.cached_search, 'ddg-text', query, lambda q=query: ddgs.text(q, region="se-sv")
+                )))
+                jobs.append(('images', template, search_executor.submit(
+                    SearchResult.cached_search, 'ddg-images', query, lambda q=query: ddgs.images(q, **IMAGE_SEARCH)
+                )))
+            # The session has to outlive every request made with it
+            concurrent.futures.wait([future for _, _, future in jobs])
 
-                else:
-                    result = SearchResult().search_query_platform(full_name, platform)
-                    with mongoconnector as connector:
-                        connector.bulk_upsert_updated('scrapped_profiles_v2', result, 'url')
-                    # value = [{
-                    #     "fullname": full_name,
-                    #     "country_code": "SE",
-                    # }]
-                    # with mongoconnector as connector:
-                    #     connector.bulk_upsert_updated('nameset_v2',value, 'fullname')
-                    cacher.insert(combined_key, True)
+        raw = {'text': [], 'images': []}
+        spans = []
+        throttled = None
+        for kind, template, future in jobs:
+            try:
+                response = future.result()
+            except ThrottledError as ex:
+                throttled = ex
+                continue
+            except Exception as ex:
+                print(f"**Error in search result # **: {str(ex)}")
+                if kind == 'text':
+                    query_planner.record(platform, template, error=True)
+                continue
+            if kind == 'text':
+                spans.append((template, len(raw['text']), len(response)))
+            raw[kind].extend(response)
+        if throttled is not None:
+            raise throttled
+
+        urls = [r['href'] for r in raw['text']] + [r['url'] for r in raw['images']]
+        verdicts = classifier.filter_many(urls, platform)
+        # Template statistics cover the text results, in plan order so `new` is what earlier templates missed
+        found = set()
+        for template, start, count in spans:
+            kept = {urls[i] for i in range(start, start + count) if verdicts[i]}
+            query_planner.record(platform, template, count, sum(verdicts[start:start + count]), len(kept - found))
+            found |= kept
+        texts = SearchResult.text_results(raw['text'], platform, verdicts)
+        images = []
+        for r, keep in zip(raw['images'], verdicts[len(raw['text']):]):
+            if keep:
+                images.append({**r, "platform": platform})
+        return texts, images
+
+    @staticmethod
+    def search_with_retry(full_name, platform, retries=int(os.getenv('RATE_LIMIT_RETRIES', 5)), search=None):
+        """Search a name again while the upstream throttles, None if it never went through."""
+        for attempt in range(retries + 1):
+            try:
+                return (search or SearchResult.search_query_platform)(full_name, platform)
+            except ThrottledError as ex:
+                # The limiter pauses the next attempt for the backoff period
+                print(f"**Throttled # {attempt + 1}**: {str(ex)}")
+        return None
+
+    @staticmethod
+    def prioritized(names, frontier, scorer: NameScorer, window_size: int, repeated: Callable[[int], object],
+                    rescore_every: int = int(os.getenv('FRONTIER_RESCORE_EVERY', 20)), batch: int = 1000):
+        """Yield windows of the best scored names and their indexes, keeping the frontier filled from `names`.
+
+        Nothing is read while the frontier is full. The index of a name read
+        again while it is queued is passed to `repeated`, there is nothing
+        left to search for it.
+        """
+        windows = 0
+        while True:
+            pulled = list(islice(names, max(0, frontier.maxsize - len(frontier))))
+            for start in range(0, len(pulled), batch):
+                indexes = {}
+                for full_name, index in pulled[start:start + batch]:
+                    if full_name in indexes:
+                        repeated(index)
+                    else:
+                        indexes[full_name] = index
+                for index in frontier.push_many(scorer.scores(list(indexes)), indexes):
+                    repeated(index)
+            windows += 1
+            if windows % rescore_every == 0:
+                # Yields learnt since a name was queued change its score
+                queued = [full_name for full_name, _ in frontier.members()]
+                for start in range(0, len(queued), batch):
+                    frontier.push_many(scorer.scores(queued[start:start + batch]))
+            window = frontier.pop_many(window_size)
+            if not window:
+                return
+            # The names keep their indexes, the checkpoint never passes one still queued
+            yield [(full_name, index) for full_name, _, index in window]
+
+    def run(self, platform, mode=os.getenv('CRAWLER_MODE', 'text'), order=os.getenv('CRAWLER_ORDER', 'file')):
+        # CRAWLER_MODE=combined searches text and images of every name in one pass
+        window_size = int(os.getenv('CRAWLER_WINDOW', 50))
+        # One client for the whole worker, results are flushed in batches across names
+        source = self.name_source()
+        # Names searched for text only still need their images in the combined mode
+        version = 'v2:combined' if mode == 'combined' else 'v2'
+        checkpoint_key = [f'Sweden:{platform}', *source.checkpoint_suffix, *(['combined'] if mode == 'combined' else [])]
+        with self.cacher as cacher, MongoDBConnector() as connector:
+            indice_log = cacher.get(checkpoint_key) or 0
+            name_generator = islice(self.generate_name_special(indice_log), 100000)
+            checkpoint = Checkpoint(cacher, checkpoint_key)
+            # Names finish in order but are written in batches, the checkpoint follows the writes
+            watermark = Watermark(indice_log)
+            finished = []
+            seen = seen_set_from_env(cacher, platform)
+            crawl_log = CrawlLog(cacher, platform)
+            # Names given up on by earlier runs are behind the checkpoint, they go first
+            retry = RetryList(cacher, ':'.join(checkpoint_key))
+            retried = retry.pending()
+            retry_windows = [[(full_name, None) for full_name in retried[start:start + window_size]]
+                             for start in range(0, len(retried), window_size)]
+            retried = set(retried)
+            done_keys = set()
+            done_names = []
+            skipped_names = []
+            given_up = []
+            if order == 'priority':
+                # CRAWLER_ORDER=priority searches the best scored of the next FRONTIER_SIZE names first
+                frontier = frontier_from_env(cacher, ':'.join(checkpoint_key))
+                frontier.requeue()
+                scorer = NameScorer(cacher, platform, NameFrequencies.from_source(source))
+                windows = self.prioritized(name_generator, frontier, scorer, window_size, finished.append)
+            else:
+                frontier = scorer = None
+                windows = iter(lambda: list(islice(name_generator, window_size)), [])
+            windows = chain(retry_windows, windows)
+
+            def settle():
+                # Moves past written, skipped and given-up names only, a crash never loses buffered ones
+                if any([watermark.complete(index) for index in finished if index is not None]):
+                    checkpoint.advance(watermark.value)
+                finished.clear()
+
+            def mark_done():
+                # Names are flagged as done in one call once their results are written
+                seen.add_many(done_keys)
+                done_keys.clear()
+                crawl_log.touch(done_names)
+                retry.remove([full_name for full_name in done_names + skipped_names if full_name in retried])
+                if frontier is not None:
+                    # Names given up on are kept in the retry list instead of the lease
+                    frontier.ack(done_names + skipped_names + given_up)
+                done_names.clear()
+                skipped_names.clear()
+                given_up.clear()
+                settle()
+
+            try:
+                with sink_from_env(connector) as buffer:
+                    # Dedup a whole window of upcoming names with a single lookup
+                    for window in windows:
+                        keys = [f"{full_name.lower()}:{platform}:{version}" for full_name, _ in window]
+                        # A source without repeats resumes from its cursor alone
+                        unseen = [True] * len(keys) if source.unique else seen.filter_unseen(keys)
+                        searched = set()
+                        kept = {}
+                        for (full_name, index), combined_key, is_new in zip(window, keys, unseen):
+                            if not is_new or combined_key in searched:
+                                print("ERROR : repeated")
+                                skipped_names.append(full_name)
+                                finished.append(index)
+                                continue
+
+                            searched.add(combined_key)
+                            if mode == 'combined':
+                                result = self.search_with_retry(full_name, platform, search=SearchResult.search_combined)
+                            else:
+                                result = self.search_with_retry(full_name, platform)
+                            if result is None:
+                                # Still throttled, the next run searches the name before moving on
+                                retry.add([full_name])
+                                given_up.append(full_name)
+                                finished.append(index)
+                                continue
+                            if mode == 'combined':
+                                # Both sets go out in the same flush, a failed image write is kept for the next one
+                                result, images = result
+                                buffer.add('serp_result_image', images, 'url')
+                            kept[full_name] = len(result)
+                            # value = [{
+                            #     "fullname": full_name,
+                            #     "country_code": "SE",
+                            # }]
+                            # with mongoconnector as connector:
+                            #     connector.bulk_upsert_updated('nameset_v2',value, 'fullname')
+                            buffer.add(
+                                'scrapped_profiles_v2', result, 'url',
+                                on_flush=lambda key=combined_key, name=full_name, index=index: (
+                                    done_keys.add(key), done_names.append(name), finished.append(index)
+                                )
+                            )
+                            if done_keys:
+                                mark_done()
+                        settle()
+                        if scorer is not None:
+                            scorer.record(kept)
+            finally:
+                mark_done()
+                seen.close()
+                checkpoint.flush()
+                query_planner.flush()
 
 
 def run_worker(target):
@@ -161,14 +442,35 @@ def run_worker(target):
     return result
 
 
+def run_query_task(task: QueryTask) -> tuple[int, list[dict], float]:
+    # The planner learns from the raw count as well, the scheduler records it
+    start = time.perf_counter()
+    raw = SearchResult.search_query_raw(task.full_name, task.query)
+    return len(raw), SearchResult.text_results(raw, task.platform), time.perf_counter() - start
+
+
 def main():
-    max_processes = 10  # Adjust this based on your needs
+    max_processes = int(os.getenv('CRAWLER_PROCESSES', 10))  # Adjust this based on your needs
     # targets = ["facebook","linkedin", "twitter", "tiktok","instagram","pinterest","reddit","quora","badoo","snapchat"]
     targets = ["facebook","linkedin", "twitter", "tiktok","instagram"]
     # targets = ["linkedin"]
-    with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
-        # Submit each task to the process pool
-        results = [executor.submit(run_worker, target) for target in targets]
+    if os.getenv('CRAWLER_MODE', 'text') == 'combined' or os.getenv('CRAWLER_ORDER', 'file') == 'priority':
+        # The combined mode and the priority order search a whole name at a time, one platform per worker
+        with concurrent.futures.ProcessPoolExecutor(max_processes) as executor:
+            for future in [executor.submit(run_worker, target) for target in targets]:
+                future.result()
+        return
+    # Every worker takes the next query of any platform, e.g. CRAWLER_WEIGHTS="facebook=2,tiktok=1"
+    scheduler = Scheduler(
+        run_query_task,
+        {target: query_schema[target] for target in targets},
+        SearchResult.generate_name_special,
+        parse_weights(os.getenv('CRAWLER_WEIGHTS', ''), targets),
+        max_workers=max_processes,
+        source=SearchResult.name_source(),
+        planner=query_planner
+    )
+    scheduler.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+"""A pool of reusable DDGS sessions keyed by proxy URL."""
+from __future__ import annotations
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Callable, TYPE_CHECKING
+
+from duckduckgo_search import DDGS
+
+from custom_logger import CrawlerLogger
+
+if TYPE_CHECKING:
+    import logging
+
+
+def proxy_mapping(proxy_url: str | None) -> dict[str, str | None]:
+    """Build the httpx proxy mapping for a proxy URL."""
+    return {
+        "http://": proxy_url,
+        "https://": proxy_url,
+    }
+
+
+class PooledSession:
+    """A session together with the bookkeeping used for eviction."""
+
+    def __init__(self, session: Any):
+        """Initialize the pooled session."""
+        self.session = session
+        self.created_at = time.monotonic()
+        self.failures = 0
+        self.errored = False
+
+    def expired(self, max_age: float) -> bool:
+        """Return True once the session is older than `max_age` seconds."""
+        return time.monotonic() - self.created_at > max_age
+
+
+class SessionPool:
+    """A thread-safe pool of keep-alive DDGS sessions.
+
+    Every session owns an HTTP/2 client, so reusing it keeps the TLS
+    connection to the proxy open between searches. At most `max_sessions`
+    sessions exist per proxy URL; callers block until one is free. A session
+    is closed and replaced after `max_failures` consecutive errors or once
+    it is older than `max_age` seconds.
+    """
+
+    def __init__(self,
+        factory: Callable[[str | None], Any] | None = None,
+        max_sessions: int = 8,
+        max_failures: int = 3,
+        max_age: float = 600,
+        timeout: int = 30
+    ):
+        """Initialize the session pool."""
+        self.factory = factory or (lambda proxy_url: DDGS(proxies=proxy_mapping(proxy_url), timeout=timeout))
+        self.max_sessions = max_sessions
+        self.max_failures = max_failures
+        self.max_age = max_age
+        self._idle: dict[str | None, list[PooledSession]] = defaultdict(list)
+        self._size: dict[str | None, int] = defaultdict(int)
+        self._leased: dict[int, PooledSession] = {}
+        self._condition = threading.Condition()
+        self.logger: logging.Logger = CrawlerLogger()
+
+    def acquire(self, proxy_url: str | None) -> PooledSession:
+        """Take an idle session for the proxy, creating one if the limit allows."""
+        with self._condition:
+            while True:
+                idle = self._idle[proxy_url]
+                while idle:
+                    pooled = idle.pop()
+                    if not pooled.expired(self.max_age):
+                        self._leased[id(pooled.session)] = pooled
+                        return pooled
+                    self._discard(proxy_url, pooled)
+                if self._size[proxy_url] < self.max_sessions:
+                    self._size[proxy_url] += 1
+                    break
+                self._condition.wait()
+
+        try:
+            pooled = PooledSession(self.factory(proxy_url))
+        except Exception:
+            with self._condition:
+                self._size[proxy_url] -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._leased[id(pooled.session)] = pooled
+        return pooled
+
+    def release(self, proxy_url: str | None, pooled: PooledSession, failed: bool = False):
+        """Return a session to the pool, evicting it if it is unhealthy."""
+        with self._condition:
+            self._leased.pop(id(pooled.session), None)
+            pooled.failures = pooled.failures + 1 if failed or pooled.errored else 0
+            pooled.errored = False
+            if pooled.failures >= self.max_failures or pooled.expired(self.max_age):
+                self._discard(proxy_url, pooled)
+            else:
+                self._idle[proxy_url].append(pooled)
+            self._condition.notify()
+
+    def failed(self, session: Any):
+        """Record an error that the caller handled itself."""
+        with self._condition:
+            pooled = self._leased.get(id(session))
+            if pooled is not None:
+                pooled.errored = True
+
+    @contextmanager
+    def session(self, proxy_url: str | None):
+        """Lease a session for the duration of the block."""
+        pooled = self.acquire(proxy_url)
+        try:
+            yield pooled.session
+        except Exception:
+            self.release(proxy_url, pooled, failed=True)
+            raise
+        else:
+            self.release(proxy_url, pooled)
+
+    def close(self):
+        """Close every idle session."""
+        with self._condition:
+            for proxy_url, idle in self._idle.items():
+                while idle:
+                    self._discard(proxy_url, idle.pop())
+
+    def _discard(self, proxy_url: str | None, pooled: PooledSession):
+        """Close a session and free its slot. Caller holds the lock."""
+        self._size[proxy_url] -= 1
+        try:
+            pooled.session.__exit__(None, None, None)
+        except Exception as exp:
+            self.logger.warning(f'Error while closing session:\n{exp}')
@@ -0,0 +1,141 @@
+"""Coalesce identical in-flight calls, in process and across processes."""
+from __future__ import annotations
+import concurrent.futures
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, TYPE_CHECKING
+
+from custom_logger import CacherLogger
+from synccacher import RELEASE_SCRIPT, Cacher, ensure_connection
+
+if TYPE_CHECKING:
+    import logging
+
+
+class SingleFlight:
+    """Run at most one call per key at a time.
+
+    Within a process, callers of a key already in flight wait on the future
+    of the first one and get its result or its exception. Across processes
+    the first caller takes a Redis lease on the key for `lease_ttl` seconds;
+    the others poll `peek` every `poll_interval` seconds, which reads the
+    result from where the leader stores it (the query cache), and take the
+    lease over once it is released or expired. A `lease_ttl` of 0 or an
+    unreachable Redis leaves only the in-process coalescing. Waits that do
+    not need the lease, such as for a rate limit token, go in `prepare` so
+    the lease never expires while its holder is still waiting.
+    """
+
+    prefix = 'flight'
+
+    def __init__(self,
+        cacher: Cacher | None = None,
+        lease_ttl: float = float(os.getenv('SINGLE_FLIGHT_TTL', 60)),
+        poll_interval: float = float(os.getenv('SINGLE_FLIGHT_POLL', 0.25))
+    ):
+        """Initialize the registry."""
+        self.cacher = cacher
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.stats = dict.fromkeys(['calls', 'shared', 'remote'], 0)
+        self.logger: logging.Logger = CacherLogger()
+        self._calls: dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self._release = None
+
+    @property
+    def client(self):
+        """The Redis client, connected on first use."""
+        with self._lock:
+            if self.cacher is None:
+                self.cacher = Cacher(
+                    host=os.getenv('REDIS_HOST', 'localhost'),
+                    port=os.getenv('REDIS_PORT', 6379),
+                    password=os.getenv('REDIS_PASSWORD', None)
+                )
+                self.cacher.connect()
+        return self.cacher.client
+
+    def _count(self, name: str):
+        """Increase a metric."""
+        with self._lock:
+            self.stats[name] += 1
+
+    @ensure_connection
+    def _acquire(self, key: str, token: str) -> bool:
+        """Take the lease of a key if nobody holds it."""
+        return bool(self.client.set(f'{self.prefix}:{key}', token, nx=True, px=int(self.lease_ttl * 1000)))
+
+    @ensure_connection
+    def _release_lease(self, key: str, token: str):
+        """Give the lease of a key back."""
+        if self._release is None:
+            self._release = self.client.register_script(RELEASE_SCRIPT)
+        self._release(keys=[f'{self.prefix}:{key}'], args=[token])
+
+    def do(self,
+        key: str,
+        call: Callable[[], Any],
+        peek: Callable[[], Any] | None = None,
+        prepare: Callable[[], Any] | None = None
+    ) -> Any:
+        """Return the result of `call`, shared with every concurrent caller of `key`.
+
+        `peek` returns the result stored by a leader of another process, or
+        None while there is none. `prepare` runs in the leader before it
+        takes the lease.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = concurrent.futures.Future()
+        if not leader:
+            self._count('shared')
+            return future.result()
+
+        try:
+            result = self._lead(key, call, peek, prepare)
+        except BaseException as exp:
+            future.set_exception(exp)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _lead(self,
+        key: str,
+        call: Callable[[], Any],
+        peek: Callable[[], Any] | None,
+        prepare: Callable[[], Any] | None
+    ) -> Any:
+        """Run the call under the Redis lease, or wait for the process holding it."""
+        if prepare is not None:
+            prepare()
+        if not self.lease_ttl or not self.client:
+            self._count('calls')
+            return call()
+
+        token = uuid.uuid4().hex
+        # None when Redis failed, the call runs without a lease then
+        while self._acquire(key, token) is False:
+            result = peek() if peek is not None else None
+            if result is not None:
+                self._count('remote')
+                return result
+            time.sleep(self.poll_interval)
+        try:
+            # The previous holder may have finished between the last peek and the lease
+            result = peek() if peek is not None else None
+            if result is not None:
+                self._count('remote')
+                return result
+            self._count('calls')
+            return call()
+        finally:
+            self._release_lease(key, token)
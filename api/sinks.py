@@ -0,0 +1,345 @@
+"""Pluggable output sinks for search results.
+
+Every sink has the `add(collection, documents, filter_field, on_flush)`,
+`flush()` and `close()` API of `WriteBehindBuffer`, and is picked with the
+`OUTPUT_SINK` environment variable:
+
+- `mongo` (default): upserts through `WriteBehindBuffer`, as before.
+- `jsonl`: append-only JSON lines in `OUTPUT_DIR`, one file per collection
+  rotated at `OUTPUT_ROTATE_BYTES`, zstd-compressed with `OUTPUT_ZSTD=1`
+  (needs `zstandard`).
+- `parquet`: one row group per flush in `OUTPUT_DIR`, files rotated at
+  `OUTPUT_ROTATE_ROWS` rows (needs `pyarrow`). A Parquet file is readable
+  once it is closed, an interrupted run leaves its last file without footer.
+
+File sinks buffer at most `OUTPUT_BATCH` documents, write them in one append
+followed by one fsync, and only then run the `on_flush` callbacks, so a
+name is marked done once its results are on disk. A collection whose write
+failed keeps its documents and callbacks for the next flush; after
+`OUTPUT_MAX_RETRIES` failed flushes in a row they go to the dead-letter file
+of `WriteBehindBuffer` instead. `pyarrow` and `zstandard` are optional, see
+the end of requirements.txt.
+"""
+from __future__ import annotations
+import abc
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, BinaryIO, Callable, TYPE_CHECKING
+
+from custom_logger import MongoLogger
+from mongo import MongoDBConnector, WriteBehindBuffer, write_dead_letter
+from normalize import canonical_document
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+if TYPE_CHECKING:
+    import logging
+
+
+class BufferedFileSink(abc.ABC):
+    """Collect documents per collection and hand them to `_write` in batches."""
+
+    def __init__(self,
+        directory: str = os.getenv('OUTPUT_DIR', 'output'),
+        batch_documents: int = int(os.getenv('OUTPUT_BATCH', 1000)),
+        max_interval: float = float(os.getenv('OUTPUT_INTERVAL', 5)),
+        max_retries: int = int(os.getenv('OUTPUT_MAX_RETRIES', 3)),
+        dead_letter_dir: str = os.getenv('DEAD_LETTER_DIR', 'dead_letter')
+    ):
+        """Initialize the sink."""
+        self.directory = directory
+        self.batch_documents = batch_documents
+        self.max_interval = max_interval
+        self.max_retries = max_retries
+        self.dead_letter_dir = dead_letter_dir
+        os.makedirs(directory, exist_ok=True)
+        self._documents: dict[str, dict[Any, dict]] = defaultdict(dict)
+        self._fields: dict[str, str] = {}
+        self._callbacks: list[tuple[str, Callable[[], object]]] = []
+        self._failures: dict[str, int] = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        self.logger: logging.Logger = MongoLogger()
+
+    def add(self, collection: str, documents: list[dict], filter_field: str, on_flush: Callable[[], object] | None = None):
+        """Buffer documents, later ones replace earlier ones with the same filter value."""
+        with self._lock:
+            batch = self._documents[collection]
+            self._fields[collection] = filter_field
+            for document in documents:
+                if filter_field == 'url':
+                    document = canonical_document(document)
+                value = document[filter_field]
+                if value in batch:
+                    document = {**batch[value], **document}
+                else:
+                    self._count += 1
+                batch[value] = document
+            if on_flush is not None:
+                self._callbacks.append((collection, on_flush))
+            if self._count >= self.batch_documents or time.monotonic() - self._last_flush >= self.max_interval:
+                self.flush()
+
+    def flush(self):
+        """Write every buffered document, then run the callbacks of the collections written."""
+        with self._lock:
+            documents, callbacks = self._documents, self._callbacks
+            self._documents = defaultdict(dict)
+            self._callbacks = []
+            self._count = 0
+            self._last_flush = time.monotonic()
+            updated_at = datetime.utcnow().isoformat()
+            failed, dropped = set(), set()
+            for collection, batch in documents.items():
+                if not batch:
+                    continue
+                try:
+                    self._write(collection, [{**document, 'updated_at': updated_at} for document in batch.values()])
+                except Exception as exp:
+                    self._failures[collection] = self._failures.get(collection, 0) + 1
+                    if self._failures[collection] <= self.max_retries:
+                        self.logger.error(f'Error while writing {collection}, keeping it for the next flush:\n{exp}')
+                        failed.add(collection)
+                        self._documents[collection] = batch
+                        self._count += len(batch)
+                    else:
+                        # Given up on, e.g. a batch that never fits the schema would block the collection
+                        self.logger.error(f'Error while writing {collection}, giving up after {self.max_retries} retries:\n{exp}')
+                        del self._failures[collection]
+                        if not self._dead_letter(collection, list(batch.values())):
+                            dropped.add(collection)
+                    continue
+                self._failures.pop(collection, None)
+            for collection, callback in callbacks:
+                if collection in failed:
+                    self._callbacks.append((collection, callback))
+                    continue
+                if collection in dropped:
+                    continue
+                try:
+                    callback()
+                except Exception as exp:
+                    self.logger.error(f'Error while executing flush callback:\n{exp}')
+
+    def _dead_letter(self, collection: str, documents: list[dict]) -> bool:
+        """Move the documents of a write given up on to the dead-letter file, return True if they were kept."""
+        try:
+            path = write_dead_letter(self.dead_letter_dir, collection, self._fields[collection], documents)
+        except Exception as exp:
+            self.logger.error(f'Dropped {len(documents)} documents of {collection}:\n{exp}')
+            return False
+        self.logger.error(f'Moved {len(documents)} documents of {collection} to {path}.')
+        return True
+
+    @abc.abstractmethod
+    def _write(self, collection: str, documents: list[dict]):
+        """Durably append a batch of documents."""
+
+    def _close_files(self):
+        """Close the open files."""
+
+    def path(self, collection: str, extension: str) -> str:
+        """Return a new file name, unique across rotations and processes."""
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')
+        return os.path.join(self.directory, f'{collection}-{stamp}-{os.getpid()}.{extension}')
+
+    def close(self):
+        """Drain the buffer and close the files."""
+        with self._lock:
+            self.flush()
+            self._close_files()
+
+    def __enter__(self):
+        """Enter the context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Drain the buffer on exit."""
+        self.close()
+        return False
+
+
+class RotatingFile:
+    """An append-only file, optionally a zstd stream, replaced once it reaches `max_bytes`."""
+
+    def __init__(self, path_factory: Callable[[], str], max_bytes: int, compress: bool = False):
+        """Initialize the file, it is opened on the first write."""
+        if compress and zstandard is None:
+            raise RuntimeError('OUTPUT_ZSTD needs the zstandard package.')
+        self.path_factory = path_factory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._raw: BinaryIO | None = None
+        self._fp = None
+
+    def write(self, data: bytes):
+        """Append data and fsync it."""
+        if self._raw is None:
+            self._raw = open(self.path_factory(), 'ab')
+            self._fp = zstandard.ZstdCompressor().stream_writer(self._raw, closefd=False) if self.compress else self._raw
+        try:
+            self._fp.write(data)
+            if self.compress:
+                # End the block so everything written so far can be decompressed
+                self._fp.flush(zstandard.FLUSH_BLOCK)
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        except Exception:
+            # Nothing is appended after a partial write, the retry starts a new file
+            try:
+                self._raw.close()
+            except OSError:
+                pass
+            self._raw = self._fp = None
+            raise
+        if self._raw.tell() >= self.max_bytes:
+            self.close()
+
+    def close(self):
+        """Finish the stream and close the file."""
+        if self._raw is None:
+            return
+        if self.compress:
+            self._fp.flush(zstandard.FLUSH_FRAME)
+            self._fp.close()
+            self._raw.flush()
+            os.fsync(self._raw.fileno())
+        self._raw.close()
+        self._raw = self._fp = None
+
+
+class JsonlSink(BufferedFileSink):
+    """Append results as JSON lines, one rotating file per collection."""
+
+    def __init__(self,
+        directory: str = os.getenv('OUTPUT_DIR', 'output'),
+        max_bytes: int = int(os.getenv('OUTPUT_ROTATE_BYTES', 256 * 1024 * 1024)),
+        compress: bool = os.getenv('OUTPUT_ZSTD', '0') == '1',
+        **kwargs
+    ):
+        """Initialize the sink."""
+        super().__init__(directory, **kwargs)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.extension = 'jsonl.zst' if compress else 'jsonl'
+        self._files: dict[str, RotatingFile] = {}
+
+    def _write(self, collection: str, documents: list[dict]):
+        """Append the documents as lines with one write and one fsync."""
+        if collection not in self._files:
+            self._files[collection] = RotatingFile(
+                lambda: self.path(collection, self.extension), self.max_bytes, self.compress
+            )
+        lines = ''.join(json.dumps(document, ensure_ascii=False, default=str) + '\n' for document in documents)
+        self._files[collection].write(lines.encode('utf-8'))
+
+    def _close_files(self):
+        """Close the open files."""
+        for file in self._files.values():
+            file.close()
+
+
+class ParquetSink(BufferedFileSink):
+    """Write results as Parquet row groups, one rotating file per collection.
+
+    The schema of a collection is inferred from its batches, with all-null
+    columns typed as strings, and only grows. A batch adding fields closes
+    the current file, the next one is written with the merged schema; fields
+    a batch lacks are null.
+    """
+
+    def __init__(self,
+        directory: str = os.getenv('OUTPUT_DIR', 'output'),
+        max_rows: int = int(os.getenv('OUTPUT_ROTATE_ROWS', 1_000_000)),
+        **kwargs
+    ):
+        """Initialize the sink."""
+        if pyarrow is None:
+            raise RuntimeError('The parquet sink needs the pyarrow package.')
+        super().__init__(directory, **kwargs)
+        self.max_rows = max_rows
+        self._schemas: dict[str, Any] = {}
+        self._writers: dict[str, tuple[Any, BinaryIO, int]] = {}
+
+    @staticmethod
+    def infer_schema(documents: list[dict]):
+        """Return the schema of a batch, all-null columns typed as strings."""
+        return pyarrow.schema([
+            field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+            for field in pyarrow.Table.from_pylist(documents).schema
+        ])
+
+    def _write(self, collection: str, documents: list[dict]):
+        """Append the documents as one row group and fsync it."""
+        schema = self._schemas.get(collection)
+        inferred = self.infer_schema(documents)
+        if schema is None:
+            schema = inferred
+        elif not set(inferred.names) <= set(schema.names):
+            # Raises on a type conflict, the batch is then retried and dead-lettered
+            schema = pyarrow.unify_schemas([schema, inferred])
+        table = pyarrow.Table.from_pylist(documents, schema=schema)
+        if collection in self._writers and not self._writers[collection][0].schema.equals(schema):
+            # A Parquet file has a single schema, the added fields start a new file
+            self._close_writer(collection)
+        self._schemas[collection] = schema
+        if collection not in self._writers:
+            self._writers[collection] = (*self._open_writer(collection, schema), 0)
+        writer, fp, rows = self._writers[collection]
+        writer.write_table(table)
+        fp.flush()
+        os.fsync(fp.fileno())
+        rows += table.num_rows
+        self._writers[collection] = (writer, fp, rows)
+        if rows >= self.max_rows:
+            self._close_writer(collection)
+
+    def _open_writer(self, collection: str, schema) -> tuple[Any, BinaryIO]:
+        """Open a new file of a collection."""
+        path = self.path(collection, 'parquet')
+        fp = open(path, 'wb')
+        try:
+            return pyarrow.parquet.ParquetWriter(fp, schema, compression='zstd'), fp
+        except Exception:
+            fp.close()
+            os.remove(path)
+            raise
+
+    def _close_writer(self, collection: str):
+        """Write the footer of a file."""
+        writer, fp, _ = self._writers.pop(collection)
+        writer.close()
+        fp.flush()
+        os.fsync(fp.fileno())
+        fp.close()
+
+    def _close_files(self):
+        """Close the open files."""
+        for collection in list(self._writers):
+            self._close_writer(collection)
+
+
+def sink_from_env(connector: MongoDBConnector):
+    """Build the configured output sink, `connector` is used by the Mongo sink."""
+    backend = os.getenv('OUTPUT_SINK', 'mongo')
+    if backend == 'mongo':
+        return WriteBehindBuffer(connector)
+    if backend == 'jsonl':
+        return JsonlSink()
+    if backend == 'parquet':
+        return ParquetSink()
+    raise ValueError(f'Unknown output sink {backend}')
@@ -1,5 +1,6 @@
+import time
 from functools import wraps
-from typing import Any, TYPE_CHECKING
+from typing import Any, Iterator, TYPE_CHECKING
 import redis
 from redis.commands.json.path import Path
 
@@ -8,6 +9,14 @@ from custom_logger import CacherLogger
 if TYPE_CHECKING:
     import logging
 
+# Delete a lease only if it is still ours, an expired one may have been taken over
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
 def ensure_connection(func):
     """Ensure that the connection to Redis is established before executing the function."""
     @wraps(func)
@@ -45,10 +54,14 @@ class Cacher:
             self.client.ping()
             self.logger.info('Redis connection established.')
         except redis.ConnectionError:
+            # Without a client every call is skipped instead of failing
+            self.client = None
             self.logger.warning('Unable to connect to Redis.')
 
     def disconnect(self):
         """Disconnect from Redis."""
+        if self.client is None:
+            return
         self.client.close()
         self.logger.info('Redis connection closed.')
 
@@ -66,30 +79,158 @@ class Cacher:
         self.client.json().set(key, Path.root_path(), values)
 
     @ensure_connection
-    def search_by_status(self, status: str | int) -> list[dict]:
+    def insert_with_ttl(self, key: list[str], value: Any, ttl: int):
+        """Writes a key that expires after `ttl` seconds in one round trip."""
+        key = self.to_key(key)
+        with self.client.pipeline(transaction=True) as pipe:
+            pipe.json().set(key, Path.root_path(), value)
+            pipe.expire(key, ttl)
+            pipe.execute()
+
+    @ensure_connection
+    def claim(self, key: list[str], token: str, ttl: int) -> bool:
+        """Take a lease expiring after `ttl` seconds with SET NX EX, return True if nobody held it."""
+        return bool(self.client.set(self.to_key(key), token, nx=True, ex=ttl))
+
+    @ensure_connection
+    def renew(self, key: list[str], ttl: int):
+        """Extend a lease for another `ttl` seconds."""
+        self.client.expire(self.to_key(key), ttl)
+
+    @ensure_connection
+    def release(self, key: list[str], token: str):
+        """Give a lease back if it is still held with `token`."""
+        self.client.eval(RELEASE_SCRIPT, 1, self.to_key(key), token)
+
+    @ensure_connection
+    def get_many(self, keys: list[str]) -> list[Any]:
+        """Get many values from Redis synchronously in one round trip."""
+        if not keys:
+            return []
+        return self.client.json().mget(keys, Path.root_path())
+
+    @ensure_connection
+    def insert_many(self, mapping: dict[str, Any]):
+        """Writes many keys to Redis synchronously in one pipeline."""
+        if not mapping:
+            return
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, value in mapping.items():
+                pipe.json().set(key, Path.root_path(), value)
+            pipe.execute()
+
+    def filter_unseen(self, keys: list[str]) -> list[bool]:
+        """Return for every key whether it has not been stored yet."""
+        values = self.get_many(keys)
+        if values is None:
+            return [True] * len(keys)
+        return [value is None for value in values]
+
+    @staticmethod
+    def status_key(status: str | int) -> str:
+        """Return the key of the set indexing the documents holding a status."""
+        return f'index:status:{status}'
+
+    def iter_by_status(self, status: str | int, page_size: int = 500) -> Iterator[tuple[str, Any]]:
+        """Yield (key, records) of a status a SSCAN page at a time, in constant memory."""
+        if not self.client:
+            self.logger.warning('Redis connection not established. Skipping caching.')
+            return
+        index_key = self.status_key(status)
+        cursor = None
+        try:
+            while cursor != 0:
+                cursor, keys = self.client.sscan(index_key, cursor or 0, count=page_size)
+                if not keys:
+                    continue
+                records = self.client.json().mget(keys, f'$.{status}')
+                stale = []
+                for key, record in zip(keys, records):
+                    if record:
+                        yield key, record[0]
+                    else:
+                        stale.append(key)
+                if stale:
+                    # The document or its status went away without passing through the index
+                    self.client.srem(index_key, *stale)
+        except Exception as exp:
+            self.logger.error(f'Error while executing iter_by_status:\n{exp}')
+
+    def search_by_status(self, status: str | int) -> dict[str, Any]:
         """Search all the requests for a specific status."""
-        keys = self.client.keys('*')
-        records = self.client.json.mget(keys, Path.root_path())
-        results = {}
-        for key, record in zip(keys, records):
-            results[key] = record[str(status)]
-        return results
+        return dict(self.iter_by_status(status))
+
+    @ensure_connection
+    def index_statuses(self, match: str = '*', page_size: int = 1000) -> int:
+        """Index the statuses of documents written before the index existed, with SCAN."""
+        indexed = 0
+        for keys in self._scan_pages(match, page_size):
+            with self.client.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.json().objkeys(key, Path.root_path())
+                replies = pipe.execute(raise_on_error=False)
+            with self.client.pipeline(transaction=False) as pipe:
+                for key, statuses in zip(keys, replies):
+                    # Flags and other non-object documents have no statuses
+                    if isinstance(statuses, list):
+                        for status in statuses:
+                            pipe.sadd(self.status_key(status), key)
+                            indexed += 1
+                pipe.execute()
+        return indexed
+
+    def _scan_pages(self, match: str, page_size: int) -> Iterator[list[str]]:
+        """Yield the keys matching a pattern a SCAN page at a time."""
+        cursor = None
+        while cursor != 0:
+            cursor, keys = self.client.scan(cursor or 0, match=match, count=page_size)
+            keys = [key for key in keys if not key.startswith('index:')]
+            if keys:
+                yield keys
+
+    def _queue_status(self, pipe, key: str, status: str | int, records: list[dict], append: bool = False):
+        """Queue a path-level status write, creating the document if it is missing."""
+        # NX writes only create what is missing and never overwrite other statuses
+        pipe.json().set(key, Path.root_path(), {}, nx=True)
+        if append:
+            pipe.json().set(key, f'$.{status}', [], nx=True)
+            if records:
+                pipe.json().arrappend(key, f'$.{status}', *records)
+        else:
+            pipe.json().set(key, f'$.{status}', records)
+        pipe.sadd(self.status_key(status), key)
 
     @ensure_connection
     def update_by_status(self, key: str, status: str | int, records: list[dict]):
-        """Update the value of a specific status."""
-        value = self.client.json.get(key, Path.root_path())
-        value[str(status)] = records
-        self.client.json.set(key, Path.root_path(), value)
+        """Replace the records of a status atomically, without reading the document."""
+        with self.client.pipeline(transaction=True) as pipe:
+            self._queue_status(pipe, key, status, records)
+            pipe.execute()
+
+    @ensure_connection
+    def append_by_status(self, key: str, status: str | int, records: list[dict]):
+        """Append records to a status atomically with JSON.ARRAPPEND."""
+        with self.client.pipeline(transaction=True) as pipe:
+            self._queue_status(pipe, key, status, records, append=True)
+            pipe.execute()
+
+    @ensure_connection
+    def bulk_update_by_status(self, mapping: dict[str, dict[str, list[dict]]]):
+        """Replace the records of many statuses of many keys in one transaction."""
+        with self.client.pipeline(transaction=True) as pipe:
+            for key, payload in mapping.items():
+                for status, records in payload.items():
+                    self._queue_status(pipe, key, status, records)
+            pipe.execute()
 
     @ensure_connection
-    def bulk_update_by_status(self, mapping: dict[str, str | list[dict]]):
-        """Update the value of a specific status."""
-        pipe = self.client.pipeline(transaction=True)
-        for key, payload in mapping.items():
-            for status, records in payload.items():
-                pipe.json.set(key, f'$.{status}', records)
-        pipe.execute()
+    def bulk_append_by_status(self, mapping: dict[str, dict[str, list[dict]]]):
+        """Append records to many statuses of many keys in one transaction."""
+        with self.client.pipeline(transaction=True) as pipe:
+            for key, payload in mapping.items():
+                for status, records in payload.items():
+                    self._queue_status(pipe, key, status, records, append=True)
+            pipe.execute()
 
     def __enter__(self):
         """Connect to Redis."""
@@ -105,3 +246,76 @@ class Cacher:
     def to_key(args):
         """Convert arguments to a Redis key."""
         return ':'.join(args)
+
+
+class Checkpoint:
+    """A resume point that is written every `every` names or `interval` seconds."""
+
+    def __init__(self, cacher: Cacher, key: list[str], every: int = 100, interval: float = 5.0):
+        """Initialize the checkpoint."""
+        self.cacher = cacher
+        self.key = key
+        self.every = every
+        self.interval = interval
+        self.value = None
+        self._written = None
+        self._pending = 0
+        self._last_write = time.monotonic()
+
+    def advance(self, value: Any) -> bool:
+        """Move the checkpoint, return True if it was written."""
+        self.value = value
+        self._pending += 1
+        if self._pending >= self.every or time.monotonic() - self._last_write >= self.interval:
+            return self.flush()
+        return False
+
+    def flush(self) -> bool:
+        """Write the latest value if it changed."""
+        self._pending = 0
+        self._last_write = time.monotonic()
+        if self.value is None or self.value == self._written:
+            return False
+        self.cacher.insert(self.key, self.value)
+        self._written = self.value
+        return True
+
+
+class RetryList:
+    """Names given up on while throttled, a Redis set the next run searches first.
+
+    The resume point moves past a name that was given up on, so the name is
+    added here before and removed once its results are written.
+    """
+
+    def __init__(self, cacher: Cacher, key: str):
+        """Initialize the list."""
+        self.cacher = cacher
+        self.key = f'retry:{key}'
+        self.logger: logging.Logger = CacherLogger()
+
+    @property
+    def client(self):
+        """The Redis client of the cacher."""
+        return self.cacher.client
+
+    @ensure_connection
+    def add(self, names: list[str]):
+        """Keep names to search again."""
+        if names:
+            self.client.sadd(self.key, *names)
+
+    @ensure_connection
+    def remove(self, names: list[str]):
+        """Forget names whose results are written."""
+        if names:
+            self.client.srem(self.key, *names)
+
+    @ensure_connection
+    def _members(self, page_size: int) -> list[str]:
+        """SSCAN the whole set."""
+        return list(self.client.sscan_iter(self.key, count=page_size))
+
+    def pending(self, page_size: int = 500) -> list[str]:
+        """Return the names left from earlier runs."""
+        return (self._members(page_size) or []) if self.client else []
@@ -1,6 +1,5 @@
 import os
 import json
-import random
 import asyncio
 import aiofiles
 import concurrent.futures
@@ -8,6 +7,7 @@ from duckduckgo_search import DDGS
 from mongo import MongoDBConnector
 from synccacher import Cacher
 from filter import specialized_filter
+from name_source import name_resources
 
 from itertools import islice
 
@@ -28,25 +28,11 @@ class SearchResult:
 
     @staticmethod
     def generate_name():
-        # Get the directory of the current script
-        script_dir = os.path.dirname(__file__)
-        first_name_path = os.path.join(script_dir, 'resource/firstname.json')
-        with open(first_name_path, 'r', encoding="utf-8") as fp:
-            first_names = json.load(fp)
-
-        last_name_path = os.path.join(script_dir, 'resource/lastname.json')
-        with open(last_name_path, 'r', encoding="utf-8") as fp:
-            last_names = json.load(fp)
-
+        # The name lists are compiled once and memory-mapped, nothing is parsed per call
+        names = name_resources()
         while True:
             # Randomly select a first name and last name
-            first_name = random.choice(first_names)
-            last_name = random.choice(last_names)
-
-            # Combine the first name and last name to form a full name
-            full_name = f"{first_name} {last_name}"
-
-            yield full_name
+            yield names.sample()
     
     @staticmethod
     def search_query_platform(fullname:str,platform):
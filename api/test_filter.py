@@ -0,0 +1,55 @@
+"""The compiled URL classifier against the per-platform filters it replaced."""
+import pytest
+
+from filter import PLATFORM_RULES, classifier, platform_filters, specialized_filter
+
+HOSTS = [host for rule in PLATFORM_RULES.values() for host in rule['hosts']] + [
+    'about.pinterest.com', 'help.pinterest.com', 'example.com',
+]
+PATHS = [
+    '', '/', '/anna', '/anna/', '/@anna', '/anna/@anna', '/in/anna', '/people/anna/123', '/people',
+    '/user/anna/posts', '/r/sweden/user/anna', '/anna/posts/1', '/p/anna?igshid=1', '/anna;params',
+    '/search?q=anna#top', '//anna',
+]
+URLS = [
+    f'{scheme}://{prefix}{host}{path}'
+    for scheme in ('https', 'http')
+    for prefix in ('', 'www.')
+    for host in HOSTS
+    for path in PATHS
+] + [
+    'https://[::1/anna', 'not a url', '', '  https://twitter.com/anna', 'https://twitter.com/an\tna',
+    'https://user@facebook.com:443/anna', 'https://LinkedIn.com/in/anna', 'ftp://instagram.com/anna;x',
+]
+
+
+def legacy(filter_function, url):
+    """The verdict of a legacy filter, one that raised rejected the URL."""
+    try:
+        return bool(filter_function(url))
+    except Exception:
+        return False
+
+
+@pytest.mark.parametrize('platform', sorted(platform_filters))
+def test_filter_many_matches_the_legacy_filters(platform):
+    expected = [legacy(platform_filters[platform], url) for url in URLS]
+    assert classifier.filter_many(URLS, platform) == expected
+
+
+@pytest.mark.parametrize('platform', sorted(platform_filters))
+def test_specialized_filter_matches_the_legacy_filters(platform):
+    for url in URLS:
+        assert specialized_filter(url, platform) == legacy(platform_filters[platform], url), url
+
+
+def test_classify_finds_the_platform_of_a_host():
+    assert classifier.classify('https://www.linkedin.com/in/anna') == ('linkedin', True)
+    assert classifier.classify('https://x.com/anna') == ('twitter', True)
+    assert classifier.classify('https://about.pinterest.com/anna') == ('pinterest', False)
+    assert classifier.classify('https://example.com/anna') == (None, False)
+
+
+def test_unknown_platform_raises():
+    with pytest.raises(KeyError):
+        specialized_filter('https://example.com/anna', 'myspace')
@@ -0,0 +1,42 @@
+"""Filling the priority frontier from the name source and checkpointing behind it."""
+from frontier import PriorityFrontier
+from scheduler import Watermark
+from serp_crawler import SearchResult
+
+
+class FakeScorer:
+    """Scores a name by the number it ends with, later names first."""
+
+    def scores(self, full_names):
+        return {full_name: float(full_name.split()[-1]) for full_name in full_names}
+
+
+def test_the_source_is_read_only_while_the_frontier_has_room():
+    frontier = PriorityFrontier(maxsize=3)
+    names = iter([(f'Name {i}', i) for i in range(10)])
+    windows = SearchResult.prioritized(names, frontier, FakeScorer(), 2, lambda index: None)
+    assert next(windows) == [('Name 2', 2), ('Name 1', 1)]
+    assert len(frontier) == 1
+    assert next(windows) == [('Name 4', 4), ('Name 3', 3)]
+    assert next(names) == ('Name 5', 5)
+
+
+def test_the_checkpoint_stays_below_every_queued_name():
+    frontier = PriorityFrontier(maxsize=4)
+    watermark = Watermark(0)
+    names = iter([(f'Name {i}', i) for i in range(20)])
+    for window in SearchResult.prioritized(names, frontier, FakeScorer(), 1, watermark.complete):
+        for _, index in window:
+            watermark.complete(index)
+        queued = [frontier._indexes[full_name] for full_name, _ in frontier.members()]
+        # Name 0 scores lowest and stays queued until the source runs out
+        assert watermark.value <= min(queued, default=watermark.value)
+    assert watermark.value == 20
+
+
+def test_a_name_read_again_while_queued_is_a_repeat():
+    frontier, repeated = PriorityFrontier(), []
+    names = iter([('Anna 1', 0), ('Bo 2', 1), ('Anna 1', 2), ('Anna 1', 3)])
+    windows = list(SearchResult.prioritized(names, frontier, FakeScorer(), 10, repeated.append))
+    assert windows == [[('Bo 2', 1), ('Anna 1', 0)]]
+    assert repeated == [2, 3]
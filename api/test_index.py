@@ -0,0 +1,166 @@
+"""Routes of the lookup API and the merging of its background jobs."""
+import threading
+import time
+
+import pytest
+
+import index
+from serp_crawler import SearchResult
+
+
+class FakeCacher:
+    """Job states, leases and flags kept in dicts, as the Cacher stores them in Redis."""
+
+    def __init__(self):
+        self.client = True
+        self.data = {}
+        self.leases = {}
+
+    def get(self, key):
+        return self.data.get(':'.join(key))
+
+    def insert_with_ttl(self, key, value, ttl):
+        self.data[':'.join(key)] = value
+
+    def insert_many(self, mapping):
+        self.data.update(mapping)
+
+    def claim(self, key, token, ttl):
+        return self.leases.setdefault(':'.join(key), token) == token
+
+    def renew(self, key, ttl):
+        pass
+
+    def release(self, key, token):
+        if self.leases.get(':'.join(key)) == token:
+            del self.leases[':'.join(key)]
+
+
+class FakeConnector:
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+
+    def find_documents(self, collection, query):
+        keys = query['lookup']['$in']
+        return [document for document in self.documents if document['lookup'] in keys]
+
+
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+
+    def submit(self, collection, documents, filter_field, on_flush=None):
+        self.written.append((collection, documents))
+        if on_flush is not None:
+            on_flush()
+
+
+def fake_manager(documents=(), stale_after=300):
+    """A JobManager running on fakes instead of Redis and MongoDB."""
+    manager = index.JobManager.__new__(index.JobManager)
+    manager.executor = index.concurrent.futures.ThreadPoolExecutor(2)
+    manager.ttl, manager.stale_after = 3600, stale_after
+    manager.cacher, manager.connector, manager.writer = FakeCacher(), FakeConnector(documents), FakeWriter()
+    manager._jobs, manager._finished = {}, index.LRUCache(10)
+    manager._changed = threading.Condition()
+    return manager
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(SearchResult, 'cached_text_results', staticmethod(lambda name, platform: None))
+    monkeypatch.setattr(index, '_manager', fake_manager())
+    yield index.app.test_client()
+    index._manager.executor.shutdown(wait=True)
+
+
+def profiles(name, platform):
+    return [{'url': f'https://{platform}.com/{name.split()[0].lower()}', 'title': name}]
+
+
+def test_health(client):
+    assert client.get('/').json == {'status': 'ok'}
+    assert client.get('/api/index').json == {'status': 'ok'}
+
+
+def test_search_rejects_a_missing_name_and_unknown_platforms(client):
+    assert client.get('/api/search').status_code == 400
+    response = client.get('/api/search?name=Anna&platforms=facebook,myspace')
+    assert response.status_code == 400 and 'myspace' in response.json['error']
+
+
+def test_search_answers_from_stored_lookups(client, monkeypatch):
+    document = {'lookup': 'anna berg:facebook:v2', 'platform': 'facebook', 'results': profiles('Anna Berg', 'facebook')}
+    monkeypatch.setattr(index, '_manager', fake_manager([document]))
+    response = client.get('/api/search?name=Anna  Berg&platforms=facebook')
+    assert response.status_code == 200
+    assert response.json['sources'] == {'facebook': 'mongo'}
+    assert response.json['results'] == {'facebook': document['results']}
+
+
+def test_search_starts_a_job_and_the_job_can_be_waited_on(client, monkeypatch):
+    monkeypatch.setattr(SearchResult, 'search_with_retry', staticmethod(profiles))
+    response = client.get('/api/search?name=Anna Berg&platforms=facebook,linkedin')
+    assert response.status_code == 202
+    state = client.get(f"{response.json['status_url']}?wait=5").json
+    assert state['status'] == 'done'
+    assert state['results'] == {platform: profiles('Anna Berg', platform) for platform in ('facebook', 'linkedin')}
+    assert index._manager.cacher.data['anna berg:linkedin:v2'] is True
+
+
+def test_concurrent_lookups_share_one_job(client, monkeypatch):
+    release, calls = threading.Event(), []
+
+    def search(name, platform):
+        calls.append(platform)
+        release.wait(5)
+        return profiles(name, platform)
+
+    monkeypatch.setattr(SearchResult, 'search_with_retry', staticmethod(search))
+    first = client.get('/api/search?name=Anna Berg&platforms=facebook').json
+    second = client.get('/api/search?name=anna berg&platforms=facebook').json
+    release.set()
+    assert first['job'] == second['job']
+    assert client.get(f"/api/jobs/{first['job']}?wait=5").json['status'] == 'done'
+    assert calls == ['facebook']
+
+
+def test_a_job_leased_by_another_process_is_joined(client, monkeypatch):
+    monkeypatch.setattr(SearchResult, 'search_with_retry', staticmethod(profiles))
+    job_id = index.JobManager.job_id('Anna Berg', ['facebook'])
+    remote = {'job': job_id, 'status': 'running', 'version': 3, 'updated_at': time.time()}
+    index._manager.cacher.leases[f'job:{job_id}:lease'] = 'other'
+    index._manager.cacher.data[f'job:{job_id}'] = remote
+    response = client.get('/api/search?name=Anna Berg&platforms=facebook')
+    assert response.status_code == 202 and response.json['status'] == 'running'
+    assert index._manager._jobs == {}
+
+
+def test_a_stale_job_is_started_again(client, monkeypatch):
+    monkeypatch.setattr(SearchResult, 'search_with_retry', staticmethod(profiles))
+    manager, job_id = index._manager, index.JobManager.job_id('Anna', ['facebook'])
+    stale = manager._jobs[job_id] = index.Job(job_id, 'Anna', ['facebook'])
+    stale.status, stale.updated_at = 'running', time.time() - manager.stale_after - 1
+    job = client.get('/api/search?name=Anna&platforms=facebook').json
+    assert client.get(f"/api/jobs/{job['job']}?wait=5").json['status'] == 'done'
+    assert stale.status == 'running'
+
+
+def test_a_failing_job_ends_failed(client, monkeypatch):
+    monkeypatch.setattr(SearchResult, 'search_with_retry', staticmethod(profiles))
+
+    def broken(*args, **kwargs):
+        raise RuntimeError('queue closed')
+
+    index._manager.writer.submit = broken
+    job = client.get('/api/search?name=Anna&platforms=facebook').json
+    state = client.get(f"/api/jobs/{job['job']}?wait=5").json
+    assert state['status'] == 'failed'
+    index._manager.executor.shutdown(wait=True)
+    assert index._manager.cacher.leases == {}
+
+
+def test_job_status_rejects_an_unknown_job_and_a_bad_wait(client):
+    assert client.get('/api/jobs/missing').status_code == 404
+    assert client.get('/api/jobs/missing/events').status_code == 404
+    assert client.get('/api/jobs/missing?wait=soon').status_code == 400
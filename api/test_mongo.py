@@ -0,0 +1,105 @@
+"""The write-behind buffer and the coalesced background upserts of the Mongo writer."""
+import json
+import threading
+
+import pytest
+
+from mongo import BackgroundWriter, WriteBehindBuffer
+
+
+class FakeConnector:
+    """Records the bulk upserts instead of sending them."""
+
+    def __init__(self):
+        self.writes = []
+        self.lock = threading.Lock()
+
+    def bulk_upsert_updated(self, collection, documents, filter_field, ordered=True):
+        with self.lock:
+            self.writes.append((collection, [document[filter_field] for document in documents]))
+        return True
+
+
+class FailingConnector(FakeConnector):
+    """Fails the writes of some collections."""
+
+    def __init__(self, failing):
+        super().__init__()
+        self.failing = failing
+
+    def bulk_upsert_updated(self, collection, documents, filter_field, ordered=True):
+        if collection in self.failing:
+            raise ValueError('document rejected')
+        return super().bulk_upsert_updated(collection, documents, filter_field, ordered)
+
+
+def buffer(connector, tmp_path, **kwargs):
+    return WriteBehindBuffer(connector, max_interval=float('inf'), dead_letter_dir=str(tmp_path / 'dead'), **kwargs)
+
+
+def test_a_failed_write_is_retried_and_the_others_run_their_callbacks(tmp_path):
+    connector, done = FailingConnector({'images'}), []
+    write_behind = buffer(connector, tmp_path, max_retries=3)
+    write_behind.add('profiles', [{'url': 'https://example.com/anna'}], 'url', on_flush=lambda: done.append('profiles'))
+    write_behind.add('images', [{'url': 'https://example.com/anna.jpg'}], 'url', on_flush=lambda: done.append('images'))
+    write_behind.flush()
+    assert done == ['profiles']
+    connector.failing.clear()
+    write_behind.flush()
+    assert done == ['profiles', 'images']
+    assert connector.writes == [('profiles', ['https://example.com/anna']), ('images', ['https://example.com/anna.jpg'])]
+
+
+def test_a_write_failing_every_retry_goes_to_the_dead_letter_file(tmp_path):
+    connector, done = FailingConnector({'images'}), []
+    write_behind = buffer(connector, tmp_path, max_retries=2)
+    write_behind.add('images', [{'url': 'https://example.com/anna.jpg'}], 'url', on_flush=lambda: done.append('images'))
+    for _ in range(3):
+        assert done == []
+        write_behind.flush()
+    assert done == ['images']
+    # Nothing is left to retry
+    write_behind.flush()
+    lines = [json.loads(line) for path in (tmp_path / 'dead').iterdir() for line in path.read_text(encoding='utf-8').splitlines()]
+    assert [(line['collection'], line['filter_field'], line['document']['url']) for line in lines] == [
+        ('images', 'url', 'https://example.com/anna.jpg')
+    ]
+
+
+def test_a_write_that_cannot_be_dead_lettered_is_dropped_with_its_callbacks(tmp_path):
+    (tmp_path / 'dead').write_text('', encoding='utf-8')
+    connector, done = FailingConnector({'images'}), []
+    write_behind = buffer(connector, tmp_path, max_retries=0)
+    write_behind.add('images', [{'url': 'https://example.com/anna.jpg'}], 'url', on_flush=lambda: done.append('images'))
+    write_behind.flush()
+    write_behind.flush()
+    assert done == [] and write_behind._count == 0
+
+
+def test_background_writer_writes_everything_and_runs_callbacks():
+    connector = FakeConnector()
+    done = []
+    with BackgroundWriter(connector, workers=2, max_queue=4, batch_documents=10) as writer:
+        for i in range(20):
+            writer.submit('profiles', [{'url': f'https://example.com/user{i}'}], 'url',
+                          on_flush=lambda i=i: done.append(i))
+        writer.flush()
+        assert sorted(done) == list(range(20))
+    written = sorted(url for _, urls in connector.writes for url in urls)
+    assert written == sorted(f'https://example.com/user{i}' for i in range(20))
+
+
+def test_background_writer_writes_a_repeated_document_once():
+    connector = FakeConnector()
+    with BackgroundWriter(connector, workers=1, max_queue=10, batch_documents=100) as writer:
+        for _ in range(5):
+            writer.submit('profiles', [{'url': 'https://example.com/anna', 'title': 'Anna'}], 'url')
+    # Coalesced into one batch, or dropped as an unchanged repeat of the last write
+    assert [url for _, urls in connector.writes for url in urls] == ['https://example.com/anna']
+
+
+def test_a_closed_writer_refuses_new_documents():
+    writer = BackgroundWriter(FakeConnector(), workers=1)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit('profiles', [{'url': 'https://example.com/anna'}], 'url')
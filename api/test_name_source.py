@@ -0,0 +1,91 @@
+"""Name sources: the CSV index, compiled tables and the Feistel enumeration."""
+import io
+
+import pytest
+
+from name_source import BinaryNameTable, CsvNameSource, FeistelPermutation, NameEnumerator, NameResources
+
+
+def table(names):
+    """A single column table held in memory."""
+    data = io.BytesIO()
+    BinaryNameTable.dump(data, lambda: ([name] for name in names), 1)
+    return BinaryNameTable('<memory>', data.getvalue())
+
+
+def write_csv(path, rows):
+    path.write_text(''.join(f'First{i},Last{i}\n' for i in range(rows)), encoding='utf-8')
+    return str(path)
+
+
+def test_csv_source_counts_and_seeks_through_its_index(tmp_path):
+    source = CsvNameSource(write_csv(tmp_path / 'names.csv', 2500), stride=1024)
+    assert len(source) == 2500
+    assert next(source.iter_names(2049)) == ('First2049 Last2049', 2049)
+    assert list(source.iter_names(2498)) == [('First2498 Last2498', 2498), ('First2499 Last2499', 2499)]
+
+
+def test_csv_source_resumes_from_a_byte_offset(tmp_path):
+    source = CsvNameSource(write_csv(tmp_path / 'names.csv', 10))
+    names = source.iter_names()
+    assert [next(names) for _ in range(3)][-1] == ('First2 Last2', 2)
+    assert next(CsvNameSource(source.path).iter_names(3, source.offset)) == ('First3 Last3', 3)
+
+
+def test_compiled_table_matches_the_csv(tmp_path):
+    csv_path = write_csv(tmp_path / 'names.csv', 100)
+    BinaryNameTable.compile_csv(csv_path, str(tmp_path / 'names.bin'))
+    with BinaryNameTable(str(tmp_path / 'names.bin')) as table:
+        assert len(table) == 100
+        assert table.row(42) == ['First42', 'Last42']
+        assert list(table.iter_names(98)) == list(CsvNameSource(csv_path).iter_names(98))
+
+
+def test_resources_address_every_combination_once():
+    resources = NameResources(table(['Anna', 'Bo', 'Åsa']), table(['Berg', 'Ek']))
+    assert len(resources) == 6
+    assert resources.pair(4) == ('Bo', 'Ek')
+    assert sorted(name for name, _ in resources.iter_names()) == sorted(
+        f'{first} {last}' for first in ['Anna', 'Bo', 'Åsa'] for last in ['Berg', 'Ek'])
+    with pytest.raises(IndexError):
+        resources.pair(6)
+    resources.close()
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64, 1000, 4097])
+@pytest.mark.parametrize('seed', ['a', 'b'])
+def test_feistel_is_a_bijection(size, seed):
+    permutation = FeistelPermutation(size, seed)
+    assert sorted(permutation(index) for index in range(size)) == list(range(size))
+
+
+def test_feistel_depends_on_the_seed_only():
+    assert [FeistelPermutation(1000, 'a')(i) for i in range(50)] == [FeistelPermutation(1000, 'a')(i) for i in range(50)]
+    assert [FeistelPermutation(1000, 'a')(i) for i in range(50)] != [FeistelPermutation(1000, 'b')(i) for i in range(50)]
+
+
+def test_feistel_rejects_indexes_out_of_range():
+    with pytest.raises(IndexError):
+        FeistelPermutation(10, 'a')(10)
+
+
+def test_enumerator_yields_every_combination_once_and_resumes():
+    resources = NameResources(table(['Anna', 'Bo', 'Åsa']), table(['Berg', 'Ek']))
+    enumerator = NameEnumerator(resources, seed='run')
+    names = [name for name, _ in enumerator.iter_names()]
+    assert sorted(names) == sorted(f'{first} {last}' for first in ['Anna', 'Bo', 'Åsa'] for last in ['Berg', 'Ek'])
+    assert [name for name, _ in enumerator.iter_names(4)] == names[4:]
+
+
+def test_distinct_keeps_the_first_spelling_in_order():
+    assert BinaryNameTable.distinct(['Anna', 'Bo', 'ANNA', 'bo', 'Åsa']) == ['Anna', 'Bo', 'Åsa']
+    assert BinaryNameTable.distinct(['Anna', 'Bo', 'anna']) == ['Anna', 'Bo']
+
+
+def test_json_lists_fall_back_to_memory_when_the_cache_is_not_writable(tmp_path):
+    json_path = tmp_path / 'firstname.json'
+    json_path.write_text('["Anna", "Bo", "anna"]', encoding='utf-8')
+    blocker = tmp_path / 'cache'
+    blocker.write_text('', encoding='utf-8')
+    with BinaryNameTable.from_json(str(json_path), str(blocker / 'sub')) as names:
+        assert [name for name, _ in names.iter_names()] == ['Anna', 'Bo']
@@ -0,0 +1,35 @@
+"""Canonical profile URLs."""
+from urllib.parse import urlsplit
+
+import pytest
+
+from normalize import canonical_url, dedupe_documents
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('http://M.Facebook.com/Anna.Berg/?locale=sv_SE#top', 'https://www.facebook.com/anna.berg'),
+    ('https://sv-se.facebook.com/people/Anna-Berg/100012345678', 'https://www.facebook.com/profile.php?id=100012345678'),
+    ('https://se.linkedin.com/in/anna-berg/details/experience/', 'https://www.linkedin.com/in/anna-berg'),
+    ('https://mobile.twitter.com/AnnaBerg', 'https://twitter.com/annaberg'),
+    ('https://old.reddit.com/user/anna/', 'https://www.reddit.com/user/anna'),
+])
+def test_mirrors_map_to_one_url(url, expected):
+    assert canonical_url(url) == expected
+
+
+@pytest.mark.parametrize('url', [
+    # Short links and separate sites keep their host
+    'https://vm.tiktok.com/ZMabcdef/',
+    'https://sv.quora.com/profile/Anna-Berg',
+    'https://anna.medium.com/',
+])
+def test_other_subdomains_are_kept(url):
+    assert urlsplit(canonical_url(url)).hostname == urlsplit(url).hostname
+
+
+def test_variants_of_a_profile_are_merged():
+    documents = dedupe_documents([
+        {'url': 'https://m.instagram.com/anna.berg/', 'title': 'Anna'},
+        {'url': 'https://www.instagram.com/Anna.Berg?igshid=x', 'body': 'Photos'},
+    ])
+    assert documents == [{'url': 'https://www.instagram.com/anna.berg', 'title': 'Anna', 'body': 'Photos'}]
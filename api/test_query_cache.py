@@ -0,0 +1,42 @@
+"""Expiry of the in-process tier of the query cache."""
+import time
+
+import pytest
+
+from query_cache import QueryCache
+
+
+class NoRedis:
+    client = None
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def test_local_entries_expire_with_the_redis_ttl(clock):
+    cache = QueryCache(NoRedis(), ttl=60)
+    cache.put('ddg-text', 'se-sv', 'anna', [{'href': 'https://example.com/anna'}])
+    clock[0] += 59
+    assert cache.get('ddg-text', 'se-sv', 'anna') == [{'href': 'https://example.com/anna'}]
+    clock[0] += 1
+    assert cache.get('ddg-text', 'se-sv', 'anna') is None
+    assert len(cache.local) == 0
+
+
+def test_empty_responses_are_kept_briefly(clock):
+    cache = QueryCache(NoRedis(), ttl=60, empty_ttl=10)
+    cache.put('ddg-text', 'se-sv', 'anna', [])
+    assert cache.get('ddg-text', 'se-sv', 'anna') == []
+    clock[0] += 10
+    assert cache.get('ddg-text', 'se-sv', 'anna') is None
+
+
+def test_empty_responses_can_be_left_out(clock):
+    cache = QueryCache(NoRedis(), ttl=60, empty_ttl=0)
+    cache.put('ddg-text', 'se-sv', 'anna', [])
+    assert cache.get('ddg-text', 'se-sv', 'anna') is None
+    assert cache.stats['writes'] == 0
@@ -0,0 +1,98 @@
+"""The checkpoint watermark and the weighted round robin of the scheduler."""
+import concurrent.futures
+from collections import Counter
+
+from scheduler import Scheduler, Watermark, WeightedRoundRobin, parse_weights
+
+
+def test_watermark_waits_for_every_predecessor():
+    watermark = Watermark(10)
+    assert not watermark.complete(12)
+    assert not watermark.complete(11)
+    assert watermark.value == 10
+    assert watermark.complete(10)
+    assert watermark.value == 13
+
+
+def test_watermark_ignores_indexes_behind_it():
+    watermark = Watermark(5)
+    assert watermark.complete(5)
+    assert not watermark.complete(3)
+    assert watermark.value == 6
+
+
+def test_round_robin_follows_the_weights_smoothly():
+    round_robin = WeightedRoundRobin({'facebook': 2, 'linkedin': 1, 'tiktok': 0})
+    picks = [round_robin.next() for _ in range(30)]
+    assert Counter(picks) == {'facebook': 20, 'linkedin': 10}
+    # Never three times the same key in a row with weights 2:1
+    assert all(len(set(picks[i:i + 3])) > 1 for i in range(len(picks) - 2))
+
+
+def test_round_robin_stops_picking_removed_keys():
+    round_robin = WeightedRoundRobin({'facebook': 1, 'linkedin': 1})
+    round_robin.remove('facebook')
+    assert {round_robin.next() for _ in range(5)} == {'linkedin'}
+    round_robin.remove('linkedin')
+    assert not round_robin
+
+
+def test_parse_weights_defaults_to_one():
+    assert parse_weights('facebook=3, unknown=2', ['facebook', 'linkedin']) == {'facebook': 3, 'linkedin': 1}
+
+
+class FakeBuffer:
+    """Keeps the callbacks until `flush` is called."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def add(self, collection, documents, filter_field, on_flush=None):
+        if on_flush is not None:
+            self.callbacks.append(on_flush)
+
+    def flush(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+
+def test_checkpoint_moves_once_the_results_are_flushed():
+    names = [('Anna Berg', 0), ('Bo Ek', 1)]
+    scheduler = Scheduler(lambda task: [], {'facebook': ['$query']}, lambda start: iter(names[start:]), {}, window_size=2)
+    scheduler.open()
+    buffer = FakeBuffer()
+    for _ in names:
+        future = concurrent.futures.Future()
+        future.set_result((3, [{'url': 'https://facebook.com/anna'}], 0.1))
+        scheduler.finish(scheduler.next_task(), future, buffer)
+    scheduler.mark_done()
+    assert scheduler._checkpoints['facebook'].value is None
+    buffer.flush()
+    scheduler.mark_done()
+    assert scheduler._checkpoints['facebook'].value == 2
+
+
+class FakePlanner:
+    def __init__(self):
+        self.records = []
+
+    def plan(self, platform):
+        return ['$query', '$query profile'], False
+
+    def record(self, platform, template, *args, **kwargs):
+        self.records.append((platform, template, *args, *kwargs.items()))
+
+
+def test_the_planner_records_returned_kept_and_new():
+    planner = FakePlanner()
+    scheduler = Scheduler(lambda task: None, {'facebook': ['$query']}, lambda start: iter([('Anna Berg', 0)]), {},
+                          planner=planner)
+    scheduler.open()
+    results = [(5, [{'url': 'https://facebook.com/anna'}], 0.2),
+               (4, [{'url': 'https://facebook.com/anna'}, {'url': 'https://facebook.com/anna.berg'}], 0.3)]
+    for result in results:
+        future = concurrent.futures.Future()
+        future.set_result(result)
+        scheduler.finish(scheduler.next_task(), future, FakeBuffer())
+    assert planner.records == [('facebook', '$query', 5, 1, 1, 0.2), ('facebook', '$query profile', 4, 2, 1, 0.3)]
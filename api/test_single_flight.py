@@ -0,0 +1,130 @@
+"""Coalescing of identical calls and the Redis lease of SingleFlight."""
+import threading
+import time
+
+import pytest
+
+from single_flight import RELEASE_SCRIPT, SingleFlight
+
+
+class FakeRedis:
+    """The commands the lease uses: SET NX PX, GET and the release script."""
+
+    def __init__(self):
+        self.data = {}
+        self.sets = 0
+
+    def set(self, key, value, nx=False, px=None):
+        self.sets += 1
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def register_script(self, script):
+        assert script == RELEASE_SCRIPT
+
+        def release(keys, args):
+            if self.data.get(keys[0]) == args[0]:
+                del self.data[keys[0]]
+                return 1
+            return 0
+        return release
+
+
+class FakeCacher:
+    def __init__(self):
+        self.client = FakeRedis()
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight(lease_ttl=0)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', call)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', call))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    # The followers wait on the leader's future
+    while flight.stats['shared'] < 4:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert calls == [1]
+    assert results == ['result'] * 5
+    assert flight.stats == {'calls': 1, 'shared': 4, 'remote': 0}
+
+
+def test_an_error_is_raised_and_the_next_call_runs_again():
+    flight = SingleFlight(lease_ttl=0)
+
+    def fail():
+        raise RuntimeError('upstream')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    assert flight.do('key', lambda: 'again') == 'again'
+
+
+def test_the_lease_is_released_after_the_call():
+    cacher = FakeCacher()
+    flight = SingleFlight(cacher, lease_ttl=60)
+    assert flight.do('key', lambda: 'result') == 'result'
+    assert cacher.client.data == {}
+
+
+def test_the_lease_is_released_when_the_call_fails():
+    cacher = FakeCacher()
+    flight = SingleFlight(cacher, lease_ttl=60)
+
+    def fail():
+        raise RuntimeError('upstream')
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    assert cacher.client.data == {}
+
+
+def test_a_lease_taken_over_is_not_released():
+    cacher = FakeCacher()
+    flight = SingleFlight(cacher, lease_ttl=60)
+
+    def call():
+        # The lease expired and another process took it
+        cacher.client.data['flight:key'] = 'other'
+        return 'result'
+
+    flight.do('key', call)
+    assert cacher.client.data == {'flight:key': 'other'}
+
+
+def test_a_leased_key_is_read_from_the_leader_of_another_process():
+    cacher = FakeCacher()
+    cacher.client.data['flight:key'] = 'other'
+    flight = SingleFlight(cacher, lease_ttl=60, poll_interval=0.001)
+    peeks = iter([None, 'stored'])
+    assert flight.do('key', lambda: pytest.fail('called'), lambda: next(peeks)) == 'stored'
+    assert flight.stats['remote'] == 1
+    assert cacher.client.data == {'flight:key': 'other'}
+
+
+def test_prepare_runs_before_the_lease_is_taken():
+    cacher = FakeCacher()
+    flight = SingleFlight(cacher, lease_ttl=60)
+    leases = []
+    flight.do('key', lambda: leases.append(list(cacher.client.data)), prepare=lambda: leases.append(list(cacher.client.data)))
+    assert leases == [[], ['flight:key']]
@@ -0,0 +1,103 @@
+"""File sinks: rotation, callbacks and failed writes."""
+import json
+
+import pytest
+
+from sinks import BufferedFileSink, JsonlSink, ParquetSink
+
+
+def read_lines(directory):
+    """Return the JSON lines of every file of a directory and the file count."""
+    files = sorted(directory.iterdir())
+    return [json.loads(line) for path in files for line in path.read_text(encoding='utf-8').splitlines()], len(files)
+
+
+def test_the_base_sink_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        BufferedFileSink(str(tmp_path))
+
+
+def test_jsonl_sink_rotates_and_keeps_every_document(tmp_path):
+    done = []
+    with JsonlSink(str(tmp_path), max_bytes=200, batch_documents=2, max_interval=float('inf')) as sink:
+        for i in range(10):
+            sink.add('profiles', [{'url': f'https://example.com/user{i}', 'title': 'x' * 50}], 'url',
+                     on_flush=lambda i=i: done.append(i))
+    documents, files = read_lines(tmp_path)
+    assert files > 1
+    assert sorted(document['url'] for document in documents) == [f'https://example.com/user{i}' for i in range(10)]
+    assert all('updated_at' in document for document in documents)
+    assert sorted(done) == list(range(10))
+
+
+def test_callbacks_run_once_the_documents_are_written(tmp_path):
+    done = []
+    sink = JsonlSink(str(tmp_path), batch_documents=100, max_interval=float('inf'))
+    sink.add('profiles', [{'url': 'https://example.com/anna'}], 'url', on_flush=lambda: done.append('anna'))
+    assert done == [] and read_lines(tmp_path) == ([], 0)
+    sink.close()
+    assert done == ['anna'] and len(read_lines(tmp_path)[0]) == 1
+
+
+def test_a_failed_write_keeps_its_documents_and_callbacks(tmp_path):
+    done = []
+    sink = JsonlSink(str(tmp_path), batch_documents=100, max_interval=float('inf'))
+    write, failures = sink._write, ['images']
+
+    def flaky(collection, documents):
+        if collection in failures:
+            failures.remove(collection)
+            raise OSError('disk full')
+        write(collection, documents)
+
+    sink._write = flaky
+    sink.add('profiles', [{'url': 'https://example.com/anna'}], 'url', on_flush=lambda: done.append('profiles'))
+    sink.add('images', [{'url': 'https://example.com/anna.jpg'}], 'url', on_flush=lambda: done.append('images'))
+    sink.flush()
+    assert done == ['profiles']
+    sink.close()
+    assert done == ['profiles', 'images']
+    assert len(read_lines(tmp_path)[0]) == 2
+
+
+def test_a_write_failing_every_retry_goes_to_the_dead_letter_file(tmp_path):
+    done = []
+    sink = JsonlSink(str(tmp_path / 'out'), batch_documents=100, max_interval=float('inf'),
+                     max_retries=2, dead_letter_dir=str(tmp_path / 'dead'))
+
+    def reject(collection, documents):
+        raise TypeError('does not fit the schema')
+
+    sink._write = reject
+    sink.add('images', [{'url': 'https://example.com/anna.jpg'}], 'url', on_flush=lambda: done.append('images'))
+    for _ in range(3):
+        assert done == []
+        sink.flush()
+    assert done == ['images'] and sink._count == 0
+    lines = read_lines(tmp_path / 'dead')[0]
+    assert [(line['collection'], line['filter_field'], line['document']['url']) for line in lines] == [
+        ('images', 'url', 'https://example.com/anna.jpg')
+    ]
+
+
+def test_parquet_sink_starts_a_new_file_for_added_fields(tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    with ParquetSink(str(tmp_path), batch_documents=1, max_interval=float('inf')) as sink:
+        sink.add('profiles', [{'url': 'https://example.com/anna', 'title': 'Anna'}], 'url')
+        sink.add('profiles', [{'url': 'https://example.com/bo', 'title': 'Bo'}], 'url')
+        sink.add('profiles', [{'url': 'https://example.com/eva', 'body': 'Photos'}], 'url')
+    tables = [parquet.read_table(path) for path in sorted(tmp_path.iterdir())]
+    assert [table.num_rows for table in tables] == [2, 1]
+    assert tables[1].to_pylist()[0]['body'] == 'Photos'
+    assert set(tables[1].schema.names) == {'url', 'title', 'body', 'updated_at'}
+
+
+def test_parquet_sink_dead_letters_a_batch_of_the_wrong_type(tmp_path):
+    pytest.importorskip('pyarrow')
+    sink = ParquetSink(str(tmp_path / 'out'), batch_documents=1, max_interval=float('inf'),
+                       max_retries=0, dead_letter_dir=str(tmp_path / 'dead'))
+    sink.add('profiles', [{'url': 'https://example.com/anna', 'rank': 1}], 'url')
+    sink.add('profiles', [{'url': 'https://example.com/bo', 'rank': 'first'}], 'url')
+    sink.add('profiles', [{'url': 'https://example.com/eva', 'rank': 3}], 'url')
+    sink.close()
+    assert [line['document']['url'] for line in read_lines(tmp_path / 'dead')[0]] == ['https://example.com/bo']
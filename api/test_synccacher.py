@@ -0,0 +1,58 @@
+"""Paging through the status index of the synchronous cacher."""
+from synccacher import Cacher
+
+
+class FakeJSON:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def mget(self, keys, path):
+        status = path[2:]
+        return [[self.documents[key][status]] if status in self.documents.get(key, {}) else None for key in keys]
+
+
+class FakeRedis:
+    """SSCAN pages of a fixed size over sets, and RedisJSON documents."""
+
+    def __init__(self, documents, sets):
+        self.documents = documents
+        self.sets = sets
+        self.pages = 0
+
+    def sscan(self, key, cursor=0, count=None):
+        self.pages += 1
+        members = sorted(self.sets.get(key, ()))
+        page = members[cursor:cursor + count]
+        return (cursor + count if cursor + count < len(members) else 0), page
+
+    def json(self):
+        return FakeJSON(self.documents)
+
+    def srem(self, key, *members):
+        self.sets[key].difference_update(members)
+
+
+def cacher(documents, sets):
+    cacher = Cacher('localhost', 6379, None)
+    cacher.client = FakeRedis(documents, sets)
+    return cacher
+
+
+def test_iter_by_status_pages_through_the_index():
+    documents = {f'request:{i}': {'done': [i]} for i in range(25)}
+    client_cacher = cacher(documents, {'index:status:done': set(documents)})
+    found = dict(client_cacher.iter_by_status('done', page_size=10))
+    assert found == {key: document['done'] for key, document in documents.items()}
+    assert client_cacher.client.pages == 3
+
+
+def test_iter_by_status_drops_stale_index_entries():
+    documents = {'request:1': {'done': [1]}, 'request:2': {'pending': []}}
+    sets = {'index:status:done': {'request:1', 'request:2', 'request:3'}}
+    assert list(cacher(documents, sets).iter_by_status('done')) == [('request:1', [1])]
+    assert sets['index:status:done'] == {'request:1'}
+
+
+def test_iter_by_status_without_redis_yields_nothing():
+    assert list(Cacher('localhost', 6379, None).iter_by_status('done')) == []
+    assert Cacher('localhost', 6379, None).search_by_status('done') == {}